@@ -5,12 +5,11 @@ load_dotenv()
 
 import os
 import json
-import base64
-import threading
+import asyncio
+from contextlib import asynccontextmanager
 from typing import Any
 from fastapi import FastAPI, WebSocket, Request, Form, status
 from fastapi.responses import Response
-from starlette.websockets import WebSocketState
 from twilio.http.http_client import TwilioHttpClient
 from twilio.rest import Client
 from twilio.twiml.voice_response import Connect, Stream, VoiceResponse
@@ -21,9 +20,35 @@ from src.modules.dialogue.utils.template import tts_label2text
 from src.modules.dialogue.utils.constants import TTSLabel
 from src.bridge import ASRBridge, TTSBridge, LLMBridge
 from src.bridge.dialog_bridge_with_ic import DialogBridgeWithIntentClassification
+from src.bridge.asr_bridge import get_asr_metrics, make_streaming_config
+from src.bridge.asr_stream_pool import ASRStreamPool, get_speech_client
+from src.bridge.asr_replay import ReplayASRBridge, ReplayScript
+from src.bridge.asr_gate import ASRUploadGate
+from src.bridge.tts_cache import configure_tts_cache, get_tts_cache
+from src.bridge.tts_stream import get_tts_stream_metrics
+from src.bridge.slot_audio import get_slot_audio_metrics
+from src.bridge.media_pacer import PacedMediaSender, get_media_pacer_metrics
+from src.bridge.tts_bridge import azure_synthesizer_pool
+from src.bridge.tts_worker_pool import configure_tts_worker_pool, get_tts_worker_pool
+from src.bridge.call_session import CallSession, get_call_session_metrics
+from src.modules.model_registry import (
+    DEFAULT_WARMUP_MODELS,
+    load_slot_audio,
+    load_template_media,
+    model_registry,
+)
 
 
 from src.utils.twilio_account import TwilioAccount
+from src.utils.executor import (
+    configure_streaming_executor,
+    get_blocking_executor_queue_depth,
+    get_streaming_executor_queue_depth,
+    run_blocking,
+    shutdown_blocking_executor,
+)
+from src.utils.admission import AdmissionController
+from src.utils.metrics import get_memory_usage
 from src.utils import gcs as gcs_service
 
 import logging
@@ -39,7 +64,7 @@ import pandas as pd
 load_dotenv()
 
 from src.utils import get_custom_logger
-from src.utils.firestore import FirestoreClient
+from src.utils.firestore import FirestoreClient, FirestoreEventWriter
 from src.utils.conversation_log import ConversationLogger
 
 logger = get_custom_logger(__name__)
@@ -51,7 +76,6 @@ for logger_name in logging.Logger.manager.loggerDict:
 templates_dir = Path(__file__).parent / "templates"
 templates_wav_dir = templates_dir / "wav"
 
-app = FastAPI()
 APP_URL = os.environ["APP_URL"]
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 ENV = os.getenv("ENV")
@@ -59,23 +83,224 @@ TENANT_ID = os.getenv("TENANT_ID")
 PROJECT_ID = os.getenv("PROJECT_ID")
 USE_INITIAL_ROUTING = os.getenv("USE_INITIAL_ROUTING", "false").lower() == "true"
 DEFAULT_DIALOG_PATTERN = int(os.getenv("DEFAULT_DIALOG_PATTERN", "1"))
+# Trueの場合、通話中はASRストリームを張り直さず1本のストリーム上で発話を区切る
+ASR_PERSISTENT_STREAM = os.getenv("ASR_PERSISTENT_STREAM", "false").lower() == "true"
+# ASRの実装 ("google" または、ASR_REPLAY_SCRIPTの認識結果を返す "replay")
+ASR_BACKEND = os.getenv("ASR_BACKEND", "google")
+ASR_REPLAY_SCRIPT = os.getenv("ASR_REPLAY_SCRIPT")
+# 音声の送信前に開始しておくASRストリームの数 (0の場合は使わない)
+ASR_STANDBY_STREAMS = int(os.getenv("ASR_STANDBY_STREAMS", "0"))
+# この時間 (秒) 通話がない場合は待機中のストリームを補充しない
+ASR_STANDBY_SHRINK_SEC = float(os.getenv("ASR_STANDBY_SHRINK_SEC", "60"))
+# 0より大きい場合、ASRへはこの長さ (ミリ秒, 50や100) の固定長リクエストで音声を送る
+ASR_AGGREGATION_MS = int(os.getenv("ASR_AGGREGATION_MS", "0"))
+# Trueの場合、VADで発話を検出している間だけASRへ音声を送る (ASR_PREROLL_MSだけ遡って送る)
+ASR_VAD_GATING = os.getenv("ASR_VAD_GATING", "false").lower() == "true"
+ASR_PREROLL_MS = int(os.getenv("ASR_PREROLL_MS", "300"))
+# 起動時にロードしておくリソース (VAPを使う場合は "vap" を追加する)
+WARMUP_MODELS = [
+    name
+    for name in os.getenv("WARMUP_MODELS", ",".join(DEFAULT_WARMUP_MODELS)).split(",")
+    if name
+]
+# Trueの場合、Azure TTSの合成済みの部分から20msのフレームとして送り始める
+AZURE_TTS_STREAMING = os.getenv("AZURE_TTS_STREAMING", "false").lower() == "true"
+# 1通話の応答を同時に合成する数 (2以上の場合、応答の最初の文を分けて先に合成する。既定では分けない)
+TTS_MAX_PARALLEL = int(os.getenv("TTS_MAX_PARALLEL", "1"))
+# 合成した音声のキャッシュ (TTS_CACHE_DIRを指定した場合はディスクにも保存し、ワーカー間で共有する)
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR")
+TTS_CACHE_MAX_MB = int(os.getenv("TTS_CACHE_MAX_MB", "256"))
+TTS_CACHE_MEMORY_ITEMS = int(os.getenv("TTS_CACHE_MEMORY_ITEMS", "256"))
+# Trueの場合、録音済みの音声がないテンプレート発話を起動時にAzure TTSで合成してキャッシュする
+TEMPLATE_AUDIO_SYNTHESIZE = os.getenv("TEMPLATE_AUDIO_SYNTHESIZE", "false").lower() == "true"
+# 全通話のTTS合成を実行する共有ワーカープールのスレッド数と、Azure TTSの同時合成数 (接続数) の上限
+TTS_WORKERS = int(os.getenv("TTS_WORKERS", "16"))
+AZURE_TTS_CONCURRENCY = int(os.getenv("AZURE_TTS_CONCURRENCY", "8"))
+# Trueの場合、ボットの音声を実時間に合わせて一定長のフレームで送り、バージイン時はフレーム単位で止める
+TTS_PACED_OUTPUT = os.getenv("TTS_PACED_OUTPUT", "false").lower() == "true"
+TTS_FRAME_MS = int(os.getenv("TTS_FRAME_MS", "20"))
+# 再生時刻よりどれだけ先に送るか (バージインで止めたときにTwilio側で捨てられる長さ)
+TTS_LEAD_MS = int(os.getenv("TTS_LEAD_MS", "100"))
+TTS_MARK_INTERVAL_MS = int(os.getenv("TTS_MARK_INTERVAL_MS", "500"))
+# Trueの場合、確認の発話を起動時に合成した断片 (月日・時刻・人数・定型句) をつないで作る
+SLOT_AUDIO_ENGINE = os.getenv("SLOT_AUDIO_ENGINE", "false").lower() == "true"
+# ワーカーあたりの同時通話数の上限 (0の場合はイベントループの遅延のみで受付を判定する)
+MAX_CONCURRENT_CALLS = int(os.getenv("MAX_CONCURRENT_CALLS", "0"))
+# イベントループの遅延がこの値 (ミリ秒) を超えている間は新規通話を受け付けない
+MAX_LOOP_LAG_MS = float(os.getenv("MAX_LOOP_LAG_MS", "100"))
+# 受け付けられない通話の転送先 (未設定の場合は話し中として拒否する)
+OVERFLOW_PHONE_NUMBER = os.getenv("OVERFLOW_PHONE_NUMBER")
+
+
+def _load_template_media_with_synthesis():
+    synthesizer = TTSBridge()
+    return load_template_media(synthesize=synthesizer.synthesize)
+
+
+def _load_slot_audio():
+    synthesizer = TTSBridge()
+    return load_slot_audio(synthesize=synthesizer.synthesize_cached)
+
+
+configure_tts_cache(
+    max_memory_items=TTS_CACHE_MEMORY_ITEMS,
+    disk_dir=TTS_CACHE_DIR,
+    max_disk_bytes=TTS_CACHE_MAX_MB * 1024**2,
+)
+
+# ワーカーのスレッドは最初の合成の依頼で起動するため、pre-forkの親プロセスで作ってもよい
+configure_tts_worker_pool(
+    max_workers=TTS_WORKERS, provider_limits={TTSBridge.provider: AZURE_TTS_CONCURRENCY}
+)
+
+if TEMPLATE_AUDIO_SYNTHESIZE:
+    # pre-forkの場合も親プロセスでのwarmup時に合成されるよう、import時に登録する
+    model_registry.register("template_media", _load_template_media_with_synthesis)
+
+if SLOT_AUDIO_ENGINE:
+    # 断片は数百件あるため、TTS_CACHE_DIRを指定して再起動やワーカー間で合成結果を共有するとよい
+    model_registry.register("slot_audio", _load_slot_audio)
+    if "slot_audio" not in WARMUP_MODELS:
+        WARMUP_MODELS.append("slot_audio")
+
+if MAX_CONCURRENT_CALLS > 0:
+    # ASRのストリームは通話ごとに1つ (再起動中は新旧の2つ) スレッドを占有する
+    configure_streaming_executor(max_workers=2 * MAX_CONCURRENT_CALLS)
+
+admission_controller = AdmissionController(
+    max_calls=MAX_CONCURRENT_CALLS, max_loop_lag=MAX_LOOP_LAG_MS / 1000
+)
+
+# 対話イベントをまとめて書き込むプロセス内共有のライター (起動時に生成)
+event_writer: FirestoreEventWriter | None = None
+# 待機中のASRストリームのプール (ASR_STANDBY_STREAMS > 0 の場合に起動時に生成)
+asr_stream_pool: ASRStreamPool | None = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global event_writer, asr_stream_pool
+    # 通話ごとにモデルをロードしないよう、サーバ起動時に一度だけロードする
+    model_registry.warmup(WARMUP_MODELS)
+    logger.info(f"Model registry: {model_registry.report()}")
+    event_writer = FirestoreEventWriter(FirestoreClient().client)
+    event_writer.start()
+    admission_controller.start()
+    if ASR_BACKEND == "google":
+        # gRPCチャネルを最初の通話の前に用意しておく
+        get_speech_client()
+        if ASR_STANDBY_STREAMS > 0:
+            asr_stream_pool = ASRStreamPool(
+                make_streaming_config(),
+                size=ASR_STANDBY_STREAMS,
+                shrink_after_seconds=ASR_STANDBY_SHRINK_SEC,
+            )
+            asr_stream_pool.start()
+    yield
+    if asr_stream_pool is not None:
+        asr_stream_pool.stop()
+    await admission_controller.stop()
+    event_writer.stop()
+    get_tts_worker_pool().shutdown()
+    shutdown_blocking_executor(wait=False)
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.get("/models")
+async def models():
+    report = model_registry.report()
+    if model_registry.is_loaded("template_media"):
+        report["template_media"]["cache"] = model_registry.get("template_media").report()
+    return report
+
+
+@app.get("/metrics")
+async def metrics():
+    return {
+        "pid": os.getpid(),
+        "memory": get_memory_usage(),
+        "call_session": get_call_session_metrics(),
+        "asr": get_asr_metrics(),
+        "tts_cache": get_tts_cache().get_metrics(),
+        "tts_stream": get_tts_stream_metrics(),
+        "slot_audio": get_slot_audio_metrics(),
+        "media_pacer": get_media_pacer_metrics(),
+        "tts_worker_pool": {
+            **get_tts_worker_pool().get_metrics(),
+            "azure_synthesizers": azure_synthesizer_pool.get_metrics(),
+        },
+        "asr_stream_pool": asr_stream_pool.get_metrics() if asr_stream_pool else {},
+        "firestore_event_writer": event_writer.get_metrics() if event_writer else {},
+    }
 
-async def get_from_phone_number(client: Client, call_sid: str) -> str:
-    call = client.calls(call_sid).fetch()
-    return call._from
+
+@app.get("/load")
+async def load():
+    load = admission_controller.get_load()
+    load["queue_depths"]["blocking_executor"] = get_blocking_executor_queue_depth()
+    load["queue_depths"]["asr_stream_executor"] = get_streaming_executor_queue_depth()
+    load["queue_depths"]["firestore_event_writer"] = (
+        event_writer.queue_depth if event_writer else 0
+    )
+    return load
 
 
-async def get_to_phone_number(client: Client, call_sid: str) -> str:
-    call = client.calls(call_sid).fetch()
-    return call.to
+# REST APIで取得した通話の電話番号 (call_sid -> (from, to)) のキャッシュ
+_call_phone_numbers_cache: dict[str, tuple[str, str]] = {}
+CALL_PHONE_NUMBERS_CACHE_SIZE = 1024
 
 
+def _fetch_call_phone_numbers(client: Client, call_sid: str) -> tuple[str, str]:
+    if call_sid not in _call_phone_numbers_cache:
+        call = client.calls(call_sid).fetch()
+        if len(_call_phone_numbers_cache) >= CALL_PHONE_NUMBERS_CACHE_SIZE:
+            _call_phone_numbers_cache.pop(next(iter(_call_phone_numbers_cache)))
+        _call_phone_numbers_cache[call_sid] = (call._from, call.to)
+    return _call_phone_numbers_cache[call_sid]
+
+
+async def get_call_phone_numbers(
+    start: dict, client: Client, call_sid: str
+) -> tuple[str, str]:
+    """発信元・発信先の電話番号を取得する
+
+    /twimlで<Stream>のカスタムパラメータとして渡したFrom/Toをstartイベントから読む。
+    パラメータがない場合のみ、Twilio REST APIで通話を1回だけ取得する (イベントループ外で実行)。
+
+    Returns:
+        tuple[str, str]: (顧客の電話番号, 着信した電話番号)
+    """
+    parameters = start.get("customParameters", {})
+    if parameters.get("From") and parameters.get("To"):
+        return parameters["From"], parameters["To"]
+
+    logger.info("Stream parameters do not include From/To. Fetching call via REST API")
+    return await run_blocking(_fetch_call_phone_numbers, client, call_sid)
+
 
 @app.post("/twiml")
-async def twiml():
+async def twiml(request: Request):
+    form = await request.form()
     response = VoiceResponse()
+    if not admission_controller.try_admit(form.get("CallSid", "")):
+        # 処理能力を超える通話は受け付けず、既存の通話のターン遅延を守る
+        if OVERFLOW_PHONE_NUMBER:
+            response.dial(OVERFLOW_PHONE_NUMBER)
+        else:
+            response.reject(reason="busy")
+        return Response(
+            content=str(response),
+            status_code=200,
+            headers={"Content-Type": "text/html"},
+        )
     connect = Connect()
     stream = Stream(url=f"wss://{APP_URL}/ws")
+    # startイベントで電話番号を受け取れるようにし、通話開始時のREST API呼び出しを省く
+    for name in ("From", "To"):
+        if form.get(name):
+            stream.parameter(name=name, value=form[name])
     # response.say("お電話ありがとうございます。SHIFT渋谷店でございます。お電話のご用件をお話しください。", voice="alice", language="ja-JP")
 
     connect.append(stream)
@@ -108,9 +333,7 @@ async def init_conversation_events(firestore_client, call_sid, customer_phone_nu
     tenant_ref = firestore_client.get_tenant_ref(env, tenant_id)
     logger.info("Tenant ref: %s", tenant_ref.path)
 
-    customer_ref = firestore_client.create_customer(
-        tenant_ref, customer_id, customer_data
-    )
+    customer_ref = firestore_client.get_customer_ref(tenant_ref, customer_id)
     logger.info("Customer ref: %s", customer_ref.path)
 
     # プロジェクトの参照を取得
@@ -140,13 +363,57 @@ async def init_conversation_events(firestore_client, call_sid, customer_phone_nu
         },
         "reading_form": {},
     }
+    # 参照が決まった時点で、それまでに保留していた対話イベントが書き込まれる
     firestore_client.set_conversation_ref(project_ref, conversation_id)
-    firestore_client.create_conversation(conversation_data)
+    # 顧客ドキュメントと対話ドキュメントの作成は互いに依存しないため並行して実行する
+    await asyncio.gather(
+        run_blocking(
+            firestore_client.create_customer, tenant_ref, customer_id, customer_data
+        ),
+        run_blocking(firestore_client.create_conversation, conversation_data),
+    )
     logger.info("Conversation ref: %s", firestore_client.conversation_ref.path)
 
     return firestore_client
 
 
+async def bootstrap_conversation(
+    start: dict, client: Client, call_sid: str, firestore_client: FirestoreClient
+) -> str:
+    """電話番号の取得と対話ドキュメントの作成を行う (初期発話の再生と並行して実行する)
+
+    Returns:
+        str: 顧客の電話番号
+    """
+    customer_phone_number, aim_phone_number = await get_call_phone_numbers(
+        start, client, call_sid
+    )
+    logger.info(
+        f"aim_phone_number: {aim_phone_number}, customer_phone_number: {customer_phone_number}"
+    )
+    await init_conversation_events(firestore_client, call_sid, customer_phone_number)
+    return customer_phone_number
+
+
+async def wait_bootstrap(bootstrap_task: asyncio.Task, firestore_client: FirestoreClient) -> str | None:
+    """バックグラウンドの初期化の完了を待つ
+
+    Returns:
+        str | None: 顧客の電話番号 (初期化に失敗した場合はNone)
+    """
+    try:
+        return await bootstrap_task
+    except Exception as e:
+        logger.error(f"Failed to bootstrap conversation: {e}", exc_info=True)
+        if firestore_client.num_pending_events:
+            # 対話ドキュメントの参照が決まらなかったため、書き込み先がない
+            logger.error(
+                f"Dropped {firestore_client.num_pending_events} conversation events "
+                "because the conversation document was not created"
+            )
+        return None
+
+
 def get_gcs_path_from_params(subdomain: str, project_id: str, customer_phone_number: str, call_sid: str) -> str:
     """
     URLパラメータからGCSパスを構築する
@@ -227,6 +494,19 @@ def delete_twilio_call_recording(
         return None
 
 
+def make_asr_bridge_factory():
+    """通話ごとのASRの生成関数を返す (ターンごとにASRを作り直す場合も同じ関数を使う)"""
+    if ASR_BACKEND == "replay":
+        # スクリプトの音声時刻は通話内で引き継ぐ
+        script = ReplayScript.load(ASR_REPLAY_SCRIPT)
+        return lambda: ReplayASRBridge(script, persistent=ASR_PERSISTENT_STREAM)
+    return lambda: ASRBridge(
+        persistent=ASR_PERSISTENT_STREAM,
+        aggregation_ms=ASR_AGGREGATION_MS,
+        stream_pool=asr_stream_pool,
+    )
+
+
 @app.websocket("/ws")
 async def websocket_endpoint(ws: WebSocket):
     logger.info("WS connection opened")
@@ -242,24 +522,6 @@ async def websocket_endpoint(ws: WebSocket):
     data = await ws.receive_json()
     logger.info(f"Media WS: Received event '{data['event']}': {data}")
 
-    asr_bridge = ASRBridge()
-    tts_bridge = TTSBridge()
-
-    t_tts = threading.Thread(target=tts_bridge.response_loop)
-
-    t_tts.start()
-
-    import asyncio
-
-    def start_async_loop(loop):
-        asyncio.set_event_loop(loop)
-        loop.run_forever()
-
-    # 新しいイベントループを作成し、それを別のスレッドで実行
-    new_loop = asyncio.new_event_loop()
-    t_loop = threading.Thread(target=start_async_loop, args=(new_loop,))
-    t_loop.start()
-
     stream_sid = data["start"]["streamSid"]
     call_sid = data["start"]["callSid"]
     account_sid = data["start"]["accountSid"]
@@ -270,116 +532,86 @@ async def websocket_endpoint(ws: WebSocket):
     auth_token = twilio_account.auth_token
     custom_client = TwilioHttpClient(max_retries=3)
     client = Client(account_sid, auth_token, http_client=custom_client)
-    aim_phone_number = await get_to_phone_number(client, call_sid)
-    customer_phone_number = await get_from_phone_number(client, call_sid)
-    logger.info(
-        f"aim_phone_number: {aim_phone_number}, customer_phone_number: {customer_phone_number}"
-    )
-    
+
+    # 初期発話を最優先で流し、Firestoreへの初期化処理はバックグラウンドで実行する
     conversation_logger = ConversationLogger(call_sid)
-    logger.info(f"Conversation logger created {conversation_logger}")
-    gcs_conversation_log_path = get_gcs_path_from_params(
-        subdomain=os.environ.get("TENANT_SUBDOMAIN"),
-        project_id=PROJECT_ID,
-        customer_phone_number=customer_phone_number.replace('+', ''),
-        call_sid=call_sid
-    ) + "/conversation_log"
-
-
-    recording_callback_url = f"https://{APP_URL}/recording/twilio2gcs?project_id={PROJECT_ID}&tenant_id={TENANT_ID}&customer_phone_number={customer_phone_number.replace('+', '')}#rc=2&rp=all"
-    # client.calls(call_sid).recordings.create(
-    #     recording_status_callback=recording_callback_url,
-    #     recording_status_callback_method="POST",
-    #     recording_channels="dual",
-    # )
-
-    firestore_client = FirestoreClient()
-    firestore_client = await init_conversation_events(
-        firestore_client, call_sid, customer_phone_number
+    firestore_client = FirestoreClient(event_writer=event_writer)
+    tts_bridge = TTSBridge(
+        streaming=AZURE_TTS_STREAMING,
+        max_parallel=TTS_MAX_PARALLEL,
+        worker_pool=get_tts_worker_pool(),
     )
-
-    tts_bridge.set_connect_info(stream_sid)
-    logger.info("Set connect info")
-
-    dialog_bridge = DialogBridgeWithIntentClassification()
-    dialog_bridge.set_stream_sid(stream_sid)
-
-    #####################################
-    
-    tts_bridge.add_response(dialog_bridge.get_initial_message())
-
-    await dialog_bridge.send_tts(ws, tts_bridge, firestore_client, conversation_logger)
-    threading.Thread(target=asr_bridge.start).start()
-
-    is_finished = False
-    while ws.application_state == WebSocketState.CONNECTED:
-        data = await ws.receive_json()
-
-        if data["event"] == "stop":
-            logger.info(f"Media WS: Received event 'stop': {data}")
-            break
-
-        elif data["event"] == "media":
-            media = data["media"]
-            chunk = base64.b64decode(media["payload"])
-            asr_bridge.add_request(chunk)
-            dialog_bridge.vad_step(chunk)
-            out = await dialog_bridge(
-                ws,
-                asr_bridge,
-                tts_bridge,
-                firestore_client=firestore_client,
-                conversation_logger=conversation_logger,
-            )
-
-            if out["asr_done"]:
-                logger.info("ASR done")
-                asr_bridge.terminate()
-                asr_bridge = ASRBridge()
-                threading.Thread(target=asr_bridge.start).start()
-                logger.info("Restarted asr bridge")
-
-            # if out["bot_speak"]:
-            #     asr_bridge.set_bot_speak(True)
-
-        elif data["event"] == "mark" and data["mark"]["name"] == "continue":
-            logger.info(f"Media WS: Received event 'mark': {data}")
-            logger.info("Bot: Speaking is done")
-            asr_bridge.reset()
-            dialog_bridge.bot_speak = False
-            # 暗黙確認時にのみバージインを許可するため、botが話し終わったタイミングでバージインを毎回オフにする
-            dialog_bridge.allow_barge_in = False
-            logger.info("set allow_barge_in to False")
-            if is_finished or (dialog_bridge.dialogue_system.is_complete() and tts_bridge.is_empty):
-                break
-        elif data["event"] == "mark" and data["mark"]["name"] == "finish":
-            is_finished = True
-        else:
-            raise "Media WS: Received unknown event"
-
-    logger.info("Media WS: Connection closed")
-    asr_bridge.terminate()
-    # t_tts.join()
+    media_pacer = (
+        PacedMediaSender(TTS_FRAME_MS, TTS_LEAD_MS, TTS_MARK_INTERVAL_MS) if TTS_PACED_OUTPUT else None
+    )
+    dialog_bridge = DialogBridgeWithIntentClassification(media_pacer=media_pacer)
+    session = CallSession(
+        ws,
+        stream_sid,
+        dialog_bridge,
+        tts_bridge,
+        firestore_client,
+        conversation_logger,
+        asr_bridge_factory=make_asr_bridge_factory(),
+        asr_gate=ASRUploadGate(preroll_ms=ASR_PREROLL_MS) if ASR_VAD_GATING else None,
+    )
+    bootstrap_task = asyncio.create_task(
+        bootstrap_conversation(data["start"], client, call_sid, firestore_client)
+    )
+    admission_controller.register(call_sid, session)
+    try:
+        await session.start()
+        await session.run()
+    finally:
+        admission_controller.unregister(call_sid)
+        # 通話の処理で例外が発生した場合も、バックグラウンドの初期化を待ってから終了する
+        customer_phone_number = await wait_bootstrap(bootstrap_task, firestore_client)
+        # この通話のイベントを書き込み終えてから通話を終了する
+        await asyncio.wrap_future(firestore_client.flush_events())
+
+    if customer_phone_number is not None:
+        gcs_conversation_log_path = get_gcs_path_from_params(
+            subdomain=os.environ.get("TENANT_SUBDOMAIN"),
+            project_id=PROJECT_ID,
+            customer_phone_number=customer_phone_number.replace('+', ''),
+            call_sid=call_sid
+        ) + "/conversation_log"
+
+        recording_callback_url = f"https://{APP_URL}/recording/twilio2gcs?project_id={PROJECT_ID}&tenant_id={TENANT_ID}&customer_phone_number={customer_phone_number.replace('+', '')}#rc=2&rp=all"
+        # client.calls(call_sid).recordings.create(
+        #     recording_status_callback=recording_callback_url,
+        #     recording_status_callback_method="POST",
+        #     recording_channels="dual",
+        # )
+    else:
+        # 電話番号が分からずGCSのパスを作れないため、対話ログはローカルにのみ保存する
+        gcs_conversation_log_path = None
+        conversation_logger.to_csv(f"{call_sid}_conversation_log.csv")
 
     logger.info("WS connection completedly closed")
     # disconnect twilio call
     try:
-        client.calls(call_sid).update(
+        await run_blocking(
+            client.calls(call_sid).update,
             twiml=twiml,
             status=CallInstance.UpdateStatus.COMPLETED,
         )
-        await conversation_logger.save_conversation_log_to_gcs(gcs_conversation_log_path)
-        conversation_logger.to_csv(f"{gcs_conversation_log_path.replace('/', '_')}.csv")
+        if gcs_conversation_log_path is not None:
+            await conversation_logger.save_conversation_log_to_gcs(gcs_conversation_log_path)
+            conversation_logger.to_csv(f"{gcs_conversation_log_path.replace('/', '_')}.csv")
         
     except twilio_exceptions.TwilioRestException as e:
         logger.warning(f"Could not update CallContext because '{e}'")
     except http.client.RemoteDisconnected as e:
         logger.warning(f"Updating CallContext is RemoteDisconnected. Error is '{e}'")
         try:
-            client.calls(call_sid).update(
-                twiml=twiml, status=CallInstance.UpdateStatus.COMPLETED
+            await run_blocking(
+                client.calls(call_sid).update,
+                twiml=twiml,
+                status=CallInstance.UpdateStatus.COMPLETED,
             )
-            await conversation_logger.save_conversation_log_to_gcs(gcs_conversation_log_path)
+            if gcs_conversation_log_path is not None:
+                await conversation_logger.save_conversation_log_to_gcs(gcs_conversation_log_path)
         except http.client.RemoteDisconnected as e:
             logger.error(
                 f"Updating CallContext is twice RemoteDisconnected. Error is '{e}'"
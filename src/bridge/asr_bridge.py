@@ -1,41 +1,341 @@
+import os
 import queue
+import threading
 import time
+from abc import ABC, abstractmethod
+from collections import deque
+from dataclasses import dataclass
 from google.api_core.exceptions import GoogleAPICallError, RetryError, OutOfRange
 from google.cloud import speech
 from google.cloud.speech import RecognitionConfig, StreamingRecognitionConfig
+from src.bridge.asr_latency import ASRLatencyTracker, get_asr_latency_metrics
+from src.bridge.asr_stream_pool import get_speech_client
 from src.utils import get_custom_logger
+from src.utils.bounded_queue import BoundedQueue, OverflowPolicy
+from src.utils.metrics import LatencyHistogram
 
 logger = get_custom_logger(__name__)
 
 MODEL = "latest_long"
 MAX_RETRIES = 3
 RETRY_INTERVAL = 5  # seconds
+# Google STTのストリーミング認識は約5分で切断されるため、その手前でストリームを張り替える
+STREAM_ROTATION_SECONDS = 270  # 発話の切れ目であればこの時間以降に張り替える
+STREAM_MAX_SECONDS = 290  # 発話中でもこの時間を超えたら張り替える
+# 音声が届かない間 (VADゲートで送らない無音区間など) も、この間隔で張り替えを判定する
+ROTATION_CHECK_INTERVAL = 0.5
+# 8kHz μ-law (1サンプル1バイト)
+BYTES_PER_SECOND = 8000
+# ASRへ未送信の音声チャンク (20ms) の上限。ストリームが詰まった場合は古い音声から捨てる
+QUEUE_MAX_CHUNKS = 100
 
+def make_streaming_config() -> StreamingRecognitionConfig:
+    config = RecognitionConfig(
+        model=MODEL,
+        encoding=RecognitionConfig.AudioEncoding.MULAW,
+        sample_rate_hertz=8000,
+        language_code="ja-JP",
+    )
+    return StreamingRecognitionConfig(
+        config=config,
+        interim_results=True,
+        single_utterance=False,
+    )
 
-class ASRBridge:
-    def __init__(self, stability_threshold=1.0):
-        self._queue = queue.Queue()
-        self._ended = False
-        self.stability = 0
+
+# 全通話共通: 音声を受け取ってからASRへ送るまでの待ち時間
+asr_queue_wait_histogram = LatencyHistogram()
+
+
+def get_asr_metrics() -> dict:
+    return {
+        "queue_wait_sec": asr_queue_wait_histogram.summary(),
+        "latency": get_asr_latency_metrics(),
+    }
+
+
+class AudioAggregator:
+    """受け取った音声を事前に確保したリングバッファに溜め、固定長のリクエストとして取り出す
+
+    書き込み (add) は受信側、読み出し (get) はASRのリクエスト生成スレッドから呼ばれる。
+    読み出しが追いつかずバッファが一杯になった場合は、古い音声から捨てる。
+    """
+
+    def __init__(self, request_ms: int, buffer_seconds: float = 2.0):
+        """
+        Args:
+            request_ms (int): 1リクエストあたりの音声の長さ (ミリ秒)
+            buffer_seconds (float): リングバッファに保持できる音声の長さ (秒)
+        """
+        self.request_bytes = BYTES_PER_SECOND * request_ms // 1000
+        capacity = max(int(BYTES_PER_SECOND * buffer_seconds), self.request_bytes)
+        self._buffer = bytearray(capacity)
+        self._view = memoryview(self._buffer)
+        # 書き込み・読み出し済みのバイト数の累計 (位置は容量で割った余り)
+        self._written = 0
+        self._read = 0
+        # (書き込み後の累計バイト数, 書き込んだ時刻): 待ち時間の計測用
+        self._timestamps: deque[tuple[int, float]] = deque()
+        self._closed = False
+        self._cond = threading.Condition()
+
+        self.num_dropped_bytes = 0
+
+    @property
+    def capacity(self) -> int:
+        return len(self._buffer)
+
+    @property
+    def buffered_bytes(self) -> int:
+        return self._written - self._read
+
+    def add(self, chunk: bytes):
+        with self._cond:
+            size = len(chunk)
+            if size > self.capacity:
+                chunk = chunk[-self.capacity :]
+                self.num_dropped_bytes += size - self.capacity
+                self._read += size - self.capacity
+                self._written += size - self.capacity
+                size = self.capacity
+            overflow = self.buffered_bytes + size - self.capacity
+            if overflow > 0:
+                self._read += overflow
+                self.num_dropped_bytes += overflow
+
+            start = self._written % self.capacity
+            first = min(size, self.capacity - start)
+            self._buffer[start : start + first] = chunk[:first]
+            self._buffer[: size - first] = chunk[first:]
+            self._written += size
+            self._timestamps.append((self._written, time.monotonic()))
+            if self.buffered_bytes >= self.request_bytes:
+                self._cond.notify()
+
+    def get(self, timeout: float | None = None) -> tuple[bytes, float] | None:
+        """1リクエスト分の音声が溜まるまで待って取り出す
+
+        Returns:
+            tuple[bytes, float] | None: (音声, 先頭の音声の待ち時間)。
+                タイムアウトまたはclose()された場合はNone
+        """
+        with self._cond:
+            if not self._cond.wait_for(
+                lambda: self._closed or self.buffered_bytes >= self.request_bytes, timeout
+            ):
+                return None
+            if self._closed:
+                return None
+
+            while self._timestamps and self._timestamps[0][0] <= self._read:
+                self._timestamps.popleft()
+            waited = time.monotonic() - self._timestamps[0][1]
+
+            start = self._read % self.capacity
+            first = min(self.request_bytes, self.capacity - start)
+            data = bytes(self._view[start : start + first]) + bytes(
+                self._view[: self.request_bytes - first]
+            )
+            self._read += self.request_bytes
+            return data, waited
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+@dataclass(frozen=True)
+class HypothesisEvent:
+    """ASRの認識結果1件分のイベント
+
+    transcript = stable_prefix + unstable_tail で、stable_prefixは
+    以降の認識結果で書き換わらないとみなせる部分。
+    """
+    revision: int
+    stable_prefix: str
+    unstable_tail: str
+    is_final: bool
+    stability: float
+    received_at: float  # time.monotonic()
+    audio_offset: float | None = None  # ストリーム先頭からの音声の時刻 (秒, 取得できる場合)
+
+    @property
+    def transcript(self) -> str:
+        return self.stable_prefix + self.unstable_tail
+
+
+class StablePrefixTracker:
+    """直近の途中結果の共通接頭辞とstabilityから、確定とみなせる接頭辞を求める
+
+    同じ発話の中では、確定済みの接頭辞は短くならない
+    (新しい結果が確定済みの接頭辞から始まらない場合のみ短くなる)。
+    """
+
+    def __init__(self, window: int = 3, stability_threshold: float = 0.8):
+        """
+        Args:
+            window (int): 共通接頭辞を取る途中結果の数
+            stability_threshold (float): このstability以上の途中結果は全体を確定とみなす
+        """
+        self.window = window
+        self.stability_threshold = stability_threshold
+        self.reset()
+
+    def reset(self):
+        self._recent: deque[str] = deque(maxlen=self.window)
+        self._stable = ""
+
+    def update(self, transcript: str, stability: float, is_final: bool) -> str:
+        """認識結果を追加し、確定とみなせる接頭辞を返す"""
+        if is_final or stability >= self.stability_threshold:
+            stable = transcript
+        else:
+            self._recent.append(transcript)
+            # 途中結果が1つだけの間は、どこまで確定しているか分からない
+            stable = os.path.commonprefix(list(self._recent)) if len(self._recent) > 1 else ""
+        if transcript.startswith(self._stable) and len(self._stable) > len(stable):
+            stable = self._stable
+        if is_final:
+            self._recent.clear()
+        self._stable = stable
+        return stable
+
+
+class BaseASRBridge(ABC):
+    """CallSession・DialogBridgeから使うASRの共通インターフェース
+
+    start()は共有Executorで実行され、認識が終わるまでブロックしてよい。
+    認識結果は transcription / is_final に反映し、_publish_hypothesis() で
+    HypothesisEventとして公開する (そのたびに revision が増える)。
+    """
+
+    # hypotheses_since() で参照できるイベントの数
+    HYPOTHESIS_HISTORY = 32
+
+    def __init__(self, persistent=False):
+        self.persistent = persistent
         self.transcription = ""
         self.is_final = False
-
+        # 認識結果を受け取る・リセットするたびに増える番号 (結果の変化の検知に使う)
+        self.revision = 0
         self.bot_speak = False
+        self.latest_hypothesis: HypothesisEvent | None = None
+        self._hypotheses: deque[HypothesisEvent] = deque(maxlen=self.HYPOTHESIS_HISTORY)
+        self._prefix_tracker = StablePrefixTracker()
+        # 通話単位でASRの遅延を記録する場合にCallSessionが設定する
+        self.latency_tracker: ASRLatencyTracker | None = None
+
+    def _publish_hypothesis(
+        self, stability: float = 0.0, audio_offset: float | None = None
+    ) -> HypothesisEvent:
+        """現在の transcription / is_final をイベントとして公開する"""
+        self.revision += 1
+        stable_prefix = self._prefix_tracker.update(
+            self.transcription, stability, self.is_final
+        )
+        event = HypothesisEvent(
+            revision=self.revision,
+            stable_prefix=stable_prefix,
+            unstable_tail=self.transcription[len(stable_prefix):],
+            is_final=self.is_final,
+            stability=stability,
+            received_at=time.monotonic(),
+            audio_offset=audio_offset,
+        )
+        self._hypotheses.append(event)
+        self.latest_hypothesis = event
+        if self.latency_tracker is not None:
+            self.latency_tracker.on_result(self.is_final, audio_offset)
+        return event
+
+    def _clear_hypotheses(self):
+        """発話の区切りで、以降の認識結果を新しい発話として扱う"""
+        self.revision += 1
+        self._prefix_tracker.reset()
+        self.latest_hypothesis = None
+
+    def hypotheses_since(self, revision: int) -> list[HypothesisEvent]:
+        """revisionより後に公開されたイベントを古い順に返す"""
+        return [event for event in list(self._hypotheses) if event.revision > revision]
+
+    @abstractmethod
+    def start(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def add_request(self, buffer):
+        raise NotImplementedError
+
+    def skip_audio(self, num_bytes: int):
+        """VADゲートによりASRへ送らなかった音声の長さを受け取る
+
+        Google STTの結果の時刻は送った音声の時刻のため、何もしない。
+        受け取った音声の長さを時刻として使うASR (リプレイ) は、ここで時刻を進める。
+        """
+
+    @abstractmethod
+    def terminate(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def end_utterance(self):
+        """現在の発話を確定し、以降の認識結果を次の発話として扱う"""
+        raise NotImplementedError
+
+    def reset(self):
+        self.transcription = ""
+        self._clear_hypotheses()
+
+    def get_transcription(self):
+        return self.transcription
+
+    def set_bot_speak(self, bot_speak):
+        self.bot_speak = bot_speak
+
+    @property
+    def queue_depth(self) -> int:
+        return 0
+
+
+class ASRBridge(BaseASRBridge):
+    """Google Speech-to-Textのストリーミング認識を使うASR"""
+
+    def __init__(
+        self, stability_threshold=1.0, persistent=False, aggregation_ms=0, stream_pool=None
+    ):
+        """
+        Args:
+            stability_threshold (float): この値を超えるstabilityの結果でストリームを終了する
+            persistent (bool): Trueの場合、通話中は1本のストリームを使い続け、
+                発話はend_utterance()で区切る (ストリームは上限時間の手前で張り替える)
+            aggregation_ms (int): 0より大きい場合、音声をこの長さ (50msや100ms) ずつまとめて送る。
+                0の場合は溜まっている音声をすべてまとめて送る
+            stream_pool (ASRStreamPool): 指定した場合、事前に開始しておいたストリームを使う
+        """
+        super().__init__(persistent)
+        self._queue = BoundedQueue(QUEUE_MAX_CHUNKS, OverflowPolicy.DROP_OLDEST)
+        self._aggregator = AudioAggregator(aggregation_ms) if aggregation_ms > 0 else None
+        self.num_requests = 0
+        self.num_request_bytes = 0
+        self._ended = False
+        self.stability = 0
+
+        self._lock = threading.Lock()
+        self._stream_started_at = time.monotonic()
+        # 現在のストリーム上のセグメント (is_finalまで) の認識結果
+        self._segment_transcript = ""
+        # end_utterance()で消費済みだが、まだis_finalが届いていないセグメントの文字列
+        self._consumed_prefix = ""
+        # 発話途中でストリームを張り替えた場合に、前のストリームから引き継ぐ文字列
+        self._carry_text = ""
+
         self.stability_threshold = stability_threshold
         self.stability_count = 0
         self.stability_count_threshold = 2
 
-        config = RecognitionConfig(
-            model="latest_long",
-            encoding=RecognitionConfig.AudioEncoding.MULAW,
-            sample_rate_hertz=8000,
-            language_code="ja-JP",
-        )
-        self.streaming_config = StreamingRecognitionConfig(
-            config=config,
-            interim_results=True,
-            single_utterance=False,
-        )
+        self.streaming_config = make_streaming_config()
+        self.stream_pool = stream_pool
 
     def start(self):
         logger.info("ASR bridge started")
@@ -48,6 +348,7 @@ class ASRBridge:
                 self._run()
                 break
             except (OutOfRange, GoogleAPICallError, RetryError) as e:
+                self._on_stream_closed()
                 logger.error(
                     f"Error occurred: {e}. Retrying in {RETRY_INTERVAL} seconds..."
                 )
@@ -57,67 +358,191 @@ class ASRBridge:
             logger.error("Maximum retry attempts reached. Terminating...")
             self.terminate()
 
-    def _run(self):
-        client = speech.SpeechClient()
-        stream = self.generator()
+    def _open_stream(self, audio):
+        """ストリーミング認識を開始する (プールに待機中のストリームがあればそれを使う)"""
+        if self.stream_pool is not None:
+            standby = self.stream_pool.acquire()
+            if standby is not None:
+                standby.attach(audio)
+                return standby.responses
         requests = (
-            speech.StreamingRecognizeRequest(audio_content=content)
-            for content in stream
+            speech.StreamingRecognizeRequest(audio_content=content) for content in audio
         )
-        responses = client.streaming_recognize(self.streaming_config, requests)
-        self.process_responses_loop(responses)
+        return get_speech_client().streaming_recognize(self.streaming_config, requests)
 
-    def set_bot_speak(self, bot_speak):
-        self.bot_speak = bot_speak
+    def _run(self):
+        while True:
+            self._stream_started_at = time.monotonic()
+            if self.latency_tracker is not None:
+                self.latency_tracker.on_stream_opened()
+            responses = self._open_stream(self.generator())
+            out_of_range = self.process_responses_loop(responses)
+            self._on_stream_closed()
+            if self._ended:
+                break
+            if out_of_range:
+                # ストリームの上限時間を超えた場合は、再帰せずにこのループで張り直す
+                logger.error("Received OutOfRange error. Restarting ASR stream...")
+            elif not self.persistent:
+                break
+            if self.persistent:
+                self._on_stream_rotated()
+                logger.info("Rotated ASR stream")
+
+    def _should_rotate(self):
+        if not self.persistent:
+            return False
+        elapsed = time.monotonic() - self._stream_started_at
+        if elapsed >= STREAM_MAX_SECONDS:
+            return True
+        at_boundary = self.is_final or not self._segment_transcript
+        return elapsed >= STREAM_ROTATION_SECONDS and at_boundary
+
+    def _on_stream_rotated(self):
+        with self._lock:
+            # 発話の途中で張り替えた場合は、新しいストリームの結果に前半を連結する
+            self._carry_text = self.transcription
+            self._segment_transcript = ""
+            self._consumed_prefix = ""
+
+    def _on_stream_closed(self):
+        if self.latency_tracker is not None:
+            self.latency_tracker.on_stream_closed()
+
+    def _on_audio_sent(self, num_bytes, received_at):
+        self.num_requests += 1
+        self.num_request_bytes += num_bytes
+        if self.latency_tracker is not None:
+            self.latency_tracker.on_audio_sent(num_bytes, received_at)
 
     def set_stability_threshold(self, stability_threshold):
         self.stability_threshold = stability_threshold
         # logger.info(f"Set stability threshold to {self.stability_threshold}")
 
-    def get_transcription(self):
-        return self.transcription
-
     def terminate(self):
         self._ended = True
+        self._on_stream_closed()
         self._queue.put(None)
+        if self._aggregator is not None:
+            self._aggregator.close()
+
+    def end_utterance(self):
+        """現在の発話を確定し、以降の認識結果を次の発話として扱う (persistentモード用)
+
+        is_finalが届く前に呼ばれた場合、同じセグメントの後続の結果から
+        消費済みの文字列を取り除く。
+        """
+        with self._lock:
+            if self.is_final:
+                self._consumed_prefix = ""
+            else:
+                self._consumed_prefix = self._segment_transcript
+            self._carry_text = ""
+            self.transcription = ""
+            self.is_final = False
+            self._clear_hypotheses()
 
     def add_request(self, buffer):
-        self._queue.put(bytes(buffer), block=False)
+        if self._aggregator is not None:
+            self._aggregator.add(buffer)
+        else:
+            self._queue.put((bytes(buffer), time.monotonic()), block=False)
+
+    @property
+    def queue_depth(self) -> int:
+        """ASRへ未送信の音声チャンク数 (集約モードでは20ms単位に換算した値)"""
+        if self._aggregator is not None:
+            return self._aggregator.buffered_bytes // (BYTES_PER_SECOND // 50)
+        return self._queue.qsize()
 
-    def process_responses_loop(self, responses):
+    def get_metrics(self) -> dict:
+        return {
+            "num_requests": self.num_requests,
+            "request_bytes": self.num_request_bytes,
+            "dropped_bytes": (
+                self._aggregator.num_dropped_bytes
+                if self._aggregator
+                else self._queue.num_dropped * BYTES_PER_SECOND // 50
+            ),
+            "queue": self._queue.get_metrics(),
+        }
+
+    def process_responses_loop(self, responses) -> bool:
+        """ストリームの認識結果を処理する
+
+        Returns:
+            bool: ストリームがOutOfRange (上限時間の超過) で終了した場合True
+        """
         try:
             for response in responses:
                 self._on_response(response)
                 if self._ended:
                     break
         except OutOfRange:
-            logger.error("Received OutOfRange error. Restarting ASRBridge...")
-            self.run_with_retries()
+            return True
         except Exception as e:
             logger.error(f"Unexpected exception: {e}")
             self.terminate()
+        return False
 
     def generator(self):
+        if self._aggregator is not None:
+            yield from self._aggregated_generator()
+            return
         while not self._ended:
-            chunk = self._queue.get()
-            if chunk is None:
+            if self._should_rotate():
                 return
+            # 張り替えの判定のため、音声が来ない間も定期的に起きる
+            try:
+                item = self._queue.get(timeout=ROTATION_CHECK_INTERVAL)
+            except queue.Empty:
+                continue
+            if item is None:
+                return
+            chunk, received_at = item
             data = [chunk]
             while True:
                 try:
-                    chunk = self._queue.get(block=False)
-                    if chunk is None:
+                    item = self._queue.get(block=False)
+                    if item is None:
                         return
-                    data.append(chunk)
+                    data.append(item[0])
                 except queue.Empty:
                     break
-            yield b"".join(data)
+            content = b"".join(data)
+            self._on_audio_sent(len(content), received_at)
+            yield content
+        self.terminate()
+
+    def _aggregated_generator(self):
+        while not self._ended:
+            if self._should_rotate():
+                return
+            # 張り替えの判定のため、音声が来ない間も定期的に起きる
+            item = self._aggregator.get(timeout=ROTATION_CHECK_INTERVAL)
+            if item is None:
+                continue
+            content, waited = item
+            self._on_audio_sent(len(content), time.monotonic() - waited)
+            asr_queue_wait_histogram.observe(waited)
+            yield content
         self.terminate()
 
     def reset(self):
-        self.transcription = ""
+        if self.persistent:
+            self.end_utterance()
+        super().reset()
         logger.info("ASR reset in asr_bridge.py")
 
+    def _segment_text(self, transcript):
+        """セグメントの認識結果から、現在の発話に属する部分を取り出す"""
+        if self._consumed_prefix:
+            if not transcript.startswith(self._consumed_prefix):
+                # 消費済みの発話が書き換わっただけの結果は次の発話に含めない
+                return ""
+            transcript = transcript[len(self._consumed_prefix):]
+        return self._carry_text + transcript
+
     def _on_response(self, response):
 
         if not response.results:
@@ -125,16 +550,33 @@ class ASRBridge:
         result = response.results[0]
         if not result.alternatives:
             return
-        self.is_final = result.is_final
-        self.stability = result.stability
-        self.transcription = result.alternatives[0].transcript
+        with self._lock:
+            self.is_final = result.is_final
+            self.stability = result.stability
+            transcript = result.alternatives[0].transcript
+            if self.persistent:
+                self._segment_transcript = transcript
+                self.transcription = self._segment_text(transcript)
+                if self.is_final:
+                    # 次の結果は新しいセグメントになるため、確定済みの文字列は引き継いで連結する
+                    self._carry_text = self.transcription
+                    self._segment_transcript = ""
+                    self._consumed_prefix = ""
+            else:
+                self.transcription = transcript
+            result_end_time = getattr(result, "result_end_time", None)
+            self._publish_hypothesis(
+                self.stability,
+                result_end_time.total_seconds() if result_end_time is not None else None,
+            )
         if self.transcription:
             logger.info(f"ASR: {self.transcription}")
             logger.info(f"ASR stability: {self.stability}")
 
         if self.stability > self.stability_threshold:
             self.stability_count += 1
-            self.terminate()
+            if not self.persistent:
+                self.terminate()
 
         # if self.stability_count >= self.stability_count_threshold:
         # self.terminate()
@@ -0,0 +1,94 @@
+import time
+from collections import deque
+
+from src.utils import get_custom_logger
+
+logger = get_custom_logger(__name__)
+
+FRAME_SECONDS = 0.02
+
+
+class ASRUploadGate:
+    """VADで発話を検出している間だけASRへ音声を送るためのゲート
+
+    発話していない間のフレームはプリロール用のリングバッファに保持し、
+    発話の開始を検出した時点でプリロールと一緒に送るため、発話の頭は欠けない。
+    発話の終了後もhangover_msの間は送り続け、ASRが結果を確定できるようにする。
+    音声が長く届かないとGoogle STTはストリームを切断するため、閉じている間も
+    keepalive_seconds ごとに1フレームだけ送る (Twilioは無音の間もフレームを送ってくるため、
+    判定はフレームの受信時に行う)。
+
+    プリロールから押し出され、ASRへ送られなかった音声の長さは pop_skipped_bytes() で取り出す。
+    ASRへ送った音声だけが進むため、persistentモードのストリームの張り替えは音声の到着を待たずに
+    時刻で判定し (ASRBridge.generator)、音声の長さを時刻として使うASR (リプレイ) には
+    送らなかった分も skip_audio() で伝える。
+    """
+
+    def __init__(self, preroll_ms: int = 300, hangover_ms: int = 600, keepalive_seconds: float = 5.0):
+        """
+        Args:
+            preroll_ms (int): 発話の開始前に遡って送る音声の長さ (ミリ秒)
+            hangover_ms (int): 発話の終了後も送り続ける音声の長さ (ミリ秒)
+            keepalive_seconds (float): 閉じている間にフレームを送る間隔 (秒)
+        """
+        self.hangover_frames = int(hangover_ms / 1000 / FRAME_SECONDS)
+        self.keepalive_seconds = keepalive_seconds
+        self._preroll: deque[bytes] = deque(maxlen=int(preroll_ms / 1000 / FRAME_SECONDS))
+        self._open = False
+        self._silent_frames = 0
+        self._last_sent_at = time.monotonic()
+        self._skipped_bytes = 0
+
+        self.num_sent_frames = 0
+        self.num_gated_frames = 0
+
+    @property
+    def is_open(self) -> bool:
+        return self._open
+
+    def process(self, chunk: bytes, is_speech: bool) -> list[bytes]:
+        """フレームを1つ受け取り、ASRへ送るフレームを返す"""
+        if is_speech:
+            self._silent_frames = 0
+            if not self._open:
+                self._open = True
+                frames = list(self._preroll) + [chunk]
+                self._preroll.clear()
+                return self._sent(frames)
+            return self._sent([chunk])
+
+        if self._open:
+            self._silent_frames += 1
+            if self._silent_frames >= self.hangover_frames:
+                self._open = False
+            return self._sent([chunk])
+
+        if time.monotonic() - self._last_sent_at >= self.keepalive_seconds:
+            return self._sent([chunk])
+        if len(self._preroll) == self._preroll.maxlen:
+            # リングバッファから押し出されたフレームは送られない
+            self.num_gated_frames += 1
+            self._skipped_bytes += len(self._preroll[0]) if self._preroll else len(chunk)
+        self._preroll.append(chunk)
+        return []
+
+    def pop_skipped_bytes(self) -> int:
+        """前回の呼び出し以降に、ASRへ送らないことが確定した音声のバイト数を返す"""
+        skipped, self._skipped_bytes = self._skipped_bytes, 0
+        return skipped
+
+    def _sent(self, frames: list[bytes]) -> list[bytes]:
+        self.num_sent_frames += len(frames)
+        self._last_sent_at = time.monotonic()
+        return frames
+
+    @property
+    def gated_seconds(self) -> float:
+        """ASRへ送らなかった音声の長さ (秒)"""
+        return (self.num_gated_frames + len(self._preroll)) * FRAME_SECONDS
+
+    def get_metrics(self) -> dict:
+        return {
+            "sent_seconds": self.num_sent_frames * FRAME_SECONDS,
+            "gated_seconds": self.gated_seconds,
+        }
@@ -0,0 +1,200 @@
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass, field
+
+from src.utils.metrics import LatencyHistogram
+
+# 全通話共通: 発話ごとのASRの遅延
+first_partial_histogram = LatencyHistogram()  # 発話の開始 → 最初の途中結果
+final_histogram = LatencyHistogram()  # 発話の終了 → 確定結果
+final_audio_lag_histogram = LatencyHistogram()  # 確定結果の末尾の音声を受け取ってから結果が届くまで
+restart_gap_histogram = LatencyHistogram()  # ストリームの終了 → 次のストリームへの音声の送信開始
+
+
+def get_asr_latency_metrics() -> dict:
+    return {
+        "first_partial_sec": first_partial_histogram.summary(),
+        "final_sec": final_histogram.summary(),
+        "final_audio_lag_sec": final_audio_lag_histogram.summary(),
+        "restart_gap_sec": restart_gap_histogram.summary(),
+    }
+
+
+@dataclass
+class UtteranceLatency:
+    """1発話分のASRの遅延 (時刻は通話開始からの秒数)"""
+    onset_at: float | None = None  # VADで発話の開始を検出した時刻
+    first_partial_at: float | None = None
+    speech_end_at: float | None = None  # 確定結果の時点で最後に発話を検出した時刻
+    final_at: float | None = None
+    final_audio_lag: float | None = None
+    num_partials: int = 0
+    restart_gaps: list[float] = field(default_factory=list)
+
+    @property
+    def first_partial_latency(self) -> float | None:
+        if self.onset_at is None or self.first_partial_at is None:
+            return None
+        return self.first_partial_at - self.onset_at
+
+    @property
+    def final_latency(self) -> float | None:
+        if self.speech_end_at is None or self.final_at is None:
+            return None
+        return self.final_at - self.speech_end_at
+
+    def to_dict(self) -> dict:
+        return {
+            **asdict(self),
+            "first_partial_latency": self.first_partial_latency,
+            "final_latency": self.final_latency,
+        }
+
+
+class ASRLatencyTracker:
+    """1通話分のASRの遅延を発話ごとに記録する
+
+    ターンごとにASRBridgeを作り直しても記録が続くよう、CallSessionが通話ごとに1つ作り、
+    各ASRBridgeの latency_tracker に設定する。VADの結果 (on_vad) はイベントループから、
+    音声の送信・認識結果・ストリームの終了はASRのスレッドから呼ばれる。
+    """
+
+    def __init__(self, onset_silence_frames: int = 10, max_audio_marks: int = 3000):
+        """
+        Args:
+            onset_silence_frames (int): このフレーム数以上の無音の後の発話を新しい発話の開始とみなす
+            max_audio_marks (int): 音声の時刻と送信時刻の対応を保持する数 (リクエスト単位)
+        """
+        self.onset_silence_frames = onset_silence_frames
+        self._started_at = time.monotonic()
+        self._lock = threading.Lock()
+
+        self._silent_frames = onset_silence_frames
+        self._last_speech_at: float | None = None
+        self._current: UtteranceLatency | None = None
+        self.utterances: list[UtteranceLatency] = []
+
+        # 現在のストリームに送った音声の (ストリーム先頭からの終端時刻, 受信時刻)
+        self._stream_audio_seconds = 0.0
+        self._audio_marks: deque[tuple[float, float]] = deque(maxlen=max_audio_marks)
+        self._stream_closed_at: float | None = None
+        self._pending_gaps: list[float] = []
+
+    def _now(self) -> float:
+        return time.monotonic() - self._started_at
+
+    def on_vad(self, is_speech: bool):
+        """mediaフレームごとのVADの結果を記録する"""
+        with self._lock:
+            now = self._now()
+            if not is_speech:
+                self._silent_frames += 1
+                return
+            if self._silent_frames >= self.onset_silence_frames and (
+                self._current is None or self._current.num_partials > 0
+            ):
+                self._close_current()
+                self._current = UtteranceLatency(onset_at=now, restart_gaps=self._pending_gaps)
+                self._pending_gaps = []
+            self._silent_frames = 0
+            self._last_speech_at = now
+
+    def on_stream_opened(self):
+        """新しいストリームで音声の時刻を数え直す"""
+        with self._lock:
+            self._stream_audio_seconds = 0.0
+            self._audio_marks.clear()
+
+    def on_audio_sent(self, num_bytes: int, received_at: float):
+        """ストリームへ音声を送ったことを記録する
+
+        Args:
+            num_bytes (int): 送った音声のバイト数 (8kHz μ-law)
+            received_at (float): その音声の先頭を受け取った時刻 (time.monotonic())
+        """
+        with self._lock:
+            if self._stream_closed_at is not None:
+                gap = time.monotonic() - self._stream_closed_at
+                self._stream_closed_at = None
+                restart_gap_histogram.observe(gap)
+                if self._current is not None:
+                    self._current.restart_gaps.append(gap)
+                else:
+                    self._pending_gaps.append(gap)
+            self._stream_audio_seconds += num_bytes / 8000
+            self._audio_marks.append((self._stream_audio_seconds, received_at))
+
+    def on_stream_closed(self):
+        """ストリームの終了 (張り替え・エラー・ターンごとの作り直し) を記録する"""
+        with self._lock:
+            if self._stream_closed_at is None:
+                self._stream_closed_at = time.monotonic()
+
+    def on_result(self, is_final: bool, audio_offset: float | None = None):
+        """認識結果の受信を記録する
+
+        Args:
+            is_final (bool): 確定結果か
+            audio_offset (float): 結果の末尾の、ストリーム先頭からの音声の時刻 (秒)
+        """
+        with self._lock:
+            now = self._now()
+            if self._current is None:
+                # VADが発話を検出する前に届いた結果 (開始時刻は不明)
+                self._current = UtteranceLatency(restart_gaps=self._pending_gaps)
+                self._pending_gaps = []
+            utterance = self._current
+            if utterance.first_partial_at is None:
+                utterance.first_partial_at = now
+                if utterance.first_partial_latency is not None:
+                    first_partial_histogram.observe(utterance.first_partial_latency)
+            utterance.num_partials += 1
+            if not is_final:
+                return
+
+            utterance.final_at = now
+            utterance.speech_end_at = self._last_speech_at
+            if utterance.final_latency is not None:
+                final_histogram.observe(utterance.final_latency)
+            if audio_offset is not None:
+                received_at = self._received_at(audio_offset)
+                if received_at is not None:
+                    utterance.final_audio_lag = time.monotonic() - received_at
+                    final_audio_lag_histogram.observe(utterance.final_audio_lag)
+            self._close_current()
+
+    def _received_at(self, audio_offset: float) -> float | None:
+        for end, received_at in self._audio_marks:
+            if end >= audio_offset:
+                return received_at
+        return None
+
+    def _close_current(self):
+        if self._current is not None:
+            self.utterances.append(self._current)
+            self._current = None
+
+    def get_record(self) -> dict:
+        """通話全体の記録 (発話ごとの遅延) を返す"""
+        with self._lock:
+            utterances = self.utterances + ([self._current] if self._current else [])
+            return {"utterances": [u.to_dict() for u in utterances]}
+
+    def summary(self) -> dict:
+        """通話全体の遅延の平均・最大を返す"""
+        with self._lock:
+            utterances = self.utterances + ([self._current] if self._current else [])
+        values = {
+            "first_partial_sec": [u.first_partial_latency for u in utterances],
+            "final_sec": [u.final_latency for u in utterances],
+            "final_audio_lag_sec": [u.final_audio_lag for u in utterances],
+            "restart_gap_sec": [gap for u in utterances for gap in u.restart_gaps],
+        }
+        summary = {"num_utterances": len(utterances)}
+        for key, samples in values.items():
+            samples = [s for s in samples if s is not None]
+            summary[key] = (
+                {"mean": sum(samples) / len(samples), "max": max(samples)} if samples else None
+            )
+        return summary
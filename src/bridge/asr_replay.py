@@ -0,0 +1,94 @@
+import json
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+
+from src.bridge.asr_bridge import BYTES_PER_SECOND, BaseASRBridge
+from src.utils import get_custom_logger
+
+logger = get_custom_logger(__name__)
+
+
+@dataclass
+class ReplayHypothesis:
+    """スクリプトの1行分の認識結果"""
+    time: float  # 通話開始からの音声の時刻 (秒)
+    transcript: str
+    is_final: bool = False
+
+
+class ReplayScript:
+    """JSONLで書かれた認識結果のスクリプトと、通話の音声時刻を保持する
+
+    1行が1つの認識結果で、timeは通話開始から受け取った音声の長さ (秒) で表す。
+    ネットワークやスレッドのタイミングに依存せず、同じ音声に対して常に同じ結果を返す。
+
+        {"time": 1.20, "transcript": "明日の"}
+        {"time": 1.80, "transcript": "明日の19時に", "is_final": true}
+
+    ターンごとにASRを作り直す場合も音声時刻が続くよう、1通話につき1つ生成して共有する。
+    """
+
+    def __init__(self, hypotheses: list[ReplayHypothesis]):
+        self.hypotheses = sorted(hypotheses, key=lambda h: h.time)
+        self.audio_seconds = 0.0
+        self._cursor = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: str | Path) -> "ReplayScript":
+        hypotheses = []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    hypotheses.append(ReplayHypothesis(**json.loads(line)))
+        return cls(hypotheses)
+
+    def advance(self, num_bytes: int) -> list[ReplayHypothesis]:
+        """音声時刻を進め、その時刻までに出力すべき認識結果を返す"""
+        with self._lock:
+            self.audio_seconds += num_bytes / BYTES_PER_SECOND
+            due = []
+            while (
+                self._cursor < len(self.hypotheses)
+                and self.hypotheses[self._cursor].time <= self.audio_seconds
+            ):
+                due.append(self.hypotheses[self._cursor])
+                self._cursor += 1
+            return due
+
+
+class ReplayASRBridge(BaseASRBridge):
+    """音声の代わりにスクリプトの認識結果を返すASR (オフラインでの計測・負荷試験用)
+
+    認識結果は add_request() で音声時刻が進んだ時点で反映するため、
+    start() はブロックせず、通話ごとにExecutorのスレッドを占有しない。
+    """
+
+    def __init__(self, script: ReplayScript, persistent=False):
+        super().__init__(persistent)
+        self.script = script
+        self._ended = False
+
+    def start(self):
+        logger.info("Replay ASR bridge started")
+
+    def add_request(self, buffer):
+        if self._ended:
+            return
+        for hypothesis in self.script.advance(len(buffer)):
+            self.transcription = hypothesis.transcript
+            self.is_final = hypothesis.is_final
+            self._publish_hypothesis(audio_offset=hypothesis.time)
+
+    def skip_audio(self, num_bytes: int):
+        # スクリプトの時刻は通話の音声の時刻のため、送らなかった音声の分も進める
+        self.add_request(bytes(num_bytes))
+
+    def end_utterance(self):
+        self.transcription = ""
+        self.is_final = False
+        self._clear_hypotheses()
+
+    def terminate(self):
+        self._ended = True
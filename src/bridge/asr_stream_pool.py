@@ -0,0 +1,251 @@
+import queue
+import threading
+import time
+from typing import Iterable, Iterator
+
+import grpc
+from google.api_core import exceptions, gapic_v1
+from google.cloud import speech
+from google.cloud.speech_v1.services.speech.transports.base import DEFAULT_CLIENT_INFO
+
+from src.utils import get_custom_logger
+from src.utils.metrics import LatencyHistogram
+
+logger = get_custom_logger(__name__)
+
+# SpeechClient.streaming_recognize の既定のタイムアウト (秒)
+STREAMING_TIMEOUT = 5000.0
+
+_speech_client: speech.SpeechClient | None = None
+_speech_client_lock = threading.Lock()
+
+
+def get_speech_client() -> speech.SpeechClient:
+    """プロセス内で共有するSpeechClient (gRPCチャネル) を返す
+
+    通話やストリームごとにクライアントを作ると、そのたびにチャネルの接続と
+    認証が発生するため、1つのクライアントを使い回す。pre-forkで起動する場合は
+    fork後 (各ワーカーのlifespan) に作成すること。
+    """
+    global _speech_client
+    if _speech_client is None:
+        with _speech_client_lock:
+            if _speech_client is None:
+                tic = time.perf_counter()
+                _speech_client = speech.SpeechClient()
+                logger.info(f"Created shared SpeechClient in {time.perf_counter() - tic:.3f} sec")
+    return _speech_client
+
+
+class _ResponseStream:
+    """gRPCのレスポンスのイテレータ (エラーはapi_coreの例外に変換する)
+
+    SpeechClient.streaming_recognize はapi_coreのラッパーが最初のレスポンスを
+    先読みするため、音声を送る前のストリームでは最初のレスポンスが届くまで戻らない。
+    待機させるストリームは _open_streaming_call() で開始し、先読みせずにこのクラスで包む。
+    """
+
+    def __init__(self, call):
+        self._call = call
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._call)
+        except grpc.RpcError as e:
+            raise exceptions.from_grpc_error(e) from e
+
+    def cancel(self):
+        self._call.cancel()
+
+
+def _open_streaming_call(client, requests):
+    """先読みせずにストリーミング認識を開始する
+
+    SpeechClientのラップ済みのメソッドと同じ既定のタイムアウトとメタデータ
+    (x-goog-api-client) をapi_coreで付ける。リトライは付けない
+    (リクエストのイテレータは再送できないため、ラップ済みのメソッドでも
+    ストリームの途中のエラーはリトライされない)。
+    """
+    transport = client.transport
+    rpc = gapic_v1.method.wrap_method(
+        lambda requests, **kwargs: transport.streaming_recognize(requests, **kwargs),
+        default_timeout=STREAMING_TIMEOUT,
+        client_info=DEFAULT_CLIENT_INFO,
+    )
+    return rpc(requests)
+
+
+class StandbyStream:
+    """音声を送る前に開始しておいたストリーミング認識
+
+    ストリームは設定 (streaming_config) だけを送った状態で待機し、
+    attach() で渡された音声の送信を始める。
+    gRPCの呼び出しはすぐに戻るため、開始にかかった時間 (warmup_seconds) は
+    設定の送信が完了するまで (チャネルの接続を含む) の時間とする。
+    """
+
+    def __init__(self, client, streaming_config):
+        self._source: queue.Queue[Iterable[bytes] | None] = queue.Queue(maxsize=1)
+        self._ready = threading.Event()
+        self.streaming_config = streaming_config
+        self.warmup_seconds: float | None = None
+        self._opened_at = time.perf_counter()
+        self.responses = _ResponseStream(_open_streaming_call(client, self._requests()))
+        self.created_at = time.monotonic()
+
+    def _requests(self) -> Iterator[speech.StreamingRecognizeRequest]:
+        # 設定はすぐに送り、音声はattach()されるまで待つ
+        yield speech.StreamingRecognizeRequest(streaming_config=self.streaming_config)
+        # gRPCは前のリクエストの送信が完了してから次のリクエストを読み出す
+        self.warmup_seconds = time.perf_counter() - self._opened_at
+        self._ready.set()
+        audio = self._source.get()
+        if audio is None:
+            return
+        for content in audio:
+            yield speech.StreamingRecognizeRequest(audio_content=content)
+
+    def wait_ready(self, timeout: float | None = None) -> bool:
+        """設定の送信が完了するまで待つ"""
+        return self._ready.wait(timeout)
+
+    def attach(self, audio: Iterable[bytes]):
+        """音声の送信を開始する"""
+        self._source.put(audio, block=False)
+
+    def close(self):
+        """使われなかったストリームを終了する"""
+        try:
+            self._source.put(None, block=False)
+        except queue.Full:
+            pass
+        cancel = getattr(self.responses, "cancel", None)
+        if cancel is not None:
+            cancel()
+
+
+class ASRStreamPool:
+    """音声の送信前に開始しておいたストリーミング認識を一定数保持するプール
+
+    Google STTは音声が届かないストリームを一定時間で切断するため、
+    max_idle_seconds を超えて使われなかったストリームは閉じて作り直す。
+    shrink_after_seconds の間 acquire() されなかった場合は作り直さずに空にし、
+    次の acquire() から再び補充する。
+    """
+
+    def __init__(
+        self,
+        streaming_config,
+        size: int = 2,
+        max_idle_seconds: float = 8.0,
+        shrink_after_seconds: float = 60.0,
+        client=None,
+    ):
+        """
+        Args:
+            streaming_config (StreamingRecognitionConfig): ストリームの設定
+            size (int): 待機させておくストリームの数
+            max_idle_seconds (float): 待機中のストリームを使わずに保持する最大時間 (秒)
+            shrink_after_seconds (float): この時間 (秒) 通話がない場合はストリームを補充しない
+            client (SpeechClient): 省略時は共有のSpeechClientを使う
+        """
+        self.streaming_config = streaming_config
+        self.size = size
+        self.max_idle_seconds = max_idle_seconds
+        self.shrink_after_seconds = shrink_after_seconds
+        self._client = client
+        # 起動直後は通話が来る前提で補充する
+        self._last_acquired = time.monotonic()
+        self._standby: list[StandbyStream] = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._ended = False
+        self._thread: threading.Thread | None = None
+
+        self.num_hits = 0
+        self.num_misses = 0
+        self.num_expired = 0
+        self.warmup_latency = LatencyHistogram()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._refill_loop, daemon=True)
+        self._thread.start()
+        logger.info(f"ASR stream pool started (size={self.size})")
+
+    def stop(self):
+        self._ended = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        with self._lock:
+            standby, self._standby = self._standby, []
+        for stream in standby:
+            stream.close()
+        logger.info("ASR stream pool stopped")
+
+    def acquire(self) -> StandbyStream | None:
+        """待機中のストリームを1つ取り出す (空の場合はNone)"""
+        now = time.monotonic()
+        with self._lock:
+            self._last_acquired = now
+            while self._standby:
+                stream = self._standby.pop(0)
+                if now - stream.created_at < self.max_idle_seconds:
+                    self.num_hits += 1
+                    self._wakeup.set()
+                    return stream
+                self._expire(stream)
+            self.num_misses += 1
+        self._wakeup.set()
+        return None
+
+    def _expire(self, stream: StandbyStream):
+        self.num_expired += 1
+        stream.close()
+
+    def _refill_loop(self):
+        while not self._ended:
+            now = time.monotonic()
+            with self._lock:
+                expired = [s for s in self._standby if now - s.created_at >= self.max_idle_seconds]
+                self._standby = [s for s in self._standby if s not in expired]
+                active = now - self._last_acquired < self.shrink_after_seconds
+                shortage = self.size - len(self._standby) if active else 0
+            for stream in expired:
+                self._expire(stream)
+
+            for _ in range(shortage):
+                if self._ended:
+                    return
+                try:
+                    client = self._client if self._client is not None else get_speech_client()
+                    stream = StandbyStream(client, self.streaming_config)
+                except Exception as e:
+                    logger.warning(f"Failed to open standby ASR stream: {e}")
+                    break
+                if not stream.wait_ready(timeout=self.max_idle_seconds):
+                    logger.warning("Standby ASR stream did not become ready")
+                    stream.close()
+                    break
+                self.warmup_latency.observe(stream.warmup_seconds)
+                with self._lock:
+                    self._standby.append(stream)
+
+            self._wakeup.wait(timeout=1.0)
+            self._wakeup.clear()
+
+    def get_metrics(self) -> dict:
+        requests = self.num_hits + self.num_misses
+        return {
+            "pool_size": self.size,
+            "available": len(self._standby),
+            "active": time.monotonic() - self._last_acquired < self.shrink_after_seconds,
+            "num_hits": self.num_hits,
+            "num_misses": self.num_misses,
+            "hit_rate": self.num_hits / requests if requests else None,
+            "num_expired": self.num_expired,
+            "warmup_latency_sec": self.warmup_latency.summary(),
+        }
@@ -0,0 +1,291 @@
+import asyncio
+import base64
+import time
+from typing import Callable
+
+from fastapi import WebSocket
+from starlette.websockets import WebSocketDisconnect, WebSocketState
+
+from src.bridge.asr_bridge import ASRBridge, BaseASRBridge
+from src.bridge.asr_gate import ASRUploadGate
+from src.bridge.asr_latency import ASRLatencyTracker
+from src.modules.dialogue.utils.constants import TurnTakingStatus
+from src.utils import get_custom_logger
+from src.utils.executor import get_blocking_executor, get_streaming_executor
+from src.utils.metrics import LatencyHistogram
+
+logger = get_custom_logger(__name__)
+
+# 全通話共通: mediaフレーム1つの取り込み (デコード, ASR送信, VAD更新) にかかったCPU時間
+frame_cpu_histogram = LatencyHistogram()
+# 全通話共通: VADゲートによりASRへ送らなかった音声の長さ (1通話あたり)
+gated_seconds_histogram = LatencyHistogram()
+
+
+def get_call_session_metrics() -> dict:
+    return {
+        "frame_cpu_sec": frame_cpu_histogram.summary(),
+        "asr_gated_sec_per_call": gated_seconds_histogram.summary(),
+    }
+
+
+class CallSession:
+    """1通話分のメディア受信・ASR・TTS合成・対話ターンをサーバのイベントループ上で実行する
+
+    通話ごとにスレッドやイベントループを作らず、TTS合成ループはasyncioのタスクとして、
+    ブロッキングなSDK呼び出し (TTS合成など) は共有Executorで、ASRのストリーミング認識は
+    専用のExecutorで実行する。
+
+    mediaフレームの受信時は音声の取り込み (ASRへの送信, VADの更新) のみを行い、
+    対話ターンの処理 (dialog_bridgeの呼び出し) は別のタスクで、状態が変化したときだけ実行する。
+    状態の変化とは、VADによる発話終了・バージインの検知、新しいASR結果、
+    TTS音声の合成完了、markの受信である。応答生成 (LLM) に時間がかかっている間も
+    フレームの取り込みは止まらない。
+    """
+
+    def __init__(
+        self,
+        ws: WebSocket,
+        stream_sid: str,
+        dialog_bridge,
+        tts_bridge,
+        firestore_client,
+        conversation_logger,
+        asr_bridge_factory: Callable[[], BaseASRBridge] = ASRBridge,
+        asr_gate: ASRUploadGate | None = None,
+    ):
+        """
+        Args:
+            asr_gate (ASRUploadGate): 指定した場合、VADで発話を検出している間だけASRへ音声を送る
+        """
+        self.ws = ws
+        self.stream_sid = stream_sid
+        self.dialog_bridge = dialog_bridge
+        self.tts_bridge = tts_bridge
+        self.firestore_client = firestore_client
+        self.conversation_logger = conversation_logger
+        self.asr_bridge_factory = asr_bridge_factory
+        self.asr_gate = asr_gate
+        self.asr_latency = ASRLatencyTracker()
+
+        self.asr_bridge = None
+        self.is_finished = False
+        self._asr_future: asyncio.Future | None = None
+        self._tts_task: asyncio.Task | None = None
+        self._turn_task: asyncio.Task | None = None
+        # 対話ターンの処理タスクを起こすシグナル
+        self._turn_signal = asyncio.Event()
+
+        # 次のmediaフレームで対話ターンの処理を行う必要があるか
+        self._turn_pending = False
+        self._asr_revision = 0
+        self.num_frames = 0
+        self.num_turn_steps = 0
+        self.frame_cpu_seconds = 0.0
+
+    async def start(self):
+        """ASRストリームとTTS合成ループを開始し、初期発話を送る"""
+        self.tts_bridge.set_connect_info(self.stream_sid)
+        self.dialog_bridge.set_stream_sid(self.stream_sid)
+        self.tts_bridge.on_audio_ready = self._on_tts_audio_ready
+        self._start_asr()
+        self._tts_task = asyncio.create_task(
+            self.tts_bridge.async_response_loop(get_blocking_executor())
+        )
+
+        self._turn_task = asyncio.create_task(self._turn_loop())
+
+        # 初期発話は合成を待ってすぐに送り、無音の時間を短くする
+        await self.tts_bridge.synthesize_initial(
+            self.dialog_bridge.get_initial_message(), get_blocking_executor()
+        )
+        await self.dialog_bridge.send_tts(
+            self.ws, self.tts_bridge, self.firestore_client, self.conversation_logger
+        )
+
+    def _start_asr(self):
+        self.asr_bridge = self.asr_bridge_factory()
+        self.asr_bridge.latency_tracker = self.asr_latency
+        self._asr_revision = self.asr_bridge.revision
+        loop = asyncio.get_running_loop()
+        # ストリーミング認識は通話中ずっとスレッドを占有するため、専用のExecutorで実行する
+        self._asr_future = loop.run_in_executor(get_streaming_executor(), self.asr_bridge.start)
+
+    def _on_tts_audio_ready(self):
+        self._turn_pending = True
+
+    def _restart_asr(self):
+        self.asr_bridge.terminate()
+        self._start_asr()
+        logger.info("Restarted asr bridge")
+
+    async def run(self):
+        """通話終了 (stopイベント, 切断, 対話完了) までメディアを処理する"""
+        if self._tts_task is None:
+            await self.start()
+        try:
+            while self.ws.application_state == WebSocketState.CONNECTED:
+                try:
+                    data = await self.ws.receive_json()
+                except WebSocketDisconnect:
+                    logger.info("Media WS: Disconnected")
+                    break
+                if not await self.handle_event(data):
+                    break
+        finally:
+            await self.close()
+
+    async def handle_event(self, data: dict) -> bool:
+        """Twilioのイベントを1つ処理する
+
+        Returns:
+            bool: 通話を継続する場合はTrue
+        """
+        if self._turn_task is not None and self._turn_task.done():
+            # 対話ターンの処理で例外が発生した場合はここで送出する
+            self._turn_task.result()
+            return False
+
+        if data["event"] == "stop":
+            logger.info(f"Media WS: Received event 'stop': {data}")
+            return False
+
+        elif data["event"] == "media":
+            tic = time.thread_time()
+            chunk = base64.b64decode(data["media"]["payload"])
+            vad_changed = self.dialog_bridge.vad_step(chunk)
+            is_speech = getattr(self.dialog_bridge, "is_speech", None)
+            if is_speech is not None:
+                self.asr_latency.on_vad(is_speech)
+            if self.asr_gate is None:
+                self.asr_bridge.add_request(chunk)
+            else:
+                for frame in self.asr_gate.process(chunk, is_speech):
+                    self.asr_bridge.add_request(frame)
+                skipped = self.asr_gate.pop_skipped_bytes()
+                if skipped:
+                    self.asr_bridge.skip_audio(skipped)
+            asr_changed = self.asr_bridge.revision != self._asr_revision
+            if asr_changed and hasattr(self.dialog_bridge, "on_hypothesis"):
+                for event in self.asr_bridge.hypotheses_since(self._asr_revision):
+                    self.dialog_bridge.on_hypothesis(event)
+            frame_cpu = time.thread_time() - tic
+            self.num_frames += 1
+            self.frame_cpu_seconds += frame_cpu
+            frame_cpu_histogram.observe(frame_cpu)
+
+            if vad_changed or asr_changed or self._turn_pending:
+                self._turn_signal.set()
+
+        elif data["event"] == "mark" and data["mark"]["name"] == "continue":
+            logger.info(f"Media WS: Received event 'mark': {data}")
+            logger.info("Bot: Speaking is done")
+            self.asr_bridge.reset()
+            self.dialog_bridge.bot_speak = False
+            # 暗黙確認時にのみバージインを許可するため、botが話し終わったタイミングでバージインを毎回オフにする
+            self.dialog_bridge.allow_barge_in = False
+            logger.info("set allow_barge_in to False")
+            # 話し終わるまで送れなかったTTS音声を次のフレームで送る
+            self._turn_pending = True
+            if self.is_finished or (
+                self.dialog_bridge.dialogue_system.is_complete()
+                and self.tts_bridge.is_empty
+            ):
+                return False
+
+        elif data["event"] == "mark" and data["mark"]["name"] == "finish":
+            self.is_finished = True
+
+        elif data["event"] == "mark" and hasattr(self.dialog_bridge, "on_mark"):
+            # 発話の途中で送ったmark (再生済みの位置の通知)
+            self.dialog_bridge.on_mark(data["mark"]["name"])
+
+        else:
+            raise ValueError(f"Media WS: Received unknown event: {data['event']}")
+
+        return True
+
+    async def _turn_loop(self):
+        """状態が変化するたびに対話ターンの処理を行う (mediaフレームの取り込みとは別のタスク)"""
+        while True:
+            await self._turn_signal.wait()
+            self._turn_signal.clear()
+            await self.turn_step()
+
+    async def turn_step(self):
+        """対話ターンの処理 (ターンテイキング, 応答生成, TTS送信, バージイン) を1回行う"""
+        self._turn_pending = False
+        self._asr_revision = self.asr_bridge.revision
+        self.num_turn_steps += 1
+        was_final = getattr(self.dialog_bridge, "is_final", False)
+
+        out = await self.dialog_bridge(
+            self.ws,
+            self.asr_bridge,
+            self.tts_bridge,
+            firestore_client=self.firestore_client,
+            conversation_logger=self.conversation_logger,
+        )
+        if out["asr_done"]:
+            logger.info("ASR done")
+            if self.asr_bridge.persistent:
+                # ストリームを張り直さず、同じストリーム上で次の発話に進む
+                self.asr_bridge.end_utterance()
+            else:
+                self._restart_asr()
+            return
+
+        # ターンテイキングは直前に読んだ認識結果を使うため、発話終了が成立していれば次のフレームで再度処理する
+        if self.dialog_bridge.turn_taking(self.asr_bridge) == TurnTakingStatus.END_OF_TURN:
+            self._turn_pending = True
+        # 対話が完了した直後は、次のフレームで終了のmarkを送る
+        if getattr(self.dialog_bridge, "is_final", False) and not was_final:
+            self._turn_pending = True
+
+    def get_metrics(self) -> dict:
+        metrics = {
+            "num_frames": self.num_frames,
+            "num_turn_steps": self.num_turn_steps,
+            "frame_cpu_sec_mean": self.frame_cpu_seconds / max(self.num_frames, 1),
+        }
+        if hasattr(self.asr_bridge, "get_metrics"):
+            metrics["asr"] = self.asr_bridge.get_metrics()
+        if self.asr_gate is not None:
+            metrics["asr_gate"] = self.asr_gate.get_metrics()
+        metrics["asr_latency"] = self.asr_latency.summary()
+        if hasattr(self.tts_bridge, "get_metrics"):
+            metrics["tts"] = self.tts_bridge.get_metrics()
+        if getattr(self.dialog_bridge, "media_pacer", None) is not None:
+            metrics["media_pacer"] = self.dialog_bridge.media_pacer.get_metrics()
+        return metrics
+
+    def queue_depths(self) -> dict[str, int]:
+        """ステージごとのキューに溜まっている件数を返す"""
+        return {
+            "asr": getattr(self.asr_bridge, "queue_depth", 0),
+            "tts_text": self.tts_bridge.text_queue.qsize(),
+            "tts_audio": self.tts_bridge.audio_queue.qsize(),
+        }
+
+    async def close(self):
+        """ASRストリームとTTS合成ループを停止する"""
+        logger.info(f"Media WS: Connection closed {self.get_metrics()}")
+        if self.asr_gate is not None:
+            gated_seconds_histogram.observe(self.asr_gate.gated_seconds)
+        logger.info(f"ASR latency record: {self.asr_latency.get_record()}")
+        if self._turn_task is not None:
+            self._turn_task.cancel()
+            try:
+                await self._turn_task
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                logger.error(f"Turn processing failed: {e}")
+        if self.asr_bridge is not None:
+            self.asr_bridge.terminate()
+        self.tts_bridge.terminate()
+        if self._tts_task is not None:
+            try:
+                await asyncio.wait_for(self._tts_task, timeout=5)
+            except asyncio.TimeoutError:
+                logger.warning("TTS response loop did not stop in time")
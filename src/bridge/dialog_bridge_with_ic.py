@@ -4,6 +4,13 @@ from src.modules import (
 from src.modules.dialogue.utils.template import tts_text2label, tts_label2text
 from src.modules.dialogue.dialogue_system import DialogueSystem
 from src.utils import get_custom_logger, ulaw_decode
+from src.utils.executor import get_blocking_executor, run_blocking
+from src.bridge.asr_bridge import HypothesisEvent
+from src.bridge.tts_bridge import BaseTTSBridge
+from src.bridge.tts_scheduler import ResponsePart
+from src.bridge.tts_stream import StreamingAudio
+from src.bridge.media_pacer import PacedMediaSender
+import base64
 import json
 import asyncio
 from abc import abstractmethod
@@ -13,9 +20,21 @@ from src.modules.dialogue.utils.constants import VADConfig, BargeInConfig, TurnT
 logger = get_custom_logger(__name__)
 
 class DialogBridgeWithIntentClassification:
-    def __init__(self, default_state: dict = {}):
+    def __init__(
+        self,
+        default_state: dict = {},
+        dialogue_system=None,
+        media_pacer: PacedMediaSender | None = None,
+    ):
+        """
+        Args:
+            dialogue_system: 負荷試験などでは、LLMを呼ばない対話システムを外から渡す
+            media_pacer (PacedMediaSender): 指定した場合、ボットの音声を一定長のフレームに分けて
+                実時間に合わせて送る (バージイン時はフレーム単位で止める)。省略時は発話全体を1つのmediaで送る
+        """
         self.stream_sid = None
-        self.dialogue_system = DialogueSystem()
+        self.media_pacer = media_pacer
+        self.dialogue_system = dialogue_system if dialogue_system is not None else DialogueSystem()
         self.streaming_vad = VolumeBasedVADModel(
             sample_rate=VADConfig.SAMPLE_RATE,
             volume_threshold=VADConfig.VOLUME_THRESHOLD,
@@ -29,17 +48,81 @@ class DialogBridgeWithIntentClassification:
         self.allow_barge_in = False
         self.pre_text = ""
         self.bot_speak = False
+        # 音声をフレームごとに送っているタスク (ストリーミング合成、またはmedia_pacer使用時)
+        self._stream_task: asyncio.Task | None = None
+        self._stream: StreamingAudio | None = None
+        # 分けて合成した応答の送信中の応答 (続きの部分はmarkを待たずに送る)
+        self._response_id: int | None = None
+        self._continuing = False
+        # 前の応答の続きが届かなかったため、送らずに待たせている音声
+        self._held_audio: tuple | None = None
+        # 発話終了前のNLUの解析 (実行中のFuture, 解析中のテキスト, 次に解析するテキスト)
+        self._prefetch_future: asyncio.Future | None = None
+        self._prefetch_text = ""
+        self._prefetch_next: str | None = None
 
         self.slots = self.dialogue_system.current_state["state"]
 
     def set_stream_sid(self, stream_sid):
         self.stream_sid = stream_sid
 
-    def vad_step(self, chunk):
-        if chunk != "/w==":
-            chunk = ulaw_decode(chunk)
-            self.streaming_vad.update_vad_status(chunk)
-            
+    def vad_step(self, chunk) -> bool:
+        """VADの状態を更新する
+
+        Returns:
+            bool: ターンテイキングに関わる状態 (発話終了, バージイン) が新たに成立した場合True
+        """
+        if chunk == "/w==":
+            return False
+        was_speech_end = self.is_slow_speech_end
+        was_barge_in = self.get_bargein_flag()
+        chunk = ulaw_decode(chunk)
+        self.streaming_vad.update_vad_status(chunk)
+        return (self.is_slow_speech_end and not was_speech_end) or (
+            self.get_bargein_flag() and not was_barge_in
+        )
+
+
+    def on_hypothesis(self, event: HypothesisEvent):
+        """ASRの認識結果ごとに呼ばれる。確定部分が伸びるたびに、発話終了を待たずにNLUの解析を始める
+
+        解析は同時に1つだけ実行し、実行中に届いた結果は最新のものだけを、実行が終わってから解析する。
+        """
+        nlu = getattr(self.dialogue_system, "rule_based_sf", None)
+        if nlu is None:
+            return
+        text = event.transcript if event.is_final else event.stable_prefix
+        if not text or text in (self._prefetch_text, self._prefetch_next):
+            return
+        if self._prefetch_future is not None and not self._prefetch_future.done():
+            self._prefetch_next = text
+            return
+        self._start_prefetch(nlu, text)
+
+    def _start_prefetch(self, nlu, text: str):
+        self._prefetch_text = text
+        self._prefetch_future = asyncio.get_running_loop().run_in_executor(
+            get_blocking_executor(), nlu.prefetch, text
+        )
+        self._prefetch_future.add_done_callback(lambda future: self._on_prefetch_done(nlu, future))
+
+    def _on_prefetch_done(self, nlu, future: asyncio.Future):
+        if future.cancelled() or future is not self._prefetch_future:
+            return
+        if future.exception() is not None:
+            logger.warning(f"NLU prefetch failed: {future.exception()}")
+        if self._prefetch_next is not None:
+            text, self._prefetch_next = self._prefetch_next, None
+            self._start_prefetch(nlu, text)
+
+    async def _wait_prefetch(self, transcription: str):
+        """発話終了時に同じテキストを解析中であれば、二重に解析せずに完了を待つ"""
+        future = self._prefetch_future
+        if future is not None and not future.done() and self._prefetch_text == transcription:
+            try:
+                await asyncio.shield(future)
+            except Exception:
+                pass
 
     def turn_taking(self, *args):
         logger.debug(
@@ -57,9 +140,21 @@ class DialogBridgeWithIntentClassification:
     def reset_turn_taking_status(self):
         self.streaming_vad.init_state()
         self.pre_text = ""
+        # 前の発話の解析結果は次の発話では使わない
+        self._prefetch_future = None
+        self._prefetch_text = ""
+        self._prefetch_next = None
+        nlu = getattr(self.dialogue_system, "rule_based_sf", None)
+        if nlu is not None:
+            nlu.clear_prefetch()
         logger.info("Reset turn taking status")
 
 
+    @property
+    def is_speech(self):
+        """直前に受け取ったフレームが発話を含んでいたか"""
+        return self.streaming_vad.last_is_speech
+
     @property
     def is_fast_speech_end(self):
         return self.streaming_vad.fast_speech_end_flag
@@ -83,6 +178,9 @@ class DialogBridgeWithIntentClassification:
             self.reset_turn_taking_status()
             self.allow_barge_in = False
             self.bot_speak = False
+            self._response_id = None
+            self._continuing = False
+            self._stop_stream()
             await ws.send_text(
                 json.dumps(
                     {
@@ -112,37 +210,159 @@ class DialogBridgeWithIntentClassification:
         queue_size = tts_bridge.audio_queue.qsize()
 
         try:
-            if queue_size > 0 and not self.bot_speak:
-                txt, _out, _ = tts_bridge.audio_queue.get()
-                self.set_bargein_flag(txt)
-                txt = tts_label2text.get(txt, txt)
-                logger.info(f"Send Bot: {txt}")
-                self.store_event(firestore_client, txt, "bot")
-                conversation_logger.add_log_entry(
-                    speaker="bot", message=txt
-                )
-                # 非同期タスクのタイムアウト設定
-                await asyncio.wait_for(ws.send_text(_out), timeout=2)
-                await asyncio.wait_for(
-                    ws.send_text(
-                        json.dumps(
-                            {
-                                "event": "mark",
-                                "streamSid": self.stream_sid,
-                                "mark": {"name": "continue"},
-                            }
+            # 分けて合成した応答の続きは、前の部分の再生中 (markの往復前) でも送る
+            if (queue_size > 0 or self._held_audio is not None) and (
+                not self.bot_speak or self._continuing
+            ):
+                if self._held_audio is not None:
+                    item, self._held_audio = self._held_audio, None
+                else:
+                    item = tts_bridge.audio_queue.get()
+                txt, _out, _ = item
+                part = txt if isinstance(txt, ResponsePart) else None
+                if part is not None:
+                    txt = part.label
+                    if part.response_id != self._response_id and part.index > 0:
+                        # バージインで止めた応答の続きは送らない
+                        logger.info(f"Dropped rest of interrupted response: {txt}")
+                        return
+                is_continuation = part is not None and part.response_id == self._response_id
+                if not is_continuation and self._continuing:
+                    # 前の応答の続きが合成できなかった場合は、前の応答を閉じて話し終わるまで待つ
+                    logger.warning("Rest of the previous response was not delivered")
+                    self._held_audio = item
+                    self._continuing = False
+                    if self.is_streaming:
+                        self._stream_task = asyncio.create_task(
+                            self._send_after(self._stream_task, self._send_continue_mark(ws))
                         )
-                    ),
-                    timeout=2,
-                )
+                    else:
+                        await self._send_continue_mark(ws)
+                    return
+                if not is_continuation:
+                    # 分けて合成した応答は、分ける前のテキストで1件の発話として記録する
+                    message = part.response if part is not None else txt
+                    self.set_bargein_flag(message)
+                    message = tts_label2text.get(message, message)
+                    logger.info(f"Send Bot: {message}")
+                    self.store_event(firestore_client, message, "bot")
+                    conversation_logger.add_log_entry(
+                        speaker="bot", message=message
+                    )
+                self._response_id = part.response_id if part is not None else None
+                # markは応答の最後の部分を送った後にだけ送る
+                mark = part is None or part.is_last
+                self._continuing = not mark
+                previous = self._stream_task if self.is_streaming else None
+                if isinstance(_out, StreamingAudio):
+                    self._stream = _out
+                if self.media_pacer is not None:
+                    # 実時間に合わせてフレームごとに送り、ターンの処理はその間も続ける
+                    self._stream_task = asyncio.create_task(
+                        self._send_after(previous, self._send_paced(ws, txt, _out, mark))
+                    )
+                elif isinstance(_out, StreamingAudio):
+                    # 合成済みのフレームから送り、ターンの処理はその間も続ける
+                    self._stream_task = asyncio.create_task(
+                        self._send_after(previous, self._send_stream(ws, _out, mark))
+                    )
+                elif previous is not None:
+                    # 前の部分をフレームごとに送っている間は、その後に送る
+                    self._stream_task = asyncio.create_task(
+                        self._send_after(previous, self._send_media(ws, _out, mark))
+                    )
+                else:
+                    # 非同期タスクのタイムアウト設定
+                    await asyncio.wait_for(ws.send_text(_out), timeout=2)
+                    if mark:
+                        await self._send_continue_mark(ws)
                 self.bot_speak = True
 
         except asyncio.TimeoutError:
             pass
 
-        if self.dialogue_system.is_complete() and tts_bridge.is_empty:
+        if (
+            self.dialogue_system.is_complete()
+            and tts_bridge.is_empty
+            and self._held_audio is None
+            and not self.is_streaming
+            and not self._continuing
+        ):
             self.is_final = True
 
+    async def _send_continue_mark(self, ws):
+        await asyncio.wait_for(
+            ws.send_text(
+                json.dumps(
+                    {
+                        "event": "mark",
+                        "streamSid": self.stream_sid,
+                        "mark": {"name": "continue"},
+                    }
+                )
+            ),
+            timeout=2,
+        )
+
+    @property
+    def is_streaming(self) -> bool:
+        return self._stream_task is not None and not self._stream_task.done()
+
+    @staticmethod
+    async def _send_after(previous: asyncio.Task | None, send):
+        """前の部分の送信が終わってから送る (止めた場合は前の部分と合わせて止める)"""
+        if previous is not None:
+            try:
+                await previous
+            except asyncio.CancelledError:
+                send.close()
+                raise
+        await send
+
+    async def _send_media(self, ws, out: str, mark: bool = True):
+        try:
+            await asyncio.wait_for(ws.send_text(out), timeout=2)
+            if mark:
+                await self._send_continue_mark(ws)
+        except Exception as e:
+            logger.error(f"Failed to send TTS audio: {e}")
+
+    async def _send_stream(self, ws, stream: StreamingAudio, mark: bool = True):
+        try:
+            async for frame in stream.frames():
+                payload = base64.b64encode(frame).decode("ascii")
+                await asyncio.wait_for(
+                    ws.send_text(BaseTTSBridge.get_twilio_media_stream(payload, self.stream_sid)),
+                    timeout=2,
+                )
+            if mark and not stream.cancelled:
+                await self._send_continue_mark(ws)
+        except Exception as e:
+            logger.error(f"Failed to send streaming TTS audio: {e}")
+
+    async def _send_paced(self, ws, text, audio, mark: bool = True):
+        try:
+            if await self.media_pacer.play(ws, self.stream_sid, text, audio) and mark:
+                await self._send_continue_mark(ws)
+        except Exception as e:
+            logger.error(f"Failed to send paced TTS audio: {e}")
+
+    def on_mark(self, name: str):
+        """continue/finish以外のmark (media_pacerが送ったmark) を受け取る"""
+        if self.media_pacer is None or not self.media_pacer.on_mark(name):
+            logger.warning(f"Received unknown mark: {name}")
+
+    def _stop_stream(self):
+        """送信中の音声を止める (media_pacer使用時は、止めた位置をログに残す)"""
+        if self.media_pacer is not None:
+            self.media_pacer.stop()
+        if self._stream is not None:
+            self._stream.cancel()
+        if self._stream_task is not None:
+            self._stream_task.cancel()
+        self._stream = None
+        self._stream_task = None
+
     @abstractmethod
     async def update_slots(self, transcription: str, *args):
         raise NotImplementedError
@@ -173,7 +393,11 @@ class DialogBridgeWithIntentClassification:
 
             if transcription != "":
                 self.store_event(firestore_client, transcription, "customer")
-                responses.extend(self.dialogue_system.process_message(transcription))
+                await self._wait_prefetch(transcription)
+                # LLM呼び出しを含むためイベントループの外で実行する
+                responses.extend(
+                    await run_blocking(self.dialogue_system.process_message, transcription)
+                )
                 conversation_logger.add_log_entry(
                     speaker="customer", message=transcription, dst_state=self.dialogue_system.dst.get_current_state()
                 )
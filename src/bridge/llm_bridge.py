@@ -1,6 +1,7 @@
 import os
 from openai import AzureOpenAI
 from src.utils import get_custom_logger
+from src.utils.bounded_queue import BoundedQueue, OverflowPolicy
 from src.modules.nlu.prompt import system_prompt_for_faq, system_prompt_for_slot_filling
 from dotenv import load_dotenv
 import queue
@@ -9,11 +10,14 @@ load_dotenv()
 
 logger = get_custom_logger(__name__)
 
+# 処理待ちのリクエスト・受け取り待ちの応答の上限 (一杯のときは待つ)
+QUEUE_SIZE = 16
+
 
 class LLMBridge:
     def __init__(self, system_prompt, json_format=False):
-        self.input_queue = queue.Queue()
-        self.output_queue = queue.Queue()
+        self.input_queue = BoundedQueue(QUEUE_SIZE, OverflowPolicy.BLOCK)
+        self.output_queue = BoundedQueue(QUEUE_SIZE, OverflowPolicy.BLOCK)
         self.stream_sid = None
         self.system_prompt = system_prompt
         self.json_format = json_format
@@ -0,0 +1,196 @@
+import asyncio
+import base64
+import json
+from dataclasses import dataclass
+from typing import AsyncIterator
+
+from src.bridge.tts_bridge import BaseTTSBridge
+from src.bridge.tts_stream import ULAW_SILENCE, StreamingAudio
+from src.utils import get_custom_logger
+from src.utils.metrics import LatencyHistogram
+
+logger = get_custom_logger(__name__)
+
+# 8kHz μ-law の1ミリ秒あたりのバイト数
+ULAW_BYTES_PER_MS = 8
+MARK_PREFIX = "frame"
+
+# 全通話共通: 送信が再生に追いつかず、相手側で音声が途切れた時間 (ストリーミング合成が実時間より遅い場合など)
+underrun_histogram = LatencyHistogram()
+# 全通話共通: バージインで止めた時点で、発話のうち相手が聞いた割合 (全体の長さが分かる場合のみ)
+heard_ratio_histogram = LatencyHistogram()
+
+
+def get_media_pacer_metrics() -> dict:
+    return {
+        "underrun_sec": underrun_histogram.summary(),
+        "barge_in_heard_ratio": heard_ratio_histogram.summary(),
+    }
+
+
+@dataclass
+class Playback:
+    """送信中の1発話の再生位置"""
+    text: str
+    seq: int
+    frame_ms: int
+    total_frames: int | None = None  # ストリーミング合成の場合は合成が終わるまで不明
+    frames_sent: int = 0
+    frames_acked: int = 0  # Twilioから返ってきたmarkの位置 (再生済みが確定している位置)
+    playhead: float | None = None  # 相手側で、送信済みのフレームを再生し終わる推定時刻
+
+    def buffered_ms(self, now: float) -> float:
+        """送信済みだが、まだ再生されていない長さ"""
+        if self.playhead is None:
+            return 0.0
+        return max(self.playhead - now, 0.0) * 1000
+
+    def heard_ms(self, now: float) -> float:
+        return self.frames_sent * self.frame_ms - self.buffered_ms(now)
+
+
+class PacedMediaSender:
+    """ボットの発話を、実時間より少しだけ先行した一定長のmediaフレームとして送る
+
+    発話全体を1つのmediaメッセージで送ると、Twilio側に発話全体が溜まり、バージインの
+    clearで発話全体を捨てることになる。フレームごとに再生時刻の lead_ms 前まで待って
+    送るため、止めた時点でTwilio側に溜まっているのは lead_ms 分だけで、以降は送らない。
+    mark_interval_ms ごとにmarkを送り、Twilioから返ってきたmarkで再生済みの位置を確認する。
+
+    1通話に1つ作り、送信は同時に1発話ずつ行う。
+    """
+
+    def __init__(self, frame_ms: int = 20, lead_ms: int = 100, mark_interval_ms: int = 500):
+        """
+        Args:
+            frame_ms (int): 1つのmediaメッセージに入れる音声の長さ
+            lead_ms (int): 再生時刻よりどれだけ先に送るか (ネットワークの揺らぎを吸収する分)
+            mark_interval_ms (int): markを送る間隔
+        """
+        self.frame_ms = frame_ms
+        self.frame_bytes = frame_ms * ULAW_BYTES_PER_MS
+        self.lead = lead_ms / 1000
+        self.mark_every = max(mark_interval_ms // frame_ms, 1)
+        self.playback: Playback | None = None
+        self._seq = 0
+
+        self.num_frames_sent = 0
+        self.num_truncated = 0
+
+    async def play(self, ws, stream_sid: str, text: str, audio: str | StreamingAudio) -> bool:
+        """発話をフレームに分けて送る
+
+        Args:
+            audio (str | StreamingAudio): mediaメッセージのJSON (TTSの送信待ちのキューの要素)、
+                またはストリーミング合成の音声
+
+        Returns:
+            bool: 最後まで送った場合True (stop() で止めた場合False)
+        """
+        self._seq += 1
+        playback = Playback(text=text, seq=self._seq, frame_ms=self.frame_ms)
+        if isinstance(audio, str):
+            ulaw = base64.b64decode(json.loads(audio)["media"]["payload"])
+            playback.total_frames = -(-len(ulaw) // self.frame_bytes)
+            chunks = self._chunks(ulaw)
+        else:
+            chunks = audio.frames()
+        self.playback = playback
+
+        loop = asyncio.get_running_loop()
+        async for frame in self._frames(chunks):
+            if self.playback is not playback:
+                return False
+            now = loop.time()
+            if playback.playhead is None or playback.playhead < now:
+                if playback.playhead is not None:
+                    underrun_histogram.observe(now - playback.playhead)
+                playback.playhead = now
+            # 再生時刻のlead前まで待つ (それより前に送ると、止めたときに捨てる音声が増える)
+            wait = playback.playhead - self.lead - now
+            if wait > 0:
+                await asyncio.sleep(wait)
+                if self.playback is not playback:
+                    return False
+            payload = base64.b64encode(frame).decode("ascii")
+            await asyncio.wait_for(
+                ws.send_text(BaseTTSBridge.get_twilio_media_stream(payload, stream_sid)), timeout=2
+            )
+            playback.playhead += self.frame_ms / 1000
+            playback.frames_sent += 1
+            self.num_frames_sent += 1
+            if playback.frames_sent % self.mark_every == 0:
+                await self._send_mark(ws, stream_sid, playback)
+
+        if self.playback is not playback or (isinstance(audio, StreamingAudio) and audio.cancelled):
+            return False
+        playback.total_frames = playback.frames_sent
+        return True
+
+    async def _send_mark(self, ws, stream_sid: str, playback: Playback):
+        name = f"{MARK_PREFIX}:{playback.seq}:{playback.frames_sent}"
+        await asyncio.wait_for(
+            ws.send_text(
+                json.dumps({"event": "mark", "streamSid": stream_sid, "mark": {"name": name}})
+            ),
+            timeout=2,
+        )
+
+    def on_mark(self, name: str) -> bool:
+        """Twilioから返ってきたmarkを受け取る
+
+        Returns:
+            bool: このクラスが送ったmarkの場合True
+        """
+        prefix, _, position = name.partition(":")
+        if prefix != MARK_PREFIX:
+            return False
+        seq, _, frames = position.partition(":")
+        # clear後に返ってくる、止めた発話のmarkは無視する
+        if self.playback is not None and int(seq) == self.playback.seq:
+            self.playback.frames_acked = max(self.playback.frames_acked, int(frames))
+        return True
+
+    def stop(self) -> Playback | None:
+        """送信を止め、止めた発話と再生位置をログに残す (以降のフレームは送らない)"""
+        playback, self.playback = self.playback, None
+        if playback is None or playback.frames_sent == playback.total_frames:
+            return None
+        now = asyncio.get_running_loop().time()
+        heard_ms = playback.heard_ms(now)
+        total = (
+            f"{playback.total_frames * self.frame_ms} ms"
+            if playback.total_frames is not None
+            else "unknown"
+        )
+        logger.info(
+            f"Bot audio truncated at {heard_ms:.0f} ms (total {total}, "
+            f"sent {playback.frames_sent * self.frame_ms} ms, "
+            f"acked {playback.frames_acked * self.frame_ms} ms): {playback.text}"
+        )
+        if playback.total_frames:
+            heard_ratio_histogram.observe(heard_ms / (playback.total_frames * self.frame_ms))
+        self.num_truncated += 1
+        return playback
+
+    async def _chunks(self, ulaw: bytes) -> AsyncIterator[bytes]:
+        for i in range(0, len(ulaw), self.frame_bytes):
+            yield ulaw[i : i + self.frame_bytes]
+
+    async def _frames(self, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        """音声をframe_msごとに区切り直す (最後のフレームは無音で埋める)"""
+        pending = bytearray()
+        async for chunk in chunks:
+            pending += chunk
+            while len(pending) >= self.frame_bytes:
+                yield bytes(pending[: self.frame_bytes])
+                del pending[: self.frame_bytes]
+        if pending:
+            yield bytes(pending).ljust(self.frame_bytes, ULAW_SILENCE)
+
+    def get_metrics(self) -> dict:
+        return {
+            "frame_ms": self.frame_ms,
+            "num_frames_sent": self.num_frames_sent,
+            "num_truncated": self.num_truncated,
+        }
@@ -0,0 +1,302 @@
+import calendar
+import re
+import string
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable
+
+import numpy as np
+from pydub import AudioSegment
+
+from src.bridge.template_audio_cache import TwilioAudio, to_twilio_audio
+from src.bridge.tts_cache import normalize_text
+from src.modules.dialogue.utils.constants import Slot
+from src.modules.dialogue.utils._constants import BUSINESS_HOURS
+from src.modules.model_registry import model_registry
+from src.utils import get_custom_logger
+from src.utils.metrics import LatencyHistogram
+
+logger = get_custom_logger(__name__)
+
+SAMPLE_RATE = 8000
+# 断片の前後に残す無音 (ミリ秒)。0にすると子音の立ち上がりが欠けることがある
+EDGE_PADDING_MS = 20
+# 無音とみなす振幅 (16bit PCM)
+SILENCE_THRESHOLD = 300
+# 人数の読みは「名様」まで含めて1つの断片にする (数字だけだと前後のつながりが不自然になる)
+PERSON_UNIT = "名様"
+
+# 全通話共通: テキストの照合から変換済みの音声ができるまでの時間
+render_histogram = LatencyHistogram()
+
+
+def get_slot_audio_metrics() -> dict:
+    metrics = {"render_sec": render_histogram.summary()}
+    if model_registry.is_loaded("slot_audio"):
+        metrics.update(model_registry.get("slot_audio").get_metrics())
+    return metrics
+
+
+def date_readings() -> list[str]:
+    """全ての月日の読み (format_entityと同じ M月D日 の形式, 2月29日を含む)"""
+    return [
+        f"{month}月{day}日"
+        for month in range(1, 13)
+        for day in range(1, calendar.monthrange(2024, month)[1] + 1)
+    ]
+
+
+def time_readings(business_hours=BUSINESS_HOURS) -> list[str]:
+    """営業時間内の30分刻みの時刻の読み (format_entityと同じ H時 / H時30分 の形式)"""
+    readings = []
+    for segment in business_hours:
+        minutes = segment.start.hour * 60 + segment.start.minute
+        end = segment.end.hour * 60 + segment.end.minute
+        while minutes < end:
+            hour, minute = divmod(minutes, 60)
+            readings.append(f"{hour}時" if minute == 0 else f"{hour}時{minute}分")
+            minutes += 30
+    return readings
+
+
+def person_readings(max_person: int = 20) -> list[str]:
+    return [f"{n}{PERSON_UNIT}" for n in range(1, max_person + 1)]
+
+
+# スロットごとの値の形式 (名前は語彙を持たず、照合した文字列をそのまま合成する)
+SLOT_PATTERNS = {
+    Slot.DATE.value: r"\d{1,2}月\d{1,2}日",
+    Slot.TIME.value: r"\d{1,2}時(?:\d{1,2}分)?",
+    Slot.N_PERSON.value: r"\d{1,2}" + PERSON_UNIT,
+    Slot.NAME.value: r".+?",
+}
+FREE_TEXT_SLOTS = {Slot.NAME.value}
+
+
+@dataclass(frozen=True)
+class SlotTemplate:
+    """定型句とスロットを並べたテンプレート (例: {日付}の{時間}に{人数}名様ですね。)"""
+    source: str
+    # 定型句 (str) またはスロット名 (Slot) を発話順に並べたもの
+    parts: tuple
+    pattern: re.Pattern
+
+    @property
+    def carriers(self) -> list[str]:
+        # SlotもstrのEnumのため、Slotでないものを定型句とする
+        return [part for part in self.parts if not isinstance(part, Slot)]
+
+    @property
+    def has_free_text(self) -> bool:
+        """つなぐときに合成が必要なスロット (名前など) を含むか"""
+        return any(isinstance(part, Slot) and part.value in FREE_TEXT_SLOTS for part in self.parts)
+
+
+def compile_template(template: str) -> SlotTemplate | None:
+    """テンプレートを照合用の正規表現と部品に分ける (対応していないスロットを含む場合はNone)"""
+    # 人数は「名様」まで含めた断片を使うため、テンプレート側の「名様」はスロットに含める
+    person = "{" + Slot.N_PERSON.value + "}"
+    template = normalize_text(template.replace(person + PERSON_UNIT, person))
+    parts = []
+    regex = ""
+    for literal, field, _, _ in string.Formatter().parse(template):
+        if literal:
+            parts.append(literal)
+            regex += re.escape(literal)
+        if field is None:
+            continue
+        if field not in SLOT_PATTERNS:
+            return None
+        parts.append(Slot(field))
+        regex += f"(?P<{Slot(field).name}>{SLOT_PATTERNS[field]})"
+    if not any(isinstance(part, Slot) for part in parts):
+        return None
+    return SlotTemplate(template, tuple(parts), re.compile(regex))
+
+
+def collect_templates(scenes: dict) -> list[SlotTemplate]:
+    """シーンの応答・確認のテンプレートのうち、スロットを含むものを集める"""
+    sources = []
+
+    def walk(value):
+        if isinstance(value, dict):
+            for v in value.values():
+                walk(v)
+        elif isinstance(value, str) and "{" in value and value not in sources:
+            sources.append(value)
+
+    walk(scenes)
+    compiled = [compile_template(source) for source in sources]
+    return [template for template in compiled if template is not None]
+
+
+def trim_silence(samples, padding: int = EDGE_PADDING_MS * SAMPLE_RATE // 1000) -> np.ndarray:
+    """前後の無音を除く (合成音声の前後には数百ミリ秒の無音が入るため、つなぐと間延びする)"""
+    samples = np.asarray(samples, dtype=np.int16)
+    voiced = np.flatnonzero(np.abs(samples.astype(np.int32)) > SILENCE_THRESHOLD)
+    if len(voiced) == 0:
+        return samples[:0]
+    start = max(voiced[0] - padding, 0)
+    end = min(voiced[-1] + padding + 1, len(samples))
+    return samples[start:end]
+
+
+def splice(fragments: list[np.ndarray], crossfade: int) -> np.ndarray:
+    """断片をつなぐ (つなぎ目はcrossfadeサンプルだけ重ねて線形にクロスフェードする)"""
+    fragments = [f for f in fragments if len(f)]
+    if not fragments:
+        return np.zeros(0, dtype=np.int16)
+    pieces = [fragments[0].astype(np.float32)]
+    for fragment in fragments[1:]:
+        fragment = fragment.astype(np.float32)
+        n = min(crossfade, len(pieces[-1]), len(fragment))
+        if n:
+            ramp = np.linspace(0.0, 1.0, n, endpoint=False, dtype=np.float32)
+            tail = pieces[-1]
+            pieces[-1] = tail[:-n]
+            pieces.append(tail[-n:] * (1.0 - ramp) + fragment[:n] * ramp)
+        pieces.append(fragment[n:])
+    return np.clip(np.concatenate(pieces), -32768, 32767).astype(np.int16)
+
+
+class SlotAudioEngine:
+    """確認の発話を、事前に合成した断片 (月日・時刻・人数・定型句) をつないで作る
+
+    名前のように語彙を持たないスロットだけをその場で合成する。テンプレートに一致しない
+    テキストや、語彙にない値 (営業時間外や30分刻みでない時刻など) の場合はNoneを返し、
+    呼び出し側で通常どおり文全体を合成する。
+    """
+
+    def __init__(
+        self,
+        templates: list[SlotTemplate],
+        fragments: dict[str, np.ndarray],
+        crossfade_ms: int = 10,
+    ):
+        """
+        Args:
+            templates (list[SlotTemplate]): 照合するテンプレート
+            fragments (dict[str, np.ndarray]): 断片のテキスト -> 前後の無音を除いた16bit PCM (8kHz)
+            crossfade_ms (int): つなぎ目を重ねる長さ
+        """
+        self.templates = templates
+        self.fragments = fragments
+        self.crossfade = crossfade_ms * SAMPLE_RATE // 1000
+        self._lock = threading.Lock()
+
+        self.num_rendered = 0
+        self.num_free_text = 0
+        self.num_unmatched = 0
+
+    def match(self, text: str) -> tuple[SlotTemplate, dict[str, str]] | None:
+        """テキストに一致するテンプレートと各スロットの値を返す (断片が揃わない場合はNone)"""
+        text = normalize_text(text)
+        for template in self.templates:
+            m = template.pattern.fullmatch(text)
+            if m is None:
+                continue
+            values = {Slot[name].value: value for name, value in m.groupdict().items()}
+            if all(
+                value in self.fragments
+                for slot, value in values.items()
+                if slot not in FREE_TEXT_SLOTS
+            ):
+                return template, values
+        return None
+
+    def render(self, text: str, synthesize: Callable[[str], TwilioAudio]) -> TwilioAudio | None:
+        """断片をつないだ音声を返す
+
+        Args:
+            text (str): 発話テキスト
+            synthesize (Callable[[str], TwilioAudio]): 名前などの語彙にない値を合成する関数
+
+        Returns:
+            TwilioAudio | None: つないだ音声 (テンプレートに一致しない場合はNone)
+        """
+        tic = time.perf_counter()
+        matched = self.match(text)
+        if matched is None:
+            with self._lock:
+                self.num_unmatched += 1
+            return None
+
+        template, values = matched
+        fragments = []
+        num_free_text = 0
+        for part in template.parts:
+            if not isinstance(part, Slot):
+                fragments.append(self.fragments[part])
+            elif part.value in FREE_TEXT_SLOTS:
+                fragments.append(trim_silence(synthesize(values[part.value]).samples))
+                num_free_text += 1
+            else:
+                fragments.append(self.fragments[values[part.value]])
+
+        samples = splice(fragments, self.crossfade)
+        audio = AudioSegment(
+            data=samples.tobytes(), sample_width=2, frame_rate=SAMPLE_RATE, channels=1
+        )
+        twilio_audio = to_twilio_audio(text, audio, source="spliced")
+        render_histogram.observe(time.perf_counter() - tic)
+        with self._lock:
+            self.num_rendered += 1
+            self.num_free_text += num_free_text
+        return twilio_audio
+
+    def get_metrics(self) -> dict:
+        with self._lock:
+            return {
+                "num_templates": len(self.templates),
+                "num_fragments": len(self.fragments),
+                "num_rendered": self.num_rendered,
+                "num_free_text": self.num_free_text,
+                "num_unmatched": self.num_unmatched,
+            }
+
+
+def build_slot_audio_engine(
+    scenes: dict,
+    synthesize: Callable[[str], TwilioAudio],
+    max_workers: int = 4,
+) -> SlotAudioEngine:
+    """シーンのテンプレートの定型句とスロットの値を全て合成し、エンジンを作る
+
+    Args:
+        scenes (dict): templates["scenes"]
+        synthesize (Callable[[str], TwilioAudio]): 断片を合成する関数 (TTSキャッシュを使うもの)
+        max_workers (int): 同時に合成する数
+    """
+    tic = time.perf_counter()
+    templates = collect_templates(scenes)
+    texts = list(dict.fromkeys(
+        [carrier for template in templates for carrier in template.carriers]
+        + date_readings()
+        + time_readings()
+        + person_readings()
+    ))
+
+    def render_fragment(text):
+        try:
+            return text, trim_silence(synthesize(text).samples)
+        except Exception as e:
+            logger.warning(f"Failed to synthesize slot audio fragment '{text}': {e}")
+            return text, None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        fragments = {
+            text: samples
+            for text, samples in executor.map(render_fragment, texts)
+            if samples is not None
+        }
+
+    # 合成できなかった定型句を含むテンプレートは使わない
+    templates = [t for t in templates if all(c in fragments for c in t.carriers)]
+    engine = SlotAudioEngine(templates, fragments)
+    logger.info(
+        f"Built slot audio engine in {time.perf_counter() - tic:.1f} sec: "
+        f"{len(templates)} templates, {len(fragments)}/{len(texts)} fragments"
+    )
+    return engine
@@ -0,0 +1,120 @@
+import base64
+import json
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+from pydub import AudioSegment
+
+from src.utils import (
+    TWILIO_SAMPLE_RATE,
+    encode_twilio_ulaw,
+    get_custom_logger,
+    segment_samples,
+    to_pcm16_8khz,
+)
+
+logger = get_custom_logger(__name__)
+
+
+@dataclass(frozen=True)
+class TwilioAudio:
+    """Twilioへそのまま送れる形に変換済みの音声"""
+    key: str
+    ulaw: bytes  # 8kHz μ-law
+    payload: str  # ulawをbase64エンコードしたもの
+    samples: object  # 8kHz 16bit PCMのサンプル (np.ndarray)
+    source: str  # "file" (録音済みの音声), "synthesized" (合成した音声), "spliced" (断片をつないだ音声) など
+
+    @property
+    def duration_seconds(self) -> float:
+        return len(self.ulaw) / 8000
+
+    def media_message(self, stream_sid: str) -> str:
+        """mediaイベントのJSONを返す (BaseTTSBridge.get_twilio_media_stream と同じ文字列)"""
+        return (
+            '{"event": "media", "media": {"payload": "'
+            + self.payload
+            + '"}, "streamSid": '
+            + json.dumps(stream_sid)
+            + "}"
+        )
+
+
+def to_twilio_audio(key: str, audio: AudioSegment, source: str = "file") -> TwilioAudio:
+    samples = to_pcm16_8khz(*segment_samples(audio))
+    ulaw = encode_twilio_ulaw(samples, TWILIO_SAMPLE_RATE)
+    return TwilioAudio(
+        key=key,
+        ulaw=ulaw,
+        payload=base64.b64encode(ulaw).decode("ascii"),
+        samples=samples,
+        source=source,
+    )
+
+
+class TemplateAudioCache:
+    """テンプレート発話 (TTSLabel) ごとの変換済み音声
+
+    キーはラベル (またはテンプレート音声のファイル名) を小文字にしたもの。
+    """
+
+    def __init__(self, entries: dict[str, TwilioAudio], missing: list[str], build_seconds: float):
+        self._entries = entries
+        self.missing = missing
+        self.build_seconds = build_seconds
+
+    def get(self, key: str) -> TwilioAudio | None:
+        return self._entries.get(key.lower())
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def report(self) -> dict:
+        return {
+            "num_entries": len(self._entries),
+            "num_synthesized": sum(e.source == "synthesized" for e in self._entries.values()),
+            "ulaw_bytes": sum(len(e.ulaw) for e in self._entries.values()),
+            "payload_bytes": sum(len(e.payload) for e in self._entries.values()),
+            "audio_seconds": sum(e.duration_seconds for e in self._entries.values()),
+            "build_seconds": self.build_seconds,
+            "missing": self.missing,
+        }
+
+
+def build_template_audio_cache(
+    recorded: dict[str, AudioSegment],
+    labels: dict[str, str],
+    synthesize: Callable[[str], AudioSegment] | None = None,
+) -> TemplateAudioCache:
+    """テンプレート音声をTwilioへ送る形式に変換したキャッシュを作る
+
+    Args:
+        recorded (dict[str, AudioSegment]): 録音済みの音声 (キーはファイル名の小文字)
+        labels (dict[str, str]): ラベル -> 発話テキスト (tts_label2text)
+        synthesize (Callable[[str], AudioSegment]): 指定した場合、録音のないラベルの
+            テキストを起動時に合成してキャッシュする
+
+    Returns:
+        TemplateAudioCache: 変換済みの音声
+    """
+    tic = time.perf_counter()
+    entries = {key: to_twilio_audio(key, audio) for key, audio in recorded.items()}
+
+    missing = []
+    for label, text in labels.items():
+        key = str(getattr(label, "value", label)).lower()
+        if key in entries:
+            continue
+        if synthesize is None:
+            missing.append(key)
+            continue
+        try:
+            entries[key] = to_twilio_audio(key, synthesize(text), source="synthesized")
+        except Exception as e:
+            logger.warning(f"Failed to synthesize template audio '{key}': {e}")
+            missing.append(key)
+
+    cache = TemplateAudioCache(entries, missing, time.perf_counter() - tic)
+    logger.info(f"Built template audio cache: {cache.report()}")
+    return cache
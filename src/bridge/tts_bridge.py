@@ -1,10 +1,11 @@
 import io
 import json
 import queue
+import asyncio
 import requests
 import base64
-import audioop
-import numpy as np
+import dataclasses
+import itertools
 from pydub import AudioSegment
 from openai import OpenAI
 import threading
@@ -16,8 +17,17 @@ import re
 from google.cloud import texttospeech
 import azure.cognitiveservices.speech as speechsdk
 from abc import abstractmethod
-
-from src.utils import get_custom_logger
+from contextlib import contextmanager
+from typing import Callable
+
+from src.utils import encode_twilio_ulaw, get_custom_logger, segment_samples
+from src.utils.bounded_queue import BoundedQueue, OverflowPolicy
+from src.modules.model_registry import model_registry
+from src.bridge.template_audio_cache import TwilioAudio
+from src.bridge.tts_cache import get_tts_cache, make_cache_key
+from src.bridge.tts_stream import StreamingAudio
+from src.bridge.tts_scheduler import OrderedSynthesisScheduler, ResponsePart, split_first_sentence
+from src.bridge.tts_worker_pool import TTSPriority, TTSWorkerPool, classify_priority
 
 logger = get_custom_logger(__name__)
 
@@ -26,19 +36,58 @@ load_dotenv()
 
 template_dir = Path(__file__).parents[1] / "modules/dialogue/utils/template_audio"
 
+# 合成待ちのテキスト・送信待ちの音声 (発話単位) の上限。どちらも捨てると応答が欠けるため、一杯のときは待つ
+TEXT_QUEUE_SIZE = 64
+AUDIO_QUEUE_SIZE = 32
+# 送信待ちの音声が一杯のとき、合成した音声を追加するまで待つ最大時間 (秒)
+AUDIO_PUT_TIMEOUT = 10
+
+# Azure TTSの声・スタイル・話速 (合成結果のキャッシュのキーにも使う)
+AZURE_VOICE = "ja-JP-NanamiNeural"
+AZURE_STYLE = "customerservice"
+AZURE_RATE = "+10%"
+
 
 # 共通の親クラス
 class BaseTTSBridge:
-    def __init__(self):
-        self.text_queue = queue.Queue()
-        self.audio_queue: queue.Queue[tuple[str, str, AudioSegment]] = queue.Queue()
+    # 共有ワーカープールで同時実行数を制限する単位
+    provider = "default"
+
+    def __init__(self, max_parallel=1, worker_pool: TTSWorkerPool | None = None):
+        """
+        Args:
+            max_parallel (int): async_response_loopで同時に合成する数。2以上の場合、
+                応答の最初の文を分けて合成し、音声は依頼した順に送る (分けた部分のラベルは ResponsePart)
+            worker_pool (TTSWorkerPool): 指定した場合、合成をプロセス内で共有するワーカープールで
+                優先度順に実行する (省略時はasync_response_loopに渡したexecutorで実行する)
+        """
+        self.worker_pool = worker_pool
+        self.text_queue = BoundedQueue(TEXT_QUEUE_SIZE, OverflowPolicy.BLOCK)
+        self.audio_queue: BoundedQueue[tuple[str, str, AudioSegment]] = BoundedQueue(
+            AUDIO_QUEUE_SIZE, OverflowPolicy.BLOCK
+        )
         self._ended = False
         self.stream_sid = None
+        # async_response_loop使用時にテキスト到着を通知するためのイベント
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._text_ready: asyncio.Event | None = None
+        # async_response_loop使用時、送信待ちの音声が追加されるたびにイベントループ上で呼ばれる
+        self.on_audio_ready: Callable[[], None] | None = None
+        self.max_parallel = max_parallel
+        self._scheduler = OrderedSynthesisScheduler(self._deliver_audio, max_parallel)
+        self._response_ids = itertools.count()
 
     def add_response(self, text):
         if text != "":
             logger.info(f"Add response: {text}")
-        self.text_queue.put(text, block=False)
+        # イベントループから呼ばれるため待てない。一杯の場合は合成が止まっているので記録して捨てる
+        if not self.text_queue.offer(text):
+            logger.error(f"TTS text queue is full, dropped response: {text}")
+        self._notify_text_ready()
+
+    def _notify_text_ready(self):
+        if self._text_ready is not None:
+            self._loop.call_soon_threadsafe(self._text_ready.set)
 
     def response_loop(self):
         logger.info("Response loop called.")
@@ -46,10 +95,101 @@ class BaseTTSBridge:
             text = self.text_queue.get()
             self.stream_use_endpoint(text)
 
+    async def async_response_loop(self, executor=None):
+        """response_loopのasyncio版
+
+        専用スレッドを持たず、合成処理 (stream_use_endpoint) のみをexecutorで実行する。
+        max_parallel件まで並列に合成し、音声は依頼した順に送信待ちのキューへ渡す。
+        """
+        logger.info("Async response loop called.")
+        self._loop = asyncio.get_running_loop()
+        self._text_ready = asyncio.Event()
+        while not self._ended:
+            try:
+                text = self.text_queue.get_nowait()
+            except queue.Empty:
+                await self._text_ready.wait()
+                self._text_ready.clear()
+                continue
+            if self._ended:
+                break
+            parts = self.split_text(text)
+            response_id = next(self._response_ids)
+            for index, part in enumerate(parts):
+                info = None
+                if len(parts) > 1:
+                    info = ResponsePart(part, text, response_id, index, len(parts))
+                await self._scheduler.submit(
+                    part, self.stream_use_endpoint, self._executor_for(part, executor), info
+                )
+        logger.info("Async response loop ended.")
+
+    async def synthesize_initial(self, text, executor=None):
+        """初期発話を合成し、送信待ちのキューに入るまで待つ (共有ワーカープールでは最優先で合成する)"""
+        executor = self._executor_for(text, executor, TTSPriority.GREETING)
+        await asyncio.get_running_loop().run_in_executor(executor, self.stream_use_endpoint, text)
+
+    def _executor_for(self, text, executor, priority: TTSPriority | None = None):
+        if self.worker_pool is None:
+            return executor
+        is_template = self.is_template(text)
+        if priority is None:
+            priority = classify_priority(text, is_template)
+        return self.worker_pool.executor(self.synthesis_provider(text), priority)
+
     def terminate(self):
         self._ended = True
-        self.text_queue.put("", block=False)
-        self.audio_queue.put(("", ""), block=False)
+        self.text_queue.offer("")
+        self.audio_queue.offer(("", ""))
+        self._notify_text_ready()
+
+    def split_text(self, text) -> list[str]:
+        """並列に合成する単位に分ける (テンプレート音声は分けない)"""
+        if self.max_parallel <= 1 or not text or self.is_template(text):
+            return [text]
+        return split_first_sentence(text)
+
+    def is_template(self, text) -> bool:
+        return False
+
+    def synthesis_provider(self, text) -> str:
+        """共有ワーカープールで、同時実行数を数えるプロバイダ
+
+        テンプレート発話は変換済みの音声を渡すだけのため、プロバイダの同時実行数に数えない。
+        """
+        return "template" if self.is_template(text) else self.provider
+
+    def _put_audio(self, item):
+        """合成した音声を送信待ちのキューに追加する
+
+        async_response_loopの合成中は、依頼した順に渡すためスケジューラを経由する。
+        応答を分けた部分の音声は、ラベルを ResponsePart に置き換える。
+        """
+        slot = self._scheduler.current_slot
+        if slot is not None:
+            if slot.part is not None:
+                item = (dataclasses.replace(slot.part, label=item[0]), *item[1:])
+            self._scheduler.add(slot, item)
+        else:
+            self._deliver_audio(item)
+
+    def _deliver_audio(self, item):
+        """送信待ちのキューに追加する (一杯の場合は空くまで待つ)"""
+        try:
+            self.audio_queue.put(item, timeout=AUDIO_PUT_TIMEOUT)
+        except queue.Full:
+            logger.error(f"TTS audio queue is full, dropped audio: {item[0]}")
+            return
+        # ストリーミング合成では合成の完了を待たずに送り始めるため、追加した時点で通知する
+        if self._loop is not None and self.on_audio_ready is not None:
+            self._loop.call_soon_threadsafe(self.on_audio_ready)
+
+    def get_metrics(self) -> dict:
+        return {
+            "text_queue": self.text_queue.get_metrics(),
+            "audio_queue": self.audio_queue.get_metrics(),
+            "scheduler": self._scheduler.get_metrics(),
+        }
         
     @property
     def is_empty(self):
@@ -87,18 +227,17 @@ class BaseTTSBridge:
     def trans4twilio(audio: AudioSegment) -> str:
         """Convert audio to Twilio media stream
 
+        8kHzへのリサンプリング・クリップ・μ-law符号化をNumPyで行うため、
+        呼び出し側で set_frame_rate(8000) しておく必要はない。
+
         Args:
             audio (AudioSegment): Audio data
 
         Returns:
             str: Base64 encoded audio payload
         """
-        d = np.array(audio.get_array_of_samples())
-        # factor = 3
-        # d = d[::factor]
-        d = np.clip(d, -30000, 30000, out=None)
-        width = 2
-        mulaw = audioop.lin2ulaw(d, width)
+        samples, sample_rate = segment_samples(audio)
+        mulaw = encode_twilio_ulaw(samples, sample_rate)
         audio_payload = base64.b64encode(mulaw).decode("ascii")
         return audio_payload
 
@@ -126,6 +265,8 @@ class BaseTTSBridge:
 
 
 class GoogleTTSBridge(BaseTTSBridge):
+    provider = "google"
+
     def __init__(self):
         super().__init__()
         self.client = texttospeech.TextToSpeechClient()
@@ -153,7 +294,7 @@ class GoogleTTSBridge(BaseTTSBridge):
             )
             audio_payload = self.trans4twilio(audio)
             out_data = self.get_twilio_media_stream(audio_payload, self.stream_sid)
-            self.audio_queue.put((text, out_data), block=False)
+            self._put_audio((text, out_data))
 
     def get_template_audio(self, text):
         flag = False
@@ -162,7 +303,7 @@ class GoogleTTSBridge(BaseTTSBridge):
             audio = AudioSegment.silent(duration=0.2)
             audio_payload = self.trans4twilio(audio)
             out_data = self.get_twilio_media_stream(audio_payload, self.stream_sid)
-            self.audio_queue.put((text, out_data), block=False)
+            self._put_audio((text, out_data))
             flag = True
         elif text == "FILLER":
             filler_text = random.choice(
@@ -173,12 +314,57 @@ class GoogleTTSBridge(BaseTTSBridge):
         return flag
 
 
-class AzureTTSBridge(BaseTTSBridge):
+class AzureSynthesizerPool:
+    """プロセス内で共有するAzureSynthesizerのプール
+
+    通話ごとにSynthesizer (Azureへの接続) を作らず、使っていないものを通話をまたいで再利用する。
+    同時に使われた数だけ作られるため、共有ワーカープールのプロバイダの上限が接続数の上限になる。
+    pre-forkの親プロセスで作られたSynthesizerは、fork後の子プロセスでは使わない。
+    """
+
     def __init__(self):
-        super().__init__()
-        api_key = os.getenv("AZURE_API_KEY")
-        region = os.getenv("AZURE_REGION")
+        self._idle: dict[tuple, queue.LifoQueue[AzureSynthesizer]] = {}
+        self._lock = threading.Lock()
+        self.num_created = 0
+        # 親プロセスから引き継いだSynthesizer (SDKのスレッドはforkで失われているため、破棄もせずに保持だけする)
+        self._inherited: list[AzureSynthesizer] = []
+
+    def _reset_after_fork(self):
+        """fork後の子プロセスで、親プロセスのSynthesizerと接続を使わないよう空にする"""
+        for idle in self._idle.values():
+            self._inherited.extend(idle.queue)
+        self._idle = {}
+        self._lock = threading.Lock()
+        self.num_created = 0
+
+    @contextmanager
+    def acquire(self, api_key, region, streaming=False):
+        key = (api_key, region, streaming)
+        with self._lock:
+            idle = self._idle.setdefault(key, queue.LifoQueue())
+        try:
+            synthesizer = idle.get_nowait()
+        except queue.Empty:
+            synthesizer = AzureSynthesizer(api_key, region, streaming)
+            with self._lock:
+                self.num_created += 1
+        try:
+            yield synthesizer
+        finally:
+            idle.put(synthesizer)
+
+    def get_metrics(self) -> dict:
+        with self._lock:
+            return {
+                "num_created": self.num_created,
+                "num_idle": sum(idle.qsize() for idle in self._idle.values()),
+            }
+
+
+class AzureSynthesizer:
+    """Azure TTSのSpeechSynthesizer (1つのSynthesizerは同時に1件ずつ合成する)"""
 
+    def __init__(self, api_key, region, streaming=False):
         self.config = speechsdk.SpeechConfig(subscription=api_key, region=region)
         self.config.set_speech_synthesis_output_format(
             speechsdk.SpeechSynthesisOutputFormat.Riff8Khz16BitMonoPcm
@@ -187,73 +373,161 @@ class AzureTTSBridge(BaseTTSBridge):
             speech_config=self.config, audio_config=None
         )
 
+        self.stream: StreamingAudio | None = None
+        self.stream_client = None
+        if streaming:
+            # Twilioへそのまま送れる8kHz μ-lawで合成し、合成中のチャンクを受け取る
+            stream_config = speechsdk.SpeechConfig(subscription=api_key, region=region)
+            stream_config.set_speech_synthesis_output_format(
+                speechsdk.SpeechSynthesisOutputFormat.Raw8Khz8BitMonoMULaw
+            )
+            self.stream_client = speechsdk.SpeechSynthesizer(
+                speech_config=stream_config, audio_config=None
+            )
+            self.stream_client.synthesizing.connect(self._on_synthesizing)
+
+    def _on_synthesizing(self, evt):
+        if self.stream is not None:
+            self.stream.feed(evt.result.audio_data)
+
+
+azure_synthesizer_pool = AzureSynthesizerPool()
+os.register_at_fork(after_in_child=azure_synthesizer_pool._reset_after_fork)
+
+
+class AzureTTSBridge(BaseTTSBridge):
+    provider = "azure"
+
+    def __init__(self, streaming=False, max_parallel=1, worker_pool: TTSWorkerPool | None = None):
+        """
+        Args:
+            streaming (bool): Trueの場合、合成済みの部分から20msのμ-lawフレームとして送る
+                (async_response_loopで使う場合のみ有効)
+            max_parallel (int): 1通話で同時に合成する数
+            worker_pool (TTSWorkerPool): 合成を実行する共有ワーカープール
+        """
+        super().__init__(max_parallel, worker_pool)
+        self._api_key = os.getenv("AZURE_API_KEY")
+        self._region = os.getenv("AZURE_REGION")
+        self.streaming = streaming
+
+    def _synthesizer(self):
+        return azure_synthesizer_pool.acquire(self._api_key, self._region, self.streaming)
+
+    def is_template(self, text) -> bool:
+        if model_registry.get("template_media").get(text) is not None:
+            return True
+        # 断片をつないで作る発話も、分けずに1件として扱う
+        engine = self._slot_audio()
+        return engine is not None and engine.match(text) is not None
+
+    def synthesis_provider(self, text) -> str:
+        # 断片をつなぐ発話でも、名前などのスロットはAzureで合成するため同時実行数に数える
+        engine = self._slot_audio()
+        if engine is not None and model_registry.get("template_media").get(text) is None:
+            matched = engine.match(text)
+            if matched is not None and matched[0].has_free_text:
+                return self.provider
+        return super().synthesis_provider(text)
+
+    @staticmethod
+    def _slot_audio():
+        """起動時に断片を合成済みの場合のみ返す (通話中に全断片の合成を始めないよう、未ロードならNone)"""
+        if not model_registry.is_loaded("slot_audio"):
+            return None
+        return model_registry.get("slot_audio")
+
     def set_connect_info(self, stream_sid):
         self.stream_sid = stream_sid
 
+    @staticmethod
+    def make_ssml(text) -> str:
+        # text = self.adjust_text(text)
+        # 「。」を破線（break）に変換して無音を挿入
+        # text_with_breaks = text.replace("。", "。<break time='200ms'/>")
+        return f"""
+        <speak version='1.0' xml:lang='ja-JP'>
+            <voice xml:lang='ja-JP' name='{AZURE_VOICE}' style='{AZURE_STYLE}'>
+                <prosody rate='{AZURE_RATE}'>
+                    {text}
+                </prosody>
+            </voice>
+        </speak>
+        """
+
+    def synthesize(self, text) -> AudioSegment:
+        """テキストを合成し、音声を返す (出力形式をRiff8Khz16BitMonoPcmにしているため8kHz)"""
+        with self._synthesizer() as synthesizer:
+            result = synthesizer.client.speak_ssml_async(self.make_ssml(text)).get()
+        return AudioSegment.from_file(io.BytesIO(result.audio_data), format="wav")
+
+    def synthesize_cached(self, text) -> TwilioAudio:
+        """キャッシュにない場合のみ合成し、変換済みの音声を返す"""
+        cache = get_tts_cache()
+        key = make_cache_key(AZURE_VOICE, AZURE_STYLE, AZURE_RATE, text)
+        audio = cache.get(key)
+        if audio is None:
+            audio = cache.put(key, self.synthesize(text))
+        return audio
+
+    def _synthesize_streaming(self, text, key):
+        """合成しながら送信待ちのキューにフレームを流し、完了後にキャッシュする"""
+        stream = StreamingAudio(self._loop)
+        # 最初のチャンクが届く前に送信側へ渡し、届いたフレームから順に送らせる
+        self._put_audio((text, stream, None))
+        with self._synthesizer() as synthesizer:
+            synthesizer.stream = stream
+            try:
+                result = synthesizer.stream_client.speak_ssml_async(self.make_ssml(text)).get()
+            finally:
+                synthesizer.stream = None
+                stream.finish()
+        if result.reason != speechsdk.ResultReason.SynthesizingAudioCompleted:
+            raise RuntimeError(f"Azure TTS streaming synthesis failed: {result.reason}")
+        if not stream.cancelled:
+            get_tts_cache().put_ulaw(key, stream.ulaw)
+
     def stream_use_endpoint(self, text):
         try:
             if text == "":
                 self.get_template_audio("APLOGIZE")
             elif not self.get_template_audio(text):
-                # text = self.adjust_text(text)
-                # 「。」を破線（break）に変換して無音を挿入
-                # text_with_breaks = text.replace("。", "。<break time='200ms'/>")
-                ssml = f"""
-                <speak version='1.0' xml:lang='ja-JP'>
-                    <voice xml:lang='ja-JP' name='ja-JP-NanamiNeural' style='customerservice'>
-                        <prosody rate='+10%'>
-                            {text}
-                        </prosody>
-                    </voice>
-                </speak>
-                """
-                result = self.client.speak_ssml_async(ssml).get()
-                audio = AudioSegment.from_file(
-                    io.BytesIO(result.audio_data), format="wav"
-                )
-                audio = audio.set_frame_rate(8000)
-                audio_payload = self.trans4twilio(audio)
-                out_data = self.get_twilio_media_stream(audio_payload, self.stream_sid)
-                self.audio_queue.put(
-                    (
-                        text,
-                        out_data,
-                        # np.ndarray型のaudioを返す
-                        audio.get_array_of_samples(),
-                    ),
-                    block=False,
-                )
+                # 確認の発話は断片をつなぐだけで作れる (名前のみ合成する)
+                engine = self._slot_audio()
+                audio = engine.render(text, self.synthesize_cached) if engine else None
+                if audio is not None:
+                    self._put_audio((text, audio.media_message(self.stream_sid), audio.samples))
+                    return
+                # 同じ文言は通話をまたいで繰り返されるため、合成結果をキャッシュする
+                cache = get_tts_cache()
+                key = make_cache_key(AZURE_VOICE, AZURE_STYLE, AZURE_RATE, text)
+                audio = cache.get(key)
+                if audio is None and self.streaming and self._loop is not None:
+                    self._synthesize_streaming(text, key)
+                    return
+                if audio is None:
+                    audio = cache.put(key, self.synthesize(text))
+                self._put_audio((text, audio.media_message(self.stream_sid), audio.samples))
         except Exception:
             self.get_template_audio("APLOGIZE")
             logger.warning("send apology message due to Azure TTS error")
 
     def get_template_audio(self, text):
         flag = False
-        audiofile_candidates = list(template_dir.glob(f"{text.lower()}.wav"))
+        # テンプレート音声は起動時に (pre-forkの場合は親プロセスで) μ-law・base64まで変換済み
+        audio = model_registry.get("template_media").get(text)
         # text = tts_label2text.get(text, text)
-        logger.info(f"audiofile_candidates: {audiofile_candidates}")
-        if len(audiofile_candidates) > 0:
-            audiofile = random.choice(audiofile_candidates)
-            logger.info(audiofile)
-            audio = AudioSegment.from_file(audiofile, format="wav")
-            audio = audio.set_frame_rate(8000)
-            audio_payload = self.trans4twilio(audio)
-            out_data = self.get_twilio_media_stream(audio_payload, self.stream_sid)
-            self.audio_queue.put(
-                (
-                    text,
-                    out_data,
-                    # np.ndarray型のaudioを返す
-                    audio.get_array_of_samples(),
-                ),
-                block=False,
-            )
+        if audio is not None:
+            logger.info(f"template audio: {audio.key}")
+            self._put_audio((text, audio.media_message(self.stream_sid), audio.samples))
             flag = True
         return flag
 
 
 # OpenAITTSBridgeクラス
 class OpenAITTSBridge(BaseTTSBridge):
+    provider = "openai"
+
     def __init__(self):
         super().__init__()
         self.client = OpenAI()
@@ -289,7 +563,7 @@ class OpenAITTSBridge(BaseTTSBridge):
 
                 audio_payload = self.trans4twilio(audio)
                 out_data = self.get_twilio_media_stream(audio_payload, self.stream_sid)
-                self.audio_queue.put((text + f"->{idx}", out_data), block=False)
+                self._put_audio((text + f"->{idx}", out_data))
                 idx += 1
 
     def get_template_audio(self, text):
@@ -298,6 +572,7 @@ class OpenAITTSBridge(BaseTTSBridge):
 
 # VoiceVoxTTSBridgeクラス
 class VoiceVoxTTSBridge(BaseTTSBridge):
+    provider = "voicevox"
     tenant = os.getenv("TENANT")
     initial_utterance = os.getenv("INITIAL_UTTERANCE")
 
@@ -350,10 +625,9 @@ class VoiceVoxTTSBridge(BaseTTSBridge):
             self.partial_text += text
             audio = self._get_template_audio(text)
             if audio is not None:
-                audio = audio.set_frame_rate(8000)
                 audio_payload = self.trans4twilio(audio)
                 out_data = self.get_twilio_media_stream(audio_payload, self.stream_sid)
-                self.audio_queue.put((text, out_data), block=False)
+                self._put_audio((text, out_data))
                 self.partial_text = ""
             else:
                 if any(char in self.partial_text for char in self.finish_chars):
@@ -369,13 +643,12 @@ class VoiceVoxTTSBridge(BaseTTSBridge):
                     )
                     logger.info(f"VoiceVoxTTSBridge: synthesize {text}")
 
-                    self.audio_queue.put((text, out_data), block=False)
+                    self._put_audio((text, out_data))
                     self.partial_text = ""
 
     def _load_audio(self, path, format=None):
-        audio = AudioSegment.from_file(path, format=format)
-        audio = audio.set_frame_rate(8000)
-        return audio
+        # 8kHzへの変換はtrans4twilioで行う
+        return AudioSegment.from_file(path, format=format)
 
     def _get_template_audio(self, text):
         audio = None
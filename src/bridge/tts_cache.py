@@ -0,0 +1,209 @@
+import base64
+import hashlib
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+
+from pydub import AudioSegment
+
+from src.bridge.template_audio_cache import TwilioAudio, to_twilio_audio
+from src.utils import get_custom_logger, ulaw_decode
+
+logger = get_custom_logger(__name__)
+
+
+def normalize_text(text: str) -> str:
+    """表記揺れで別のキーにならないよう、合成するテキストを正規化する"""
+    text = unicodedata.normalize("NFKC", str(text))
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def make_cache_key(voice: str, style: str, rate: str, text: str) -> str:
+    """声・スタイル・話速・正規化したテキストから、合成結果のキーを作る"""
+    source = "\x1f".join([voice, style, rate, normalize_text(text)])
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+
+class TTSCache:
+    """合成した音声の2段キャッシュ (メモリ上のLRU + ディスク上のμ-law)
+
+    ディスクのキャッシュはファイル名がキーのため、pre-forkの各ワーカーや再起動後の
+    プロセスと共有できる。合計サイズが max_disk_bytes を超えたら、最後に使われたのが
+    古いファイルから削除する。
+    """
+
+    SUFFIX = ".ulaw"
+
+    def __init__(
+        self,
+        max_memory_items: int = 256,
+        disk_dir: str | Path | None = None,
+        max_disk_bytes: int = 256 * 1024**2,
+    ):
+        """
+        Args:
+            max_memory_items (int): メモリ上に保持する音声の数
+            disk_dir (str | Path): ディスクのキャッシュの保存先 (省略時はメモリのみ)
+            max_disk_bytes (int): ディスクのキャッシュの合計サイズの上限
+        """
+        self.max_memory_items = max_memory_items
+        self.disk_dir = Path(disk_dir) if disk_dir is not None else None
+        self.max_disk_bytes = max_disk_bytes
+        self._memory: OrderedDict[str, TwilioAudio] = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes = 0
+
+        self.num_memory_hits = 0
+        self.num_disk_hits = 0
+        self.num_misses = 0
+        self.num_puts = 0
+        self.num_evicted_files = 0
+
+        if self.disk_dir is not None:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            self._disk_bytes = sum(f.stat().st_size for f in self._disk_files())
+
+    def _disk_files(self) -> list[Path]:
+        return list(self.disk_dir.glob(f"*{self.SUFFIX}"))
+
+    def _path(self, key: str) -> Path:
+        return self.disk_dir / f"{key}{self.SUFFIX}"
+
+    def get(self, key: str) -> TwilioAudio | None:
+        with self._lock:
+            audio = self._memory.get(key)
+            if audio is not None:
+                self._memory.move_to_end(key)
+                self.num_memory_hits += 1
+                return audio
+
+        audio = self._read_disk(key)
+        with self._lock:
+            if audio is None:
+                self.num_misses += 1
+                return None
+            self.num_disk_hits += 1
+            self._remember(key, audio)
+        return audio
+
+    def put(self, key: str, audio: AudioSegment) -> TwilioAudio:
+        """合成した音声を変換して保存し、変換後の音声を返す"""
+        return self._store(key, to_twilio_audio(key, audio, source="synthesized"))
+
+    def put_ulaw(self, key: str, ulaw: bytes) -> TwilioAudio:
+        """μ-lawで合成した音声 (ストリーミング合成の結果) を保存する"""
+        return self._store(key, self._from_ulaw(key, ulaw, source="synthesized"))
+
+    def _store(self, key: str, twilio_audio: TwilioAudio) -> TwilioAudio:
+        if not twilio_audio.ulaw:
+            return twilio_audio
+        with self._lock:
+            self.num_puts += 1
+            self._remember(key, twilio_audio)
+        self._write_disk(key, twilio_audio.ulaw)
+        return twilio_audio
+
+    def _remember(self, key: str, audio: TwilioAudio):
+        self._memory[key] = audio
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def _read_disk(self, key: str) -> TwilioAudio | None:
+        if self.disk_dir is None:
+            return None
+        path = self._path(key)
+        try:
+            ulaw = path.read_bytes()
+            # 最後に使われた時刻として更新時刻を使う
+            os.utime(path)
+        except OSError:
+            return None
+        return self._from_ulaw(key, ulaw, source="disk")
+
+    @staticmethod
+    def _from_ulaw(key: str, ulaw: bytes, source: str) -> TwilioAudio:
+        return TwilioAudio(
+            key=key,
+            ulaw=ulaw,
+            payload=base64.b64encode(ulaw).decode("ascii"),
+            samples=ulaw_decode(ulaw),
+            source=source,
+        )
+
+    def _write_disk(self, key: str, ulaw: bytes):
+        if self.disk_dir is None:
+            return
+        path = self._path(key)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            tmp_path.write_bytes(ulaw)
+            # 他のワーカーが読み途中のファイルを壊さないよう、置き換えで書き込む
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to write TTS cache file {path}: {e}")
+            return
+        with self._lock:
+            self._disk_bytes += len(ulaw)
+            if self._disk_bytes <= self.max_disk_bytes:
+                return
+        self._evict_disk()
+
+    def _evict_disk(self):
+        """最後に使われたのが古いファイルから、上限の9割まで削除する"""
+        files = []
+        for f in self._disk_files():
+            try:
+                stat = f.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, f))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        target = int(self.max_disk_bytes * 0.9)
+        num_evicted = 0
+        for _, size, f in files:
+            if total <= target:
+                break
+            try:
+                f.unlink()
+            except OSError:
+                continue
+            total -= size
+            num_evicted += 1
+        with self._lock:
+            self._disk_bytes = total
+            self.num_evicted_files += num_evicted
+        logger.info(f"Evicted {num_evicted} TTS cache files ({total} bytes left)")
+
+    def get_metrics(self) -> dict:
+        with self._lock:
+            hits = self.num_memory_hits + self.num_disk_hits
+            lookups = hits + self.num_misses
+            return {
+                "memory_items": len(self._memory),
+                "disk_bytes": self._disk_bytes if self.disk_dir is not None else None,
+                "num_memory_hits": self.num_memory_hits,
+                "num_disk_hits": self.num_disk_hits,
+                "num_misses": self.num_misses,
+                "hit_rate": hits / lookups if lookups else None,
+                "num_puts": self.num_puts,
+                "num_evicted_files": self.num_evicted_files,
+            }
+
+
+_tts_cache = TTSCache()
+
+
+def configure_tts_cache(**kwargs) -> TTSCache:
+    """プロセス内で共有するTTSキャッシュを設定する (起動時に一度だけ呼ぶ)"""
+    global _tts_cache
+    _tts_cache = TTSCache(**kwargs)
+    return _tts_cache
+
+
+def get_tts_cache() -> TTSCache:
+    return _tts_cache
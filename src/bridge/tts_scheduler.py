@@ -0,0 +1,180 @@
+import asyncio
+import re
+import threading
+from dataclasses import dataclass
+from typing import Callable
+
+from src.utils import get_custom_logger
+
+logger = get_custom_logger(__name__)
+
+SENTENCE_END = re.compile(r"[。！？!?]")
+
+
+def split_first_sentence(text: str) -> list[str]:
+    """最初の文と残りに分ける (文が1つの場合はそのまま返す)
+
+    最初の文だけを分けて先に合成し、再生を早く始める。分けた部分は ResponsePart
+    として送信側に渡し、1つの発話として記録・送信する。
+    """
+    match = SENTENCE_END.search(text)
+    if match is None:
+        return [text]
+    head, rest = text[: match.end()], text[match.end():].strip()
+    return [head, rest] if rest else [head]
+
+
+@dataclass(frozen=True)
+class ResponsePart:
+    """応答を分けて合成した部分の音声のラベル
+
+    送信側は最初の部分で応答全体 (response) を1件の発話として記録し、続きの部分は
+    markの往復を待たずに送る。markは最後の部分を送った後にだけ送る。
+    """
+
+    label: str
+    response: str
+    response_id: int
+    index: int
+    num_parts: int
+
+    @property
+    def is_last(self) -> bool:
+        return self.index == self.num_parts - 1
+
+
+class SynthesisSlot:
+    """1件の合成の出力先 (合成した順ではなく、依頼した順に送信待ちのキューへ渡す)"""
+
+    def __init__(self, text: str, part: ResponsePart | None = None):
+        self.text = text
+        self.part = part
+        self.items: list = []
+        self.done = False
+
+
+class OrderedSynthesisScheduler:
+    """テキストを並列に合成し、音声を依頼した順に送信待ちのキューへ渡す
+
+    先頭の合成が終わっていなくても、先頭で既に出力された音声 (ストリーミング合成の
+    フレームなど) はすぐに渡すため、最初の文の再生は後続の合成を待たない。
+    """
+
+    def __init__(self, deliver: Callable[[object], None], max_parallel: int = 3):
+        """
+        Args:
+            deliver (Callable): 送信待ちのキューへ音声を渡す関数
+            max_parallel (int): 同時に合成する数の上限
+        """
+        self.deliver = deliver
+        self.max_parallel = max_parallel
+        self._slots: list[SynthesisSlot] = []
+        self._lock = threading.Lock()
+        # 送信待ちのキューへ渡すスレッドは1つだけにして、渡す順序を保つ
+        self._deliver_lock = threading.Lock()
+        self._flush_requested = False
+        self._local = threading.local()
+        self._semaphore: asyncio.Semaphore | None = None
+        self._in_flight = 0
+
+        self.num_synthesized = 0
+        self.max_in_flight = 0
+
+    @property
+    def current_slot(self) -> SynthesisSlot | None:
+        """合成中のスレッドに割り当てられた出力先"""
+        return getattr(self._local, "slot", None)
+
+    async def submit(
+        self,
+        text: str,
+        synthesize: Callable[[str], None],
+        executor=None,
+        part: ResponsePart | None = None,
+    ):
+        """合成を依頼する (同時に合成できる数を超えている場合は空くまで待つ)
+
+        Args:
+            part (ResponsePart): 応答を分けた部分の場合、その位置 (出力した音声のラベルに付ける)
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_parallel)
+        slot = SynthesisSlot(text, part)
+        with self._lock:
+            self._slots.append(slot)
+        await self._semaphore.acquire()
+        self._in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self._in_flight)
+        asyncio.get_running_loop().create_task(self._run(slot, synthesize, executor))
+
+    async def _run(self, slot: SynthesisSlot, synthesize, executor):
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                executor, self._synthesize_in_slot, slot, synthesize
+            )
+        except Exception as e:
+            logger.error(f"TTS synthesis failed for '{slot.text}': {e}")
+        finally:
+            self._in_flight -= 1
+            self._semaphore.release()
+            self.num_synthesized += 1
+
+    def _synthesize_in_slot(self, slot: SynthesisSlot, synthesize):
+        self._local.slot = slot
+        try:
+            synthesize(slot.text)
+        finally:
+            self._local.slot = None
+            # キューへの追加は待つことがあるため、イベントループではなく合成スレッドで渡す
+            with self._lock:
+                slot.done = True
+            self.flush()
+
+    def add(self, slot: SynthesisSlot, item):
+        """合成スレッドから出力された音声を受け取る"""
+        with self._lock:
+            slot.items.append(item)
+        self.flush()
+
+    def flush(self):
+        """先頭から順に、渡せる音声を送信待ちのキューへ渡す
+
+        キューへの追加は空きを待つことがあるため、_lock を持たずに渡す。他のスレッドが
+        渡している間は、そのスレッドが続けて渡すため、呼び出したスレッドは待たずに戻る。
+        """
+        with self._lock:
+            self._flush_requested = True
+        while self._deliver_lock.acquire(blocking=False):
+            try:
+                while True:
+                    with self._lock:
+                        if not self._flush_requested:
+                            break
+                        self._flush_requested = False
+                        ready = self._pop_ready()
+                    for item in ready:
+                        self.deliver(item)
+            finally:
+                self._deliver_lock.release()
+            # 解放する直前に依頼された分は、ここで渡す
+            with self._lock:
+                if not self._flush_requested:
+                    return
+
+    def _pop_ready(self) -> list:
+        ready = []
+        while self._slots:
+            head = self._slots[0]
+            ready.extend(head.items)
+            head.items.clear()
+            if not head.done:
+                break
+            self._slots.pop(0)
+        return ready
+
+    def get_metrics(self) -> dict:
+        return {
+            "max_parallel": self.max_parallel,
+            "num_synthesized": self.num_synthesized,
+            "max_in_flight": self.max_in_flight,
+        }
@@ -0,0 +1,76 @@
+import asyncio
+import time
+
+from src.utils.metrics import LatencyHistogram
+
+# 20ms分の8kHz μ-law
+FRAME_BYTES = 160
+# μ-lawの無音 (最後のフレームの穴埋めに使う)
+ULAW_SILENCE = b"\xff"
+
+# 全通話共通: 合成の開始から最初のフレームが届くまでの時間
+first_frame_histogram = LatencyHistogram()
+
+
+def get_tts_stream_metrics() -> dict:
+    return {"first_frame_sec": first_frame_histogram.summary()}
+
+
+class StreamingAudio:
+    """合成中の音声を20msのμ-lawフレームとしてイベントループへ受け渡す
+
+    feed() / finish() は合成SDKのスレッドから、frames() はイベントループから呼ぶ。
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self._frames: asyncio.Queue[bytes | None] = asyncio.Queue()
+        self._pending = bytearray()
+        self._chunks: list[bytes] = []
+        self.started_at = time.monotonic()
+        self.first_frame_at: float | None = None
+        self.num_frames = 0
+        self.finished = False
+        self.cancelled = False
+
+    @property
+    def ulaw(self) -> bytes:
+        """これまでに受け取った音声 (キャッシュへの保存用)"""
+        return b"".join(self._chunks)
+
+    def feed(self, data: bytes):
+        if self.cancelled or not data:
+            return
+        self._chunks.append(bytes(data))
+        self._pending += data
+        while len(self._pending) >= FRAME_BYTES:
+            self._push(bytes(self._pending[:FRAME_BYTES]))
+            del self._pending[:FRAME_BYTES]
+
+    def finish(self):
+        """合成が終わったことを通知する (端数は無音で埋めて1フレームにする)"""
+        if self._pending and not self.cancelled:
+            self._push(bytes(self._pending).ljust(FRAME_BYTES, ULAW_SILENCE))
+            self._pending.clear()
+        self.finished = True
+        self._loop.call_soon_threadsafe(self._frames.put_nowait, None)
+
+    def cancel(self):
+        """バージインなどで、以降のフレームを送らないようにする"""
+        self.cancelled = True
+        self._loop.call_soon_threadsafe(self._frames.put_nowait, None)
+
+    def _push(self, frame: bytes):
+        if self.first_frame_at is None:
+            self.first_frame_at = time.monotonic()
+            first_frame_histogram.observe(self.first_frame_at - self.started_at)
+        self.num_frames += 1
+        self._loop.call_soon_threadsafe(self._frames.put_nowait, frame)
+
+    async def frames(self):
+        """届いた順にフレームを返す (合成の終了またはキャンセルで終わる)"""
+        while True:
+            frame = await self._frames.get()
+            if frame is None or self.cancelled:
+                return
+            yield frame
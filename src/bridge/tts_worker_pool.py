@@ -0,0 +1,205 @@
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Executor, Future
+from enum import IntEnum
+from typing import Callable
+
+from src.bridge.tts_cache import normalize_text
+from src.utils import get_custom_logger
+from src.utils.metrics import LatencyHistogram
+
+logger = get_custom_logger(__name__)
+
+# この文字数以下の発話は短い応答として、長い応答 (店舗案内の回答など) より先に合成する
+SHORT_TEXT_CHARS = 40
+
+
+class TTSPriority(IntEnum):
+    """合成の優先度 (小さいほど先に合成する)"""
+
+    # 初期発話・テンプレート発話 (相手が無音で待っている、またはすぐに終わるもの)
+    GREETING = 0
+    # 確認・質問などの短い応答
+    SHORT = 1
+    # 店舗案内の回答などの長い応答
+    LONG = 2
+
+
+def classify_priority(text: str, is_template: bool = False) -> TTSPriority:
+    if is_template:
+        return TTSPriority.GREETING
+    if len(normalize_text(text)) <= SHORT_TEXT_CHARS:
+        return TTSPriority.SHORT
+    return TTSPriority.LONG
+
+
+# 全通話共通: 合成の依頼から開始までの待ち時間 (優先度ごと)
+wait_histograms = {priority: LatencyHistogram() for priority in TTSPriority}
+
+
+class _Job:
+    def __init__(self, fn, args, priority: TTSPriority, provider: str):
+        self.fn = fn
+        self.args = args
+        self.priority = priority
+        self.provider = provider
+        self.future: Future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class TTSWorkerPool:
+    """プロセス内で共有するTTS合成のワーカープール
+
+    通話ごとに合成用のスレッドを持たず、全通話の合成をここで実行する。
+    待っている合成は優先度の高い順 (同じ優先度なら依頼した順) に実行し、
+    プロバイダごとに同時に実行する数を制限する (制限に達したプロバイダの合成は、
+    他のプロバイダの合成を止めずに待つ)。ワーカーのスレッドは最初の依頼で起動するため、
+    pre-forkの親プロセスで作ってもよい。
+    """
+
+    def __init__(self, max_workers: int = 16, provider_limits: dict[str, int] | None = None):
+        """
+        Args:
+            max_workers (int): ワーカーのスレッド数 (全プロバイダ合計の同時実行数の上限)
+            provider_limits (dict[str, int]): プロバイダ -> 同時に実行する数の上限
+                (指定のないプロバイダはmax_workersまで)
+        """
+        self.max_workers = max_workers
+        self.provider_limits = dict(provider_limits or {})
+        # プロバイダ -> 待っている合成のヒープ (優先度, 依頼順, 合成)
+        self._queues: dict[str, list] = {}
+        self._running: dict[str, int] = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._threads: list[threading.Thread] = []
+        self._shutdown = False
+
+        self.num_completed = 0
+        self.high_watermark = 0
+
+    def submit(
+        self,
+        fn: Callable,
+        *args,
+        priority: TTSPriority = TTSPriority.SHORT,
+        provider: str = "default",
+    ) -> Future:
+        """合成を依頼する (結果はconcurrent.futures.Futureで受け取る)"""
+        job = _Job(fn, args, priority, provider)
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("TTS worker pool is shut down")
+            self._start_workers()
+            heapq.heappush(self._queues.setdefault(provider, []), (priority, next(self._seq), job))
+            self.high_watermark = max(self.high_watermark, self._queue_depth())
+            self._cond.notify()
+        return job.future
+
+    def executor(self, provider: str, priority: TTSPriority) -> Executor:
+        """loop.run_in_executor に渡せる、プロバイダと優先度を指定したExecutor"""
+        return _PoolExecutor(self, provider, priority)
+
+    def _start_workers(self):
+        while len(self._threads) < self.max_workers:
+            thread = threading.Thread(
+                target=self._worker, name=f"tts-worker-{len(self._threads)}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def _queue_depth(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    def _next_job(self) -> _Job | None:
+        """同時実行数に空きのあるプロバイダのうち、最も優先度の高い合成を取り出す"""
+        best = None
+        for provider, queue in self._queues.items():
+            if not queue:
+                continue
+            limit = self.provider_limits.get(provider)
+            if limit is not None and self._running.get(provider, 0) >= limit:
+                continue
+            if best is None or queue[0][:2] < self._queues[best][0][:2]:
+                best = provider
+        if best is None:
+            return None
+        return heapq.heappop(self._queues[best])[2]
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                job = self._next_job()
+                while job is None and not self._shutdown:
+                    self._cond.wait()
+                    job = self._next_job()
+                if job is None:
+                    return
+                self._running[job.provider] = self._running.get(job.provider, 0) + 1
+
+            wait_histograms[job.priority].observe(time.monotonic() - job.enqueued_at)
+            if job.future.set_running_or_notify_cancel():
+                try:
+                    job.future.set_result(job.fn(*job.args))
+                except BaseException as e:
+                    job.future.set_exception(e)
+
+            with self._cond:
+                self._running[job.provider] -= 1
+                self.num_completed += 1
+                # 同時実行数の制限で待っていた合成を実行できるようになったため、全ワーカーに通知する
+                self._cond.notify_all()
+
+    def shutdown(self):
+        """待っている合成を取り消し、ワーカーを終了する"""
+        with self._cond:
+            self._shutdown = True
+            for queue in self._queues.values():
+                for _, _, job in queue:
+                    job.future.cancel()
+                queue.clear()
+            self._cond.notify_all()
+
+    def get_metrics(self) -> dict:
+        with self._cond:
+            metrics = {
+                "max_workers": self.max_workers,
+                "num_workers": len(self._threads),
+                "queue_depth": self._queue_depth(),
+                "queue_depth_by_provider": {p: len(q) for p, q in self._queues.items()},
+                "running_by_provider": dict(self._running),
+                "provider_limits": dict(self.provider_limits),
+                "high_watermark": self.high_watermark,
+                "num_completed": self.num_completed,
+            }
+        metrics["wait_sec"] = {p.name.lower(): h.summary() for p, h in wait_histograms.items()}
+        return metrics
+
+
+class _PoolExecutor(Executor):
+    def __init__(self, pool: TTSWorkerPool, provider: str, priority: TTSPriority):
+        self._pool = pool
+        self._provider = provider
+        self._priority = priority
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        if kwargs:
+            return self._pool.submit(
+                lambda: fn(*args, **kwargs), priority=self._priority, provider=self._provider
+            )
+        return self._pool.submit(fn, *args, priority=self._priority, provider=self._provider)
+
+
+_tts_worker_pool: TTSWorkerPool | None = None
+
+
+def configure_tts_worker_pool(**kwargs) -> TTSWorkerPool:
+    """プロセス内で共有するTTSワーカープールを設定する (起動時に一度だけ呼ぶ)"""
+    global _tts_worker_pool
+    _tts_worker_pool = TTSWorkerPool(**kwargs)
+    return _tts_worker_pool
+
+
+def get_tts_worker_pool() -> TTSWorkerPool | None:
+    return _tts_worker_pool
@@ -5,17 +5,21 @@ import numpy as np
 from scipy import signal
 from src.modules.vap.vap import VAPRealTime
 from src.utils import get_custom_logger
+from src.utils.bounded_queue import BoundedQueue, OverflowPolicy
 
 logger = get_custom_logger(__name__)
 
 
 class AudioSynchronizer:
-    def __init__(self, frame_size=160, sample_rate=8000, target_sample_rate=16000):
+    def __init__(
+        self, frame_size=160, sample_rate=8000, target_sample_rate=16000, max_queue_frames=50
+    ):
         """
         Args:
             frame_size: 入力フレームサイズ（8kHzでの160サンプル = 20ms）
             sample_rate: 入力サンプリングレート（8kHz）
             target_sample_rate: 目標サンプリングレート（16kHz）
+            max_queue_frames: 各キューに保持するフレーム数の上限
         """
         self.frame_size = frame_size
         self.sample_rate = sample_rate
@@ -30,12 +34,12 @@ class AudioSynchronizer:
         self.bot_buffer = np.zeros(self.buffer_size, dtype=np.float32)
         self.user_buffer = np.zeros(self.buffer_size, dtype=np.float32)
 
-        # タイムスタンプ付きバッファ用のキュー
-        self.bot_queue = queue.Queue()
-        self.user_queue = queue.Queue()
+        # タイムスタンプ付きバッファ用のキュー (1秒分を超えたら古いフレームから捨てる)
+        self.bot_queue = BoundedQueue(max_queue_frames, OverflowPolicy.DROP_OLDEST)
+        self.user_queue = BoundedQueue(max_queue_frames, OverflowPolicy.DROP_OLDEST)
 
         # 同期済みフレームキュー
-        self.sync_queue = queue.Queue()
+        self.sync_queue = BoundedQueue(max_queue_frames, OverflowPolicy.DROP_OLDEST)
         self._ended = False
 
         # 同期処理用スレッド
@@ -0,0 +1,74 @@
+"""Twilio向けの音声変換 (8kHzへのリサンプリング + μ-law符号化) のマイクロベンチマーク
+
+以前の変換 (pydubの set_frame_rate + audioop.lin2ulaw) と、NumPyのみの変換
+(BaseTTSBridge.trans4twilio) を、入力のサンプリングレートごとに比較する。
+audioopのないPython (3.13以降) では、以前の変換は計測しない。
+
+Usage:
+    python -m src.loadtest.audio_bench --seconds 3 --repeat 50
+"""
+import argparse
+import base64
+import time
+
+import numpy as np
+from pydub import AudioSegment
+
+from src.bridge.tts_bridge import BaseTTSBridge
+
+try:
+    import audioop
+except ImportError:
+    audioop = None
+
+
+def legacy_trans4twilio(audio: AudioSegment) -> str:
+    """以前の変換 (呼び出し側の set_frame_rate(8000) を含む)"""
+    audio = audio.set_frame_rate(8000)
+    d = np.array(audio.get_array_of_samples())
+    d = np.clip(d, -30000, 30000, out=None)
+    return base64.b64encode(audioop.lin2ulaw(d, 2)).decode("ascii")
+
+
+def make_speech_like(seconds: float, sample_rate: int) -> AudioSegment:
+    """音声に近い帯域の合成信号 (基本周波数の倍音 + 雑音)"""
+    rng = np.random.default_rng(0)
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    x = sum(np.sin(2 * np.pi * 180 * k * t) / k for k in range(1, 12))
+    x = x / np.abs(x).max() * 12000 + rng.normal(0, 500, len(t))
+    return AudioSegment(
+        data=x.astype(np.int16).tobytes(), sample_width=2, frame_rate=sample_rate, channels=1
+    )
+
+
+def measure(fn, audio: AudioSegment, repeat: int) -> float:
+    """1回あたりの時間 (ミリ秒, repeat回の中央値)"""
+    times = []
+    for _ in range(repeat):
+        tic = time.perf_counter()
+        fn(audio)
+        times.append(time.perf_counter() - tic)
+    return float(np.median(times)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=3.0, help="1発話の長さ")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--rates", default="8000,16000,24000")
+    args = parser.parse_args()
+
+    print(f"{args.seconds:.1f} sec utterance, median of {args.repeat} runs")
+    print(f"{'rate':>6} {'legacy ms':>10} {'numpy ms':>10} {'speedup':>8}")
+    for rate in [int(r) for r in args.rates.split(",")]:
+        audio = make_speech_like(args.seconds, rate)
+        new = measure(BaseTTSBridge.trans4twilio, audio, args.repeat)
+        if audioop is None:
+            print(f"{rate:>6} {'-':>10} {new:>10.3f} {'-':>8}")
+            continue
+        legacy = measure(legacy_trans4twilio, audio, args.repeat)
+        print(f"{rate:>6} {legacy:>10.3f} {new:>10.3f} {legacy / new:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+"""Twilio Media Streamsのプロトコルで /ws に同時接続する負荷試験クライアント
+
+各通話は connected/start を送ったあと、WAVファイルを20msごとに実時間で送り、
+ボットの音声を受け取ったらmarkを返す (Twilioと同様に、再生が終わった時点で返す)。
+同時通話数を段階的に増やし、段階ごとに以下を出力する。
+
+- 初期発話までの時間 (time to first audio)
+- ターン遅延 (発話の送信終了から、ボットの音声を最初に受け取るまで)
+- 送信が1フレーム以上遅れたフレーム数 (dropped frames)
+- サーバプロセスのCPU使用率とRSS
+
+Usage:
+    python -m src.loadtest.client --wav caller.wav --concurrency 1,5,10,20
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+import uuid
+import wave
+from dataclasses import dataclass, field
+
+import numpy as np
+import websockets
+
+from src.utils import chunk_generator, get_custom_logger, lin2ulaw, to_pcm16_8khz
+from src.utils.metrics import LatencyHistogram, get_cpu_seconds, get_memory_usage
+
+logger = get_custom_logger(__name__)
+
+FRAME_SECONDS = 0.02
+SAMPLE_RATE = 8000
+SILENCE_PAYLOAD = base64.b64encode(b"\xff" * int(SAMPLE_RATE * FRAME_SECONDS)).decode("ascii")
+
+
+def load_ulaw_frames(wav_path: str) -> list[str]:
+    """WAVファイルを8kHz μ-lawの20msフレーム (base64) に変換する"""
+    with wave.open(wav_path, "rb") as wf:
+        sample_rate = wf.getframerate()
+        num_channels = wf.getnchannels()
+    pcm = b"".join(
+        base64.b64decode(chunk)
+        for _, chunk in chunk_generator(wav_path, FRAME_SECONDS, include_silence=False)
+    )
+    samples = np.frombuffer(pcm, dtype=np.int16)
+    if num_channels > 1:
+        samples = samples[: len(samples) // num_channels * num_channels]
+        samples = samples.reshape(-1, num_channels).mean(axis=1).astype(np.int16)
+    ulaw = lin2ulaw(to_pcm16_8khz(samples, sample_rate))
+
+    frame_bytes = int(SAMPLE_RATE * FRAME_SECONDS)
+    return [
+        base64.b64encode(ulaw[i : i + frame_bytes]).decode("ascii")
+        for i in range(0, len(ulaw) - frame_bytes + 1, frame_bytes)
+    ]
+
+
+@dataclass
+class CallResult:
+    time_to_first_audio: float | None = None
+    turn_latencies: list[float] = field(default_factory=list)
+    frames_sent: int = 0
+    late_frames: int = 0
+    timeouts: int = 0
+    error: str | None = None
+
+
+class SimulatedCall:
+    """1通話分のTwilio側の振る舞いを再現する"""
+
+    def __init__(self, url: str, frames: list[str], num_turns: int, turn_timeout: float):
+        self.url = url
+        self.frames = frames
+        self.num_turns = num_turns
+        self.turn_timeout = turn_timeout
+        self.stream_sid = "MZ" + uuid.uuid4().hex
+        self.call_sid = "CA" + uuid.uuid4().hex
+        self.result = CallResult()
+
+        self._started_at = 0.0
+        # ボットの音声の再生が終わる時刻と、その後に返すmark
+        self._playback_end = 0.0
+        self._pending_marks: list[tuple[float, str]] = []
+        # ユーザの発話を送り終えた時刻 (ボットの応答待ちの間のみ値を持つ)
+        self._awaiting_since: float | None = None
+        self._received_response = False
+
+    def _event(self, event: str, **kwargs) -> str:
+        return json.dumps({"event": event, "streamSid": self.stream_sid, **kwargs})
+
+    async def run(self) -> CallResult:
+        try:
+            async with websockets.connect(self.url, max_size=None) as ws:
+                await ws.send(json.dumps({"event": "connected", "protocol": "Call", "version": "1.0.0"}))
+                await ws.send(
+                    self._event(
+                        "start",
+                        start={
+                            "streamSid": self.stream_sid,
+                            "callSid": self.call_sid,
+                            "accountSid": "AC" + "0" * 32,
+                            "tracks": ["inbound"],
+                            "customParameters": {"From": "+810000000000", "To": "+810000000001"},
+                            "mediaFormat": {"encoding": "audio/x-mulaw", "sampleRate": 8000, "channels": 1},
+                        },
+                    )
+                )
+                self._started_at = time.perf_counter()
+                receiver = asyncio.create_task(self._receive_loop(ws))
+                try:
+                    await self._send_loop(ws)
+                    await ws.send(self._event("stop", stop={"callSid": self.call_sid}))
+                finally:
+                    receiver.cancel()
+        except (websockets.ConnectionClosed, OSError) as e:
+            self.result.error = repr(e)
+        return self.result
+
+    async def _receive_loop(self, ws):
+        async for message in ws:
+            data = json.loads(message)
+            now = time.perf_counter()
+            if data["event"] == "media":
+                if self.result.time_to_first_audio is None:
+                    self.result.time_to_first_audio = now - self._started_at
+                if self._awaiting_since is not None:
+                    self.result.turn_latencies.append(now - self._awaiting_since)
+                    self._awaiting_since = None
+                    self._received_response = True
+                num_samples = len(base64.b64decode(data["media"]["payload"]))
+                self._playback_end = max(self._playback_end, now) + num_samples / SAMPLE_RATE
+            elif data["event"] == "mark":
+                self._pending_marks.append((self._playback_end, data["mark"]["name"]))
+            elif data["event"] == "clear":
+                # clearされた場合、残りのmarkはすぐに返される
+                self._playback_end = now
+                self._pending_marks = [(now, name) for _, name in self._pending_marks]
+
+    def _bot_is_speaking(self, now: float) -> bool:
+        return bool(self._pending_marks) or now < self._playback_end
+
+    async def _send_loop(self, ws):
+        turn = 0
+        frame_index = 0
+        # 初期発話の再生が終わるまで無音を送る
+        phase = "greeting"
+        phase_started = time.perf_counter()
+        next_time = time.perf_counter()
+
+        while True:
+            now = time.perf_counter()
+            for due, name in [m for m in self._pending_marks if m[0] <= now]:
+                self._pending_marks.remove((due, name))
+                await ws.send(self._event("mark", mark={"name": name}))
+
+            if phase == "greeting" and self.result.time_to_first_audio is not None and not self._bot_is_speaking(now):
+                phase, frame_index = "speak", 0
+            elif phase == "listen" and self._received_response and not self._bot_is_speaking(now):
+                turn += 1
+                if turn >= self.num_turns:
+                    return
+                phase, frame_index = "speak", 0
+                self._received_response = False
+            elif phase in ("greeting", "listen") and now - phase_started > self.turn_timeout:
+                self.result.timeouts += 1
+                return
+
+            if phase == "speak":
+                payload = self.frames[frame_index]
+                frame_index += 1
+                if frame_index >= len(self.frames):
+                    phase, phase_started = "listen", now
+                    self._awaiting_since = now
+            else:
+                payload = SILENCE_PAYLOAD
+            await ws.send(self._event("media", media={"track": "inbound", "payload": payload}))
+            self.result.frames_sent += 1
+
+            next_time += FRAME_SECONDS
+            delay = next_time - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif -delay > FRAME_SECONDS:
+                # 実時間から1フレーム以上遅れたフレーム
+                self.result.late_frames += 1
+
+
+class ServerSampler:
+    """負荷試験中にサーバプロセスのCPU使用率とRSSを定期的に記録する"""
+
+    def __init__(self, pid: int | None, interval: float = 0.5):
+        self.pid = pid
+        self.interval = interval
+        self.cpu_percent = LatencyHistogram()
+        self.max_rss_bytes = 0
+
+    async def run(self):
+        if self.pid is None:
+            return
+        last_cpu, last_time = get_cpu_seconds(self.pid), time.perf_counter()
+        while True:
+            await asyncio.sleep(self.interval)
+            cpu, now = get_cpu_seconds(self.pid), time.perf_counter()
+            self.cpu_percent.observe(100 * (cpu - last_cpu) / (now - last_time))
+            last_cpu, last_time = cpu, now
+            self.max_rss_bytes = max(self.max_rss_bytes, get_memory_usage(self.pid).get("rss_bytes", 0))
+
+
+async def run_level(url: str, frames: list[str], concurrency: int, args, server_pid: int | None) -> dict:
+    sampler = ServerSampler(server_pid)
+    sampler_task = asyncio.create_task(sampler.run())
+
+    async def start_call(index: int):
+        # 同時に接続しないよう少しずつずらして開始する
+        await asyncio.sleep(index * args.ramp_interval)
+        return await SimulatedCall(url, frames, args.turns, args.turn_timeout).run()
+
+    results = await asyncio.gather(*(start_call(i) for i in range(concurrency)))
+    sampler_task.cancel()
+
+    ttfa = LatencyHistogram()
+    turn_latency = LatencyHistogram()
+    for result in results:
+        if result.time_to_first_audio is not None:
+            ttfa.observe(result.time_to_first_audio)
+        for latency in result.turn_latencies:
+            turn_latency.observe(latency)
+    frames_sent = sum(r.frames_sent for r in results)
+    late_frames = sum(r.late_frames for r in results)
+    return {
+        "concurrency": concurrency,
+        "errors": sum(r.error is not None for r in results),
+        "timeouts": sum(r.timeouts for r in results),
+        "time_to_first_audio_sec": ttfa.summary(),
+        "turn_latency_sec": turn_latency.summary(),
+        "frames_sent": frames_sent,
+        "dropped_frames": late_frames,
+        "dropped_frame_ratio": late_frames / max(frames_sent, 1),
+        "server_cpu_percent": sampler.cpu_percent.summary(),
+        "server_max_rss_bytes": sampler.max_rss_bytes,
+    }
+
+
+async def run(args, server_pid: int | None):
+    frames = load_ulaw_frames(args.wav)
+    url = args.url
+    for concurrency in [int(c) for c in args.concurrency.split(",")]:
+        report = await run_level(url, frames, concurrency, args, server_pid)
+        print(json.dumps(report, ensure_ascii=False), flush=True)
+
+
+def start_stub_server(args) -> subprocess.Popen:
+    command = [
+        sys.executable, "-m", "src.loadtest.server",
+        "--port", str(args.port),
+        "--asr-latency", str(args.asr_latency),
+        "--tts-latency", str(args.tts_latency),
+        "--llm-latency", str(args.llm_latency),
+        "--num-turns", str(args.turns),
+    ]
+    if args.persistent_asr:
+        command.append("--persistent-asr")
+    if args.asr_script:
+        command.extend(["--asr-script", args.asr_script])
+    if args.tts_streaming:
+        command.append("--tts-streaming")
+    command.extend(["--tts-max-parallel", str(args.tts_max_parallel)])
+    command.extend(["--asr-preroll-ms", str(args.asr_preroll_ms)])
+    command.extend(["--tts-frame-ms", str(args.tts_frame_ms)])
+    command.extend(["--tts-workers", str(args.tts_workers)])
+    command.extend(["--tts-provider-limit", str(args.tts_provider_limit)])
+    log_file = open(args.server_log, "ab")
+    process = subprocess.Popen(
+        command, env=os.environ.copy(), stdout=log_file, stderr=subprocess.STDOUT
+    )
+    # サーバの起動を待つ
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{args.port}/metrics", timeout=1)
+            break
+        except OSError:
+            time.sleep(0.5)
+    return process
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--wav", type=str, required=True, help="発話として送るWAVファイル")
+    parser.add_argument("--concurrency", type=str, default="1,5,10,20", help="同時通話数 (カンマ区切りで段階的に増やす)")
+    parser.add_argument("--turns", type=int, default=3, help="1通話あたりの発話回数")
+    parser.add_argument("--turn-timeout", type=float, default=20.0)
+    parser.add_argument("--ramp-interval", type=float, default=0.05, help="通話の開始間隔 (秒)")
+    parser.add_argument("--url", type=str, default=None, help="接続先 (省略時は代替実装のサーバを起動する)")
+    parser.add_argument("--server-pid", type=int, default=None, help="--url指定時にCPU・RSSを計測するサーバのPID")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--asr-latency", type=float, default=0.3)
+    parser.add_argument("--tts-latency", type=float, default=0.2)
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--persistent-asr", action="store_true")
+    parser.add_argument("--asr-script", type=str, default=None, help="代替ASRの代わりに使うReplayASRBridgeのスクリプト (JSONL)")
+    # 以下は代替実装のサーバを起動する場合に、サーバへそのまま渡す
+    parser.add_argument("--tts-streaming", action="store_true", help="合成済みの部分から送り始める")
+    parser.add_argument("--tts-max-parallel", type=int, default=1, help="1つの応答を並列に合成する数")
+    parser.add_argument("--asr-preroll-ms", type=int, default=0, help="0より大きい場合、VADゲートを使う")
+    parser.add_argument("--tts-frame-ms", type=int, default=0, help="0より大きい場合、音声を実時間に合わせて送る")
+    parser.add_argument("--tts-workers", type=int, default=0, help="0より大きい場合、共有ワーカープールで合成する")
+    parser.add_argument("--tts-provider-limit", type=int, default=4, help="共有ワーカープールでの同時合成数の上限")
+    parser.add_argument("--server-log", type=str, default=os.devnull, help="代替実装のサーバのログの出力先")
+    args = parser.parse_args()
+
+    process = None
+    server_pid = args.server_pid
+    if args.url is None:
+        process = start_stub_server(args)
+        server_pid = process.pid
+        args.url = f"ws://127.0.0.1:{args.port}/ws"
+    try:
+        asyncio.run(run(args, server_pid))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=10)
+
+
+if __name__ == "__main__":
+    main()
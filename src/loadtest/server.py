@@ -0,0 +1,162 @@
+"""外部サービスをローカルの代替実装に置き換えた負荷試験用サーバ
+
+main.py の /ws と同じ流れ (CallSession + DialogBridgeWithIntentClassification) で通話を処理する。
+
+Usage:
+    python -m src.loadtest.server --port 8765 --asr-latency 0.3 --tts-latency 0.2 --llm-latency 0.5
+"""
+import argparse
+import os
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+
+import uvicorn
+from fastapi import FastAPI, WebSocket
+
+from src.bridge.asr_gate import ASRUploadGate
+from src.bridge.asr_replay import ReplayASRBridge, ReplayScript
+from src.bridge.call_session import CallSession, get_call_session_metrics
+from src.bridge.dialog_bridge_with_ic import DialogBridgeWithIntentClassification
+from src.bridge.media_pacer import PacedMediaSender
+from src.bridge.tts_worker_pool import configure_tts_worker_pool, get_tts_worker_pool
+from src.loadtest.stubs import (
+    StubASRBridge,
+    StubConversationLogger,
+    StubDialogueSystem,
+    StubFirestoreClient,
+    StubTTSBridge,
+)
+from src.utils import get_custom_logger
+from src.utils.admission import AdmissionController
+from src.utils.metrics import get_memory_usage
+
+logger = get_custom_logger(__name__)
+
+
+@dataclass
+class StubConfig:
+    asr_latency: float = 0.3
+    tts_latency: float = 0.2
+    tts_streaming: bool = False
+    tts_max_parallel: int = 1
+    llm_latency: float = 0.5
+    num_turns: int = 3
+    persistent_asr: bool = False
+    # 指定した場合、音量による代替ASRの代わりにスクリプトの認識結果を返す
+    asr_script: str | None = None
+    # 0より大きい場合、VADで発話を検出している間だけASRへ音声を送る (プリロールの長さ, ミリ秒)
+    asr_preroll_ms: int = 0
+    # 0より大きい場合、ボットの音声をこの長さ (ミリ秒) のフレームで実時間に合わせて送る
+    tts_frame_ms: int = 0
+    # 0より大きい場合、合成をプロセス内で共有するワーカープール (このスレッド数) で実行する
+    tts_workers: int = 0
+    # 共有ワーカープールでの、スタブTTSの同時実行数の上限
+    tts_provider_limit: int = 4
+
+
+config = StubConfig()
+admission_controller = AdmissionController()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    admission_controller.start()
+    yield
+    await admission_controller.stop()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.get("/metrics")
+async def metrics():
+    return {
+        "pid": os.getpid(),
+        "memory": get_memory_usage(),
+        "call_session": get_call_session_metrics(),
+        "load": admission_controller.get_load(),
+        "tts_worker_pool": get_tts_worker_pool().get_metrics() if get_tts_worker_pool() else {},
+    }
+
+
+def make_asr_bridge_factory():
+    if config.asr_script is not None:
+        script = ReplayScript.load(config.asr_script)
+        return lambda: ReplayASRBridge(script, persistent=config.persistent_asr)
+    return lambda: StubASRBridge(config.asr_latency, persistent=config.persistent_asr)
+
+
+@app.websocket("/ws")
+async def websocket_endpoint(ws: WebSocket):
+    await ws.accept()
+    # connected
+    await ws.receive_json()
+    # start
+    data = await ws.receive_json()
+    stream_sid = data["start"]["streamSid"]
+    call_sid = data["start"]["callSid"]
+
+    dialog_bridge = DialogBridgeWithIntentClassification(
+        dialogue_system=StubDialogueSystem(config.llm_latency, config.num_turns),
+        media_pacer=PacedMediaSender(config.tts_frame_ms) if config.tts_frame_ms > 0 else None,
+    )
+    session = CallSession(
+        ws,
+        stream_sid,
+        dialog_bridge,
+        StubTTSBridge(
+            config.tts_latency,
+            streaming=config.tts_streaming,
+            max_parallel=config.tts_max_parallel,
+            worker_pool=get_tts_worker_pool(),
+        ),
+        StubFirestoreClient(),
+        StubConversationLogger(call_sid),
+        asr_bridge_factory=make_asr_bridge_factory(),
+        asr_gate=ASRUploadGate(preroll_ms=config.asr_preroll_ms) if config.asr_preroll_ms > 0 else None,
+    )
+    admission_controller.register(call_sid, session)
+    try:
+        await session.start()
+        await session.run()
+    finally:
+        admission_controller.unregister(call_sid)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--asr-latency", type=float, default=config.asr_latency)
+    parser.add_argument("--tts-latency", type=float, default=config.tts_latency)
+    parser.add_argument("--llm-latency", type=float, default=config.llm_latency)
+    parser.add_argument("--num-turns", type=int, default=config.num_turns)
+    parser.add_argument("--persistent-asr", action="store_true")
+    parser.add_argument("--tts-streaming", action="store_true")
+    parser.add_argument("--tts-max-parallel", type=int, default=config.tts_max_parallel)
+    parser.add_argument("--asr-script", type=str, default=None, help="ReplayASRBridgeで使うJSONLスクリプト")
+    parser.add_argument("--asr-preroll-ms", type=int, default=0, help="0より大きい場合、VADゲートを使う")
+    parser.add_argument("--tts-frame-ms", type=int, default=0, help="0より大きい場合、音声を実時間に合わせて送る")
+    parser.add_argument("--tts-workers", type=int, default=0, help="0より大きい場合、共有ワーカープールで合成する")
+    parser.add_argument("--tts-provider-limit", type=int, default=config.tts_provider_limit)
+    args = parser.parse_args()
+
+    config.asr_latency = args.asr_latency
+    config.tts_latency = args.tts_latency
+    config.llm_latency = args.llm_latency
+    config.num_turns = args.num_turns
+    config.persistent_asr = args.persistent_asr
+    config.tts_streaming = args.tts_streaming
+    config.tts_max_parallel = args.tts_max_parallel
+    config.asr_script = args.asr_script
+    config.asr_preroll_ms = args.asr_preroll_ms
+    config.tts_frame_ms = args.tts_frame_ms
+    if args.tts_workers > 0:
+        configure_tts_worker_pool(
+            max_workers=args.tts_workers, provider_limits={"stub": args.tts_provider_limit}
+        )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""負荷試験用に外部サービス (ASR, TTS, LLM, Firestore) を置き換えるローカル実装
+
+いずれも本番のクラスと同じインターフェースを持ち、指定した遅延の後に
+固定の結果を返す。ネットワークを使わないため、サーバ側のCPU・メモリの
+使い方だけを計測できる。
+"""
+import base64
+import queue
+import threading
+import time
+
+import numpy as np
+
+from src.bridge.asr_bridge import BaseASRBridge
+from src.bridge.tts_bridge import BaseTTSBridge
+from src.bridge.tts_stream import StreamingAudio
+from src.bridge.tts_worker_pool import TTSWorkerPool
+from src.modules.dialogue.utils.constants import VADConfig
+from src.utils import get_custom_logger, ulaw_decode
+
+logger = get_custom_logger(__name__)
+
+
+class StubASRBridge(BaseASRBridge):
+    """音量で発話を検出し、asr_latency秒後に固定の認識結果を返すASRBridgeの代替"""
+
+    def __init__(
+        self,
+        asr_latency: float = 0.3,
+        transcript: str = "明日の19時に2名で予約したいです",
+        persistent: bool = False,
+    ):
+        super().__init__(persistent)
+        self.asr_latency = asr_latency
+        self.transcript = transcript
+
+        self._queue = queue.Queue()
+        self._ended = False
+        self._lock = threading.Lock()
+        # (結果を反映する時刻, 認識結果, is_final)
+        self._pending: list[tuple[float, str, bool]] = []
+        self._in_speech = False
+        self._silent_frames = 0
+
+    def start(self):
+        while not self._ended:
+            try:
+                chunk = self._queue.get(timeout=0.02)
+            except queue.Empty:
+                chunk = None
+            if chunk is not None:
+                self._detect_speech(chunk)
+            self._apply_due_results()
+
+    def _detect_speech(self, chunk: bytes):
+        power = np.abs(ulaw_decode(chunk).astype(np.int32)).mean()
+        now = time.monotonic()
+        if power > VADConfig.VOLUME_THRESHOLD:
+            if not self._in_speech:
+                self._pending.append((now + self.asr_latency, self.transcript[:4], False))
+            self._in_speech = True
+            self._silent_frames = 0
+        elif self._in_speech:
+            self._silent_frames += 1
+            # 200msの無音で発話の区切りとみなし、確定結果を返す
+            if self._silent_frames >= 10:
+                self._pending.append((now + self.asr_latency, self.transcript, True))
+                self._in_speech = False
+
+    def _apply_due_results(self):
+        now = time.monotonic()
+        while self._pending and self._pending[0][0] <= now:
+            _, transcript, is_final = self._pending.pop(0)
+            with self._lock:
+                self.transcription = transcript
+                self.is_final = is_final
+                self._publish_hypothesis()
+
+    def add_request(self, buffer):
+        self._queue.put(bytes(buffer), block=False)
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def end_utterance(self):
+        with self._lock:
+            self.transcription = ""
+            self.is_final = False
+            self._clear_hypotheses()
+
+    def reset(self):
+        self.end_utterance()
+
+    def terminate(self):
+        self._ended = True
+        self._queue.put(None)
+
+
+class StubTTSBridge(BaseTTSBridge):
+    """tts_latency秒待ってから、文字数に比例した長さの無音を返すTTSBridgeの代替"""
+
+    # 1文字あたりの発話時間 (秒)
+    SECONDS_PER_CHAR = 0.12
+
+    provider = "stub"
+
+    def __init__(
+        self,
+        tts_latency: float = 0.2,
+        streaming: bool = False,
+        max_parallel: int = 1,
+        worker_pool: TTSWorkerPool | None = None,
+    ):
+        super().__init__(max_parallel, worker_pool)
+        self.tts_latency = tts_latency
+        self.streaming = streaming
+
+    def set_connect_info(self, stream_sid):
+        self.stream_sid = stream_sid
+
+    def stream_use_endpoint(self, text):
+        num_samples = int(8000 * self.SECONDS_PER_CHAR * max(len(text), 1))
+        if self.streaming and self._loop is not None:
+            # tts_latencyの間に4回に分けて音声が届く
+            stream = StreamingAudio(self._loop)
+            self._put_audio((text, stream, None))
+            for _ in range(4):
+                time.sleep(self.tts_latency / 4)
+                stream.feed(b"\xff" * (num_samples // 4))
+            stream.finish()
+            return
+        time.sleep(self.tts_latency)
+        # μ-lawの0xFFは無音
+        audio_payload = base64.b64encode(b"\xff" * num_samples).decode("ascii")
+        out_data = self.get_twilio_media_stream(audio_payload, self.stream_sid)
+        self._put_audio((text, out_data, np.zeros(num_samples, dtype=np.int16)))
+
+    def get_template_audio(self, text):
+        return False
+
+
+class StubDST:
+    def get_current_state(self) -> dict:
+        return {}
+
+
+class StubDialogueSystem:
+    """llm_latency秒待ってから固定の応答を返し、num_turnsターンで完了するDialogueSystemの代替"""
+
+    def __init__(self, llm_latency: float = 0.5, num_turns: int = 3):
+        self.llm_latency = llm_latency
+        self.num_turns = num_turns
+        self.initial_message = "お電話ありがとうございます。ご用件をお話しください。"
+        self.current_state = {"state": {}}
+        self.dst = StubDST()
+        self.awaiting_final_confirmation = False
+        self._turn = 0
+
+    def process_message(self, message: str) -> list[str]:
+        time.sleep(self.llm_latency)
+        self._turn += 1
+        if self.is_complete():
+            return ["ご予約を承りました。お電話ありがとうございました。"]
+        return ["承知しました。人数とお名前を教えてください。"]
+
+    def is_complete(self) -> bool:
+        return self._turn >= self.num_turns
+
+
+class StubFirestoreClient:
+    def __init__(self):
+        self.num_events = 0
+
+    def get_timestamp(self):
+        return time.time()
+
+    def add_conversation_event(self, event_data: dict):
+        self.num_events += 1
+        return str(self.num_events)
+
+
+class StubConversationLogger:
+    def __init__(self, call_sid: str):
+        self.call_sid = call_sid
+        self.entries = []
+
+    def add_log_entry(self, speaker: str, message: str, **kwargs):
+        self.entries.append((speaker, message))
@@ -4,3 +4,4 @@ from src.modules.dialogue.dst import RuleDST
 from src.modules.dialogue.nlg import TemplateNLG
 from src.modules.dialogue.utils._template import templates as _templates
 from src.modules.dialogue.utils.template import templates, conversation_flow
+from src.modules.model_registry import ModelRegistry, model_registry
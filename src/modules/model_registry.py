@@ -0,0 +1,167 @@
+import threading
+import time
+from dataclasses import dataclass, asdict
+from typing import Any, Callable
+
+from src.utils import get_custom_logger
+from src.utils.metrics import get_rss_bytes
+
+logger = get_custom_logger(__name__)
+
+
+@dataclass
+class ResourceStats:
+    """ロード済みリソースの計測結果"""
+    name: str
+    load_seconds: float
+    rss_before_bytes: int
+    rss_after_bytes: int
+
+    @property
+    def rss_delta_bytes(self) -> int:
+        return self.rss_after_bytes - self.rss_before_bytes
+
+    def to_dict(self) -> dict:
+        stats = asdict(self)
+        stats["rss_delta_bytes"] = self.rss_delta_bytes
+        return stats
+
+
+class ModelRegistry:
+    """プロセス内で共有する読み取り専用の重いリソース (GiNZA, テンプレート, テンプレート音声, VAP重み) を管理する
+
+    各リソースは最初に要求された時点 (またはwarmup時) に一度だけロードされ、
+    以降の通話では同じオブジェクトが返される。通話ごとの状態は呼び出し側
+    (StreamingNLUModule, VAPRealTime など) が保持する。
+    """
+
+    def __init__(self):
+        self._loaders: dict[str, Callable[[], Any]] = {}
+        self._resources: dict[str, Any] = {}
+        self._stats: dict[str, ResourceStats] = {}
+        # ローダーから他のリソースを取得できるよう再入可能なロックを使う
+        self._lock = threading.RLock()
+
+    def register(self, name: str, loader: Callable[[], Any]):
+        """リソースのローダーを登録する
+
+        Args:
+            name (str): リソース名
+            loader (Callable[[], Any]): リソースを生成する関数
+        """
+        with self._lock:
+            self._loaders[name] = loader
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._resources
+
+    def get(self, name: str) -> Any:
+        """リソースを取得する (未ロードの場合はここでロードする)
+
+        Args:
+            name (str): リソース名
+
+        Returns:
+            Any: ロード済みのリソース
+        """
+        resource = self._resources.get(name)
+        if resource is not None:
+            return resource
+
+        with self._lock:
+            if name in self._resources:
+                return self._resources[name]
+            if name not in self._loaders:
+                raise KeyError(f"Unknown resource: {name}")
+
+            rss_before = get_rss_bytes()
+            tic = time.perf_counter()
+            resource = self._loaders[name]()
+            load_seconds = time.perf_counter() - tic
+            stats = ResourceStats(
+                name=name,
+                load_seconds=load_seconds,
+                rss_before_bytes=rss_before,
+                rss_after_bytes=get_rss_bytes(),
+            )
+            self._resources[name] = resource
+            self._stats[name] = stats
+
+        logger.info(
+            "Loaded resource '%s' in %.3f sec (rss +%.1f MB)",
+            name,
+            stats.load_seconds,
+            stats.rss_delta_bytes / 1024**2,
+        )
+        return resource
+
+    def warmup(self, names: list[str] | None = None):
+        """指定したリソース (省略時は登録済みの全リソース) を事前にロードする"""
+        if names is None:
+            names = list(self._loaders.keys())
+        for name in names:
+            self.get(name)
+
+    def report(self) -> dict[str, dict]:
+        """ロード済みリソースごとのロード時間とRSS増分を返す"""
+        return {name: stats.to_dict() for name, stats in self._stats.items()}
+
+
+def _load_ginza():
+    import spacy
+
+    return spacy.load("ja_ginza")
+
+
+def _load_template_audio():
+    from pydub import AudioSegment
+    from src.bridge.tts_bridge import template_dir
+
+    # ファイル名 (小文字) -> 音声 (8kHzへの変換はTwilio向けに変換するときに行う)
+    return {
+        path.stem.lower(): AudioSegment.from_file(path, format="wav")
+        for path in sorted(template_dir.glob("*.wav"))
+    }
+
+
+def load_template_media(synthesize=None):
+    """テンプレート発話をTwilioへ送る形式 (μ-law, base64) に変換したキャッシュを作る
+
+    Args:
+        synthesize (Callable[[str], AudioSegment]): 指定した場合、録音のないラベルを起動時に合成する
+    """
+    from src.bridge.template_audio_cache import build_template_audio_cache
+    from src.modules.dialogue.utils.constants import TTSLabel
+    from src.modules.dialogue.utils.template import tts_label2text
+
+    labels = {label: tts_label2text.get(label, label.value) for label in TTSLabel}
+    return build_template_audio_cache(model_registry.get("template_audio"), labels, synthesize)
+
+
+def load_slot_audio(synthesize):
+    """確認の発話をつなぐための断片 (月日・時刻・人数・定型句) を合成したエンジンを作る
+
+    Args:
+        synthesize (Callable[[str], TwilioAudio]): 断片を合成する関数
+    """
+    from src.bridge.slot_audio import build_slot_audio_engine
+    from src.modules.dialogue.utils.template import templates
+
+    return build_slot_audio_engine(templates["scenes"], synthesize)
+
+
+def _load_vap():
+    # torchは開発用依存のため、VAPを使う場合にのみimportする
+    from src.modules.vap.vap import load_vap_model
+
+    return load_vap_model()
+
+
+# サーバ起動時 (pre-forkの場合はfork前) にロードするリソースの既定値
+DEFAULT_WARMUP_MODELS = ["ginza", "template_audio", "template_media"]
+
+model_registry = ModelRegistry()
+model_registry.register("ginza", _load_ginza)
+model_registry.register("template_audio", _load_template_audio)
+model_registry.register("template_media", load_template_media)
+model_registry.register("vap", _load_vap)
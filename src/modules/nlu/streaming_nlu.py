@@ -1,7 +1,8 @@
-import spacy
+from collections import OrderedDict
 from enum import Enum
 from dataclasses import dataclass, field
 from src.utils import get_custom_logger
+from src.modules.model_registry import model_registry
 from src.modules.nlu.process_text import process_date, process_time, process_person_count
 from src.modules.nlu.validation import validate_date, validate_person_count, validate_time
 
@@ -47,14 +48,16 @@ class NLUStatus:
 
 class StreamingNLUModule:
     MAX_TOKENS_POST_TERMINAL = 2
+    # 発話終了前に解析しておく結果の数 (確定部分が伸びるたびに解析するため、直近のものだけ残す)
+    PREFETCH_CACHE_SIZE = 4
 
-    def __init__(self, slot_keys: list[str] = None):
+    def __init__(self, slot_keys: list[str] = None, nlp=None):
         if slot_keys is None:
             slot_keys = []
 
-        # spaCyの日本語モデルをロード
+        # spaCyの日本語モデルはプロセス内で共有する (未ロードの場合はここでロード)
         try:
-            self.nlp = spacy.load("ja_ginza")
+            self.nlp = nlp if nlp is not None else model_registry.get("ginza")
         except OSError:
             logger.error("日本語モデル 'ja_ginza' が見つかりません。")
             raise
@@ -71,13 +74,34 @@ class StreamingNLUModule:
         self.terminal_forms = []
         self.faq_response = None
         self._hearing_item = ""  # ヒアリング項目を保持する変数
+        # ASR結果の確定部分を発話終了前に解析しておく (前処理後のテキスト -> doc)
+        self._prefetched: OrderedDict[str, object] = OrderedDict()
 
     def update_doc(self, text: str):
         if not text:
             logger.warning("空のテキストが渡されました。")
             self.doc = None
         else:
-            self.doc = self.nlp(text)
+            # 解析結果はprefetch()を実行するスレッドからも更新されるため、取り出しは1回で行う
+            self.doc = self._prefetched.get(text)
+            if self.doc is None:
+                self.doc = self.nlp(text)
+
+    def prefetch(self, text: str):
+        """発話終了の前に、process()で使う解析結果を作っておく"""
+        text = self._preprocess_text(text)
+        if not text:
+            return
+        if text in self._prefetched:
+            return
+        # 共有したGiNZAパイプラインは複数のスレッドから同時に呼んでよい (通話ごとに直列化しない)
+        self._prefetched[text] = self.nlp(text)
+        while len(self._prefetched) > self.PREFETCH_CACHE_SIZE:
+            self._prefetched.popitem(last=False)
+
+    def clear_prefetch(self):
+        """発話の区切りで、前の発話の解析結果を捨てる"""
+        self._prefetched.clear()
             
     def validate_entity(self, label, value):
         flag = False
@@ -30,6 +30,8 @@ class VolumeBasedVADModel:
         self.slow_speech_end_flag = False
         self.chunk_speech_end_results = []
         self.speech_chunks = []
+        # 直前のチャンクが発話を含んでいたか
+        self.last_is_speech = False
 
     def init_state(self):
         self.buffer = np.array([])
@@ -60,6 +62,7 @@ class VolumeBasedVADModel:
             # logger.info(f"power: {power}")
         # logger.debug(self.buffer)
         is_speech = any(speech_flags)
+        self.last_is_speech = is_speech
         if is_speech:
             self.speech_chunks.append(is_speech)
             logger.debug(f"Speech detected: {len(self.speech_chunks)}")
@@ -123,23 +123,65 @@ class VapGPT(nn.Module):
         return F.binary_cross_entropy_with_logits(vad_output, vad)
 
 
+def _init_encoder_params(vap: VapGPT, state_dict):
+    # The downsampling parameters are not loaded by "load_state_dict"
+    vap.encoder1.downsample[1].weight = nn.Parameter(
+        state_dict["encoder.downsample.1.weight"]
+    )
+    vap.encoder1.downsample[1].bias = nn.Parameter(
+        state_dict["encoder.downsample.1.bias"]
+    )
+    vap.encoder1.downsample[2].ln.weight = nn.Parameter(
+        state_dict["encoder.downsample.2.ln.weight"]
+    )
+    vap.encoder1.downsample[2].ln.bias = nn.Parameter(
+        state_dict["encoder.downsample.2.ln.bias"]
+    )
+
+    vap.encoder2.downsample[1].weight = nn.Parameter(
+        state_dict["encoder.downsample.1.weight"]
+    )
+    vap.encoder2.downsample[1].bias = nn.Parameter(
+        state_dict["encoder.downsample.1.bias"]
+    )
+    vap.encoder2.downsample[2].ln.weight = nn.Parameter(
+        state_dict["encoder.downsample.2.ln.weight"]
+    )
+    vap.encoder2.downsample[2].ln.bias = nn.Parameter(
+        state_dict["encoder.downsample.2.ln.bias"]
+    )
+
+
+def load_vap_model(device: str = "cpu") -> VapGPT:
+    """学習済みのCPC/VAP重みを読み込んだ推論用モデルを返す
+
+    モデルは推論時に状態を持たないため、プロセス内の全通話で共有できる。
+    """
+    vap = VapGPT(VapConfig())
+    sd = torch.load(VAP_MODEL_PATH, map_location=torch.device("cpu"))
+    vap.load_encoder(cpc_model=CPC_MODEL_PATH)
+    vap.load_state_dict(sd, strict=False)
+    _init_encoder_params(vap, sd)
+    vap.to(device)
+    return vap.eval()
+
+
 class VAPRealTime:
     BINS_P_NOW = [0, 1]
     BINS_PFUTURE = [2, 3]
 
-    def __init__(self, frame_rate: int = 20, context_len_sec: float = 2.5):
-        conf = VapConfig()
-        self.vap = VapGPT(conf)
-
+    def __init__(
+        self,
+        frame_rate: int = 20,
+        context_len_sec: float = 2.5,
+        model: VapGPT | None = None,
+    ):
         self.device = "cpu"
-        sd = torch.load(VAP_MODEL_PATH, map_location=torch.device("cpu"))
-        self.vap.load_encoder(cpc_model=CPC_MODEL_PATH)
-        self.vap.load_state_dict(sd, strict=False)
-
-        self._init_encoder_params(sd)
+        if model is None:
+            from src.modules.model_registry import model_registry
 
-        self.vap.to(self.device)
-        self.vap = self.vap.eval()
+            model = model_registry.get("vap")
+        self.vap = model
 
         self.frame_rate = frame_rate
         self.audio_context_len = int(context_len_sec * frame_rate)
@@ -159,33 +201,6 @@ class VAPRealTime:
             f"Initialized VAPRealTime with frame_rate={frame_rate}, context_len={context_len_sec}"
         )
 
-    def _init_encoder_params(self, state_dict):
-        self.vap.encoder1.downsample[1].weight = nn.Parameter(
-            state_dict["encoder.downsample.1.weight"]
-        )
-        self.vap.encoder1.downsample[1].bias = nn.Parameter(
-            state_dict["encoder.downsample.1.bias"]
-        )
-        self.vap.encoder1.downsample[2].ln.weight = nn.Parameter(
-            state_dict["encoder.downsample.2.ln.weight"]
-        )
-        self.vap.encoder1.downsample[2].ln.bias = nn.Parameter(
-            state_dict["encoder.downsample.2.ln.bias"]
-        )
-
-        self.vap.encoder2.downsample[1].weight = nn.Parameter(
-            state_dict["encoder.downsample.1.weight"]
-        )
-        self.vap.encoder2.downsample[1].bias = nn.Parameter(
-            state_dict["encoder.downsample.1.bias"]
-        )
-        self.vap.encoder2.downsample[2].ln.weight = nn.Parameter(
-            state_dict["encoder.downsample.2.ln.weight"]
-        )
-        self.vap.encoder2.downsample[2].ln.bias = nn.Parameter(
-            state_dict["encoder.downsample.2.ln.bias"]
-        )
-
     def _pad_audio(self, audio: torch.Tensor) -> torch.Tensor:
         """音声データを必要な長さにパディング"""
         current_size = audio.shape[-1]
@@ -0,0 +1,118 @@
+import asyncio
+import time
+
+from src.utils import get_custom_logger
+from src.utils.metrics import LatencyHistogram
+
+logger = get_custom_logger(__name__)
+
+
+class AdmissionController:
+    """ワーカーごとの同時通話数とイベントループの遅延を監視し、新規通話の受付可否を判定する
+
+    /twiml で受け付けた通話は、WebSocketが接続されるまで予約として数える。
+    同時通話数が上限に達している場合、またはイベントループの遅延が閾値を
+    超えている場合 (上限を設定しない場合の自己計測による判定) は受け付けない。
+    """
+
+    def __init__(
+        self,
+        max_calls: int = 0,
+        max_loop_lag: float = 0.1,
+        reservation_ttl: float = 15.0,
+        lag_check_interval: float = 0.5,
+    ):
+        """
+        Args:
+            max_calls (int): 同時通話数の上限 (0以下の場合は上限なし)
+            max_loop_lag (float): 受付を止めるイベントループ遅延 (秒)
+            reservation_ttl (float): /twimlの受付からWebSocket接続までを待つ時間 (秒)
+            lag_check_interval (float): イベントループ遅延の計測間隔 (秒)
+        """
+        self.max_calls = max_calls
+        self.max_loop_lag = max_loop_lag
+        self.reservation_ttl = reservation_ttl
+        self.lag_check_interval = lag_check_interval
+
+        self.sessions: dict[str, object] = {}
+        self._reservations: dict[str, float] = {}
+        self.loop_lag = 0.0
+        self.loop_lag_histogram = LatencyHistogram()
+        self.num_admitted = 0
+        self.num_rejected = 0
+        self._monitor_task: asyncio.Task | None = None
+
+    def start(self):
+        """イベントループ遅延の計測を開始する (イベントループ上で呼ぶ)"""
+        self._monitor_task = asyncio.create_task(self._monitor_loop_lag())
+
+    async def stop(self):
+        if self._monitor_task is not None:
+            self._monitor_task.cancel()
+            try:
+                await self._monitor_task
+            except asyncio.CancelledError:
+                pass
+
+    async def _monitor_loop_lag(self):
+        while True:
+            tic = time.perf_counter()
+            await asyncio.sleep(self.lag_check_interval)
+            self.loop_lag = max(0.0, time.perf_counter() - tic - self.lag_check_interval)
+            self.loop_lag_histogram.observe(self.loop_lag)
+
+    @property
+    def num_active_calls(self) -> int:
+        return len(self.sessions)
+
+    @property
+    def num_reserved_calls(self) -> int:
+        now = time.monotonic()
+        for call_sid, reserved_at in list(self._reservations.items()):
+            if now - reserved_at > self.reservation_ttl:
+                del self._reservations[call_sid]
+        return len(self._reservations)
+
+    def rejection_reason(self) -> str | None:
+        """新規通話を受け付けられない理由を返す (受け付けられる場合はNone)"""
+        if self.max_calls > 0 and self.num_active_calls + self.num_reserved_calls >= self.max_calls:
+            return "max_calls"
+        if self.loop_lag > self.max_loop_lag:
+            return "loop_lag"
+        return None
+
+    def try_admit(self, call_sid: str) -> bool:
+        """新規通話を受け付ける場合はTrueを返し、WebSocket接続まで枠を予約する"""
+        reason = self.rejection_reason()
+        if reason is not None:
+            self.num_rejected += 1
+            logger.warning(f"Rejected call {call_sid} ({reason}): {self.get_load()}")
+            return False
+        self.num_admitted += 1
+        self._reservations[call_sid] = time.monotonic()
+        return True
+
+    def register(self, call_sid: str, session):
+        self._reservations.pop(call_sid, None)
+        self.sessions[call_sid] = session
+
+    def unregister(self, call_sid: str):
+        self.sessions.pop(call_sid, None)
+
+    def get_load(self) -> dict:
+        """現在の負荷 (通話数, ステージごとのキュー長, イベントループ遅延) を返す"""
+        queue_depths: dict[str, int] = {}
+        for session in list(self.sessions.values()):
+            for stage, depth in session.queue_depths().items():
+                queue_depths[stage] = queue_depths.get(stage, 0) + depth
+        return {
+            "active_calls": self.num_active_calls,
+            "reserved_calls": self.num_reserved_calls,
+            "max_calls": self.max_calls,
+            "accepting": self.rejection_reason() is None,
+            "queue_depths": queue_depths,
+            "loop_lag_sec": self.loop_lag,
+            "loop_lag_histogram_sec": self.loop_lag_histogram.summary(),
+            "num_admitted": self.num_admitted,
+            "num_rejected": self.num_rejected,
+        }
@@ -1,5 +1,8 @@
 import base64
 import wave
+from functools import lru_cache
+from math import gcd
+
 import numpy as np
 
 import librosa
@@ -20,6 +23,126 @@ def ulaw_decode(x: bytes) -> NDArray[np.int16]:
     return x_inv_int16
 
 
+TWILIO_SAMPLE_RATE = 8000
+# Twilioへ送る音声の振幅の上限 (μ-lawの最大値付近で音が割れないよう、少し手前で切る)
+TWILIO_CLIP = 30000
+
+
+def _build_ulaw_table() -> NDArray[np.uint8]:
+    """16bit PCMの全ての値 (uint16として見た値) -> μ-law の変換表
+
+    audioop.lin2ulaw と同じく、14bitに落としてからG.711のμ-lawに符号化する。
+    """
+    pcm = np.arange(65536, dtype=np.uint16).view(np.int16).astype(np.int32) >> 2
+    mask = np.where(pcm < 0, 0x7F, 0xFF)
+    magnitude = np.minimum(np.abs(pcm), 8159) + 0x21
+    # セグメント番号: magnitude <= 0x3F, 0x7F, ..., 0x1FFF の最初の位置
+    seg = np.searchsorted(np.array([0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF]), magnitude)
+    uval = np.where(seg >= 8, 0x7F, (seg << 4) | ((magnitude >> (seg + 1)) & 0xF))
+    return (uval ^ mask).astype(np.uint8)
+
+
+ULAW_TABLE = _build_ulaw_table()
+
+
+def lin2ulaw(samples: NDArray[np.int16]) -> bytes:
+    """16bit PCMをμ-lawに符号化する (audioop.lin2ulaw(samples, 2) と同じ結果)"""
+    samples = np.ascontiguousarray(samples, dtype=np.int16)
+    return ULAW_TABLE[samples.view(np.uint16)].tobytes()
+
+
+@lru_cache(maxsize=None)
+def _polyphase_filter(up: int, down: int) -> NDArray[np.float32]:
+    """リサンプリング用のローパスフィルタ (カイザー窓のsinc, scipy.signal.resample_polyと同じ設計)"""
+    max_rate = max(up, down)
+    half_len = 10 * max_rate
+    n = np.arange(-half_len, half_len + 1)
+    h = np.sinc(n / max_rate) * np.kaiser(2 * half_len + 1, 5.0)
+    return (h * (up / h.sum())).astype(np.float32)
+
+
+def resample_poly(samples, orig_sr: int, target_sr: int) -> NDArray[np.float32]:
+    """ポリフェーズフィルタでサンプリングレートを変換する (16/24kHz -> 8kHzなどの整数比は1回の畳み込み)
+
+    出力する標本の位置ごとに必要なフィルタ係数 (位相) だけを掛けるため、
+    up倍に補間した信号を作らない。
+
+    Returns:
+        NDArray[np.float32]: 変換後の信号 (丸め・クリップはしない)
+    """
+    x = np.asarray(samples, dtype=np.float32)
+    if orig_sr == target_sr:
+        return x
+    g = gcd(orig_sr, target_sr)
+    up, down = target_sr // g, orig_sr // g
+    h = _polyphase_filter(up, down)
+    half_len = len(h) // 2
+    num_out = -(-len(x) * up // down)
+
+    if up == 1:
+        # 間引きのみ: 入力とフィルタをそれぞれdown個の位相に分け、係数ごとに連続した配列の積和をとる
+        # (出力の標本数の長さのベクトル演算をタップ数だけ繰り返す)
+        padded = np.zeros(half_len + len(x) + len(h) + down, np.float32)
+        padded[half_len : half_len + len(x)] = x
+        hr = h[::-1]
+        out = np.zeros(num_out, dtype=np.float32)
+        tmp = np.empty(num_out, dtype=np.float32)
+        for p in range(down):
+            phase = np.ascontiguousarray(padded[p::down])
+            for k, coef in enumerate(hr[p::down]):
+                np.multiply(phase[k : k + num_out], coef, out=tmp)
+                out += tmp
+        return out
+
+    # 出力m は up倍の信号上の位置 t = m * down + half_len を中心とし、
+    # 位相 r = t % up の係数 h[r], h[r + up], ... を入力 x[t // up], x[t // up - 1], ... に掛ける
+    num_taps = -(-len(h) // up)
+    padded = np.concatenate([np.zeros(num_taps, np.float32), x, np.zeros(num_taps, np.float32)])
+    t = np.arange(num_out) * down + half_len
+    out = np.empty(num_out, dtype=np.float32)
+    for r in range(up):
+        m = np.flatnonzero(t % up == r)
+        if len(m) == 0:
+            continue
+        taps = h[r::up]
+        idx = (t[m] // up + num_taps)[:, None] - np.arange(len(taps))[None, :]
+        out[m] = padded[idx] @ taps
+    return out
+
+
+def segment_samples(audio) -> tuple[NDArray[np.int16], int]:
+    """pydubのAudioSegmentをモノラルの16bit PCMとサンプリングレートにする"""
+    if audio.sample_width not in (1, 2, 4):
+        audio = audio.set_sample_width(2)
+    dtype = {1: np.uint8, 2: np.int16, 4: np.int32}[audio.sample_width]
+    x = np.frombuffer(audio.raw_data, dtype=dtype)
+    if audio.sample_width == 1:
+        x = (x.astype(np.int16) - 128) << 8
+    elif audio.sample_width == 4:
+        x = (x >> 16).astype(np.int16)
+    if audio.channels > 1:
+        x = x.reshape(-1, audio.channels).mean(axis=1).astype(np.int16)
+    return x, audio.frame_rate
+
+
+def to_pcm16_8khz(samples, sample_rate: int) -> NDArray[np.int16]:
+    """16bit PCMを8kHzに変換する"""
+    if sample_rate == TWILIO_SAMPLE_RATE:
+        return np.asarray(samples, dtype=np.int16)
+    x = resample_poly(samples, sample_rate, TWILIO_SAMPLE_RATE)
+    return np.clip(np.rint(x), -32768, 32767).astype(np.int16)
+
+
+def encode_twilio_ulaw(samples, sample_rate: int, clip: int = TWILIO_CLIP) -> bytes:
+    """16bit PCMを、Twilioへ送る8kHz μ-lawに変換する (リサンプリング・クリップ・符号化)"""
+    if sample_rate != TWILIO_SAMPLE_RATE:
+        x = resample_poly(samples, sample_rate, TWILIO_SAMPLE_RATE)
+        x = np.rint(x, out=x)
+    else:
+        x = np.asarray(samples)
+    return lin2ulaw(np.clip(x, -clip, clip).astype(np.int16))
+
+
 def chunk_generator(input_file: str, chunk_seconds: float = 0.02, include_silence=True):
     chunk_count = 0
     with wave.open(input_file, "rb") as wf:
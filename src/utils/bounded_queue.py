@@ -0,0 +1,84 @@
+import queue
+from enum import Enum
+
+
+class OverflowPolicy(str, Enum):
+    """キューが一杯のときにputをどう扱うか"""
+
+    # 最も古い要素を捨てて追加する (音声フレーム: 遅れて届いた古い音声は処理しない)
+    DROP_OLDEST = "drop_oldest"
+    # 空きが出るまで待つ (テキスト: 捨てると応答が欠ける)
+    BLOCK = "block"
+
+
+class BoundedQueue(queue.Queue):
+    """上限とあふれたときの方針を持つqueue.Queue
+
+    get()・qsize()などはqueue.Queueと同じように使える。
+    あふれた回数は num_dropped / num_blocked / num_rejected で参照できる。
+    """
+
+    def __init__(self, maxsize: int, policy: OverflowPolicy = OverflowPolicy.BLOCK):
+        """
+        Args:
+            maxsize (int): 保持する要素数の上限 (1以上)
+            policy (OverflowPolicy): 一杯のときの方針
+        """
+        if maxsize <= 0:
+            raise ValueError("maxsize must be positive")
+        super().__init__(maxsize)
+        self.policy = policy
+        # DROP_OLDESTで捨てた要素の数
+        self.num_dropped = 0
+        # BLOCKで空きを待ったputの数
+        self.num_blocked = 0
+        # BLOCKで追加できなかった (queue.Fullを送出した) putの数
+        self.num_rejected = 0
+        self.high_watermark = 0
+
+    def _put(self, item):
+        super()._put(item)
+        self.high_watermark = max(self.high_watermark, self._qsize())
+
+    def put(self, item, block=True, timeout=None):
+        if self.policy is OverflowPolicy.DROP_OLDEST:
+            with self.not_full:
+                if self._qsize() >= self.maxsize:
+                    # 捨てた要素の分の未完了タスクは、追加した要素に引き継ぐ
+                    self._get()
+                    self.num_dropped += 1
+                else:
+                    self.unfinished_tasks += 1
+                self._put(item)
+                self.not_empty.notify()
+            return
+
+        with self.mutex:
+            is_full = self._qsize() >= self.maxsize
+            if is_full and block:
+                self.num_blocked += 1
+        try:
+            super().put(item, block, timeout)
+        except queue.Full:
+            with self.mutex:
+                self.num_rejected += 1
+            raise
+
+    def offer(self, item) -> bool:
+        """待たずに追加を試み、追加できたかを返す (終了通知など、捨ててもよい要素用)"""
+        try:
+            self.put(item, block=False)
+        except queue.Full:
+            return False
+        return True
+
+    def get_metrics(self) -> dict:
+        return {
+            "size": self.qsize(),
+            "maxsize": self.maxsize,
+            "policy": self.policy.value,
+            "high_watermark": self.high_watermark,
+            "num_dropped": self.num_dropped,
+            "num_blocked": self.num_blocked,
+            "num_rejected": self.num_rejected,
+        }
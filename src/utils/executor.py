@@ -0,0 +1,101 @@
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from src.utils import get_custom_logger
+
+logger = get_custom_logger(__name__)
+
+# ブロッキングなSDK呼び出し (gRPC, Azure TTS, LLM, Twilio REST) を実行するスレッド数の上限
+# 短時間で終わる処理のみを実行し、ASRのストリーミング認識は専用のExecutorで実行する
+BLOCKING_EXECUTOR_MAX_WORKERS = int(os.getenv("BLOCKING_EXECUTOR_MAX_WORKERS", "128"))
+
+_executor: ThreadPoolExecutor | None = None
+_executor_lock = threading.Lock()
+
+# ASRのストリーミング認識 (通話中ずっとスレッドを1つ占有する) を実行するスレッド数の上限
+_streaming_max_workers = 256
+_streaming_executor: ThreadPoolExecutor | None = None
+
+
+def get_blocking_executor() -> ThreadPoolExecutor:
+    """プロセス内で共有する、上限付きのブロッキング処理用Executorを返す"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=BLOCKING_EXECUTOR_MAX_WORKERS,
+                    thread_name_prefix="blocking",
+                )
+                logger.info(
+                    f"Created blocking executor with max_workers={BLOCKING_EXECUTOR_MAX_WORKERS}"
+                )
+    return _executor
+
+
+def configure_streaming_executor(max_workers: int):
+    """ASRのストリーミング認識用Executorのスレッド数を設定する (最初の通話の前に呼ぶ)
+
+    ストリームの再起動時は古いストリームの終了を待たずに新しいストリームを開始するため、
+    同時通話数の上限より多めに指定する。
+    """
+    global _streaming_max_workers
+    _streaming_max_workers = max_workers
+
+
+def get_streaming_executor() -> ThreadPoolExecutor:
+    """プロセス内で共有する、ASRのストリーミング認識用Executorを返す
+
+    ストリーミング認識は通話中ずっとスレッドを占有するため、共有のブロッキング処理用Executorで
+    実行すると、同時通話数が増えたときにTTS合成や対話の処理がワーカーの空き待ちで止まる。
+    """
+    global _streaming_executor
+    if _streaming_executor is None:
+        with _executor_lock:
+            if _streaming_executor is None:
+                _streaming_executor = ThreadPoolExecutor(
+                    max_workers=_streaming_max_workers,
+                    thread_name_prefix="asr-stream",
+                )
+                logger.info(
+                    f"Created streaming executor with max_workers={_streaming_max_workers}"
+                )
+    return _streaming_executor
+
+
+async def run_blocking(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """ブロッキングな関数を共有Executorで実行し、イベントループを止めずに結果を待つ"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_blocking_executor(), functools.partial(func, *args, **kwargs)
+    )
+
+
+def get_blocking_executor_queue_depth() -> int:
+    """共有Executorで実行待ちになっている処理の数"""
+    if _executor is None:
+        return 0
+    return _executor._work_queue.qsize()
+
+
+def get_streaming_executor_queue_depth() -> int:
+    """ASRのストリーミング認識用Executorで開始待ちになっているストリームの数"""
+    if _streaming_executor is None:
+        return 0
+    return _streaming_executor._work_queue.qsize()
+
+
+def shutdown_blocking_executor(wait: bool = True):
+    """共有Executorを終了する (サーバ停止時に呼ぶ)"""
+    global _executor, _streaming_executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=wait, cancel_futures=True)
+            _executor = None
+        if _streaming_executor is not None:
+            _streaming_executor.shutdown(wait=wait, cancel_futures=True)
+            _streaming_executor = None
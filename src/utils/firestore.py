@@ -1,6 +1,10 @@
 import os
 import json
 import uuid
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
 from typing import Any, Dict
 
 import firebase_admin
@@ -9,6 +13,7 @@ from google.cloud.firestore import Client, SERVER_TIMESTAMP
 from src.utils import get_custom_logger
 from dotenv import load_dotenv
 from google.oauth2.service_account import Credentials
+from src.utils.metrics import LatencyHistogram
 
 
 load_dotenv()
@@ -17,15 +22,196 @@ logger = get_custom_logger(__name__)
 
 # logger.info(f"ROOT_DIR: {ROOT_DIR}")
 
+class FirestoreEventWriter:
+    """対話イベントの書き込みをキューに溜め、WriteBatchでまとめてコミットするライター
+
+    プロセスで1つだけ生成し、専用スレッドでコミットする。イベントは対話 (key) ごとの
+    キューに溜め、各キューの先頭から順に取り出すため、同じ対話のイベントは追加した順に
+    書き込まれる。flush(key) は指定した対話のイベントを他の対話より先にコミットする。
+    """
+
+    # FirestoreのWriteBatchは1回のコミットで500件まで
+    MAX_BATCH_SIZE = 500
+    MAX_RETRIES = 3
+
+    def __init__(self, client: Client, batch_size: int = 50, flush_interval: float = 0.2):
+        """
+        Args:
+            client (Client): Firestoreクライアント
+            batch_size (int): この件数が溜まったらコミットする
+            flush_interval (float): 最初のイベントを受け取ってからコミットするまでの最大待ち時間 (秒)
+        """
+        self.client = client
+        self.batch_size = min(batch_size, self.MAX_BATCH_SIZE)
+        self.flush_interval = flush_interval
+        # 対話 (key) -> 書き込み待ちのイベント (document_ref, data, 追加した時刻)
+        self._pending: dict[str | None, deque] = {}
+        self._num_pending = 0
+        # コミット中のイベントの対話
+        self._in_flight: set[str | None] = set()
+        # flush() で待っている (key, Future)
+        self._waiters: list[tuple[str | None, Future]] = []
+        self._cond = threading.Condition()
+        self._ended = False
+        self._thread: threading.Thread | None = None
+
+        self.flush_latency = LatencyHistogram()
+        self.batch_sizes = LatencyHistogram()
+        self.num_written = 0
+        self.num_failed = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+        logger.info("Firestore event writer started")
+
+    def stop(self, timeout: float | None = 10):
+        """キューに残ったイベントを書き込んでから停止する"""
+        with self._cond:
+            self._ended = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+        logger.info("Firestore event writer stopped")
+
+    def enqueue(self, document_ref, data: Dict[str, Any], key: str | None = None):
+        """ドキュメントの書き込みをキューに追加する
+
+        Args:
+            key (str): 書き込み順を保つ単位 (対話のドキュメントのパス)
+        """
+        with self._cond:
+            self._pending.setdefault(key, deque()).append((document_ref, data, time.monotonic()))
+            self._num_pending += 1
+            self._cond.notify()
+
+    def flush(self, key: str | None = None) -> Future:
+        """これまでにキューに追加したイベントがコミットされると完了するFutureを返す
+
+        Args:
+            key (str): 指定した場合、その対話のイベントだけを待つ (他の対話のイベントは待たない)
+        """
+        future = Future()
+        with self._cond:
+            if self._thread is None or not self._thread.is_alive() or self._is_written(key):
+                future.set_result(None)
+            else:
+                self._waiters.append((key, future))
+                self._cond.notify()
+        return future
+
+    @property
+    def queue_depth(self) -> int:
+        return self._num_pending
+
+    def get_metrics(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth,
+            "num_written": self.num_written,
+            "num_failed": self.num_failed,
+            "batch_size": self.batch_sizes.summary(),
+            "flush_latency_sec": self.flush_latency.summary(),
+        }
+
+    def _is_written(self, key: str | None) -> bool:
+        if key is None:
+            return self._num_pending == 0 and not self._in_flight
+        return key not in self._pending and key not in self._in_flight
+
+    def _flush_keys(self) -> list[str | None]:
+        """flush() で待たれている対話 (先にコミットする)"""
+        keys = []
+        for key, _ in self._waiters:
+            if key is None:
+                return list(self._pending)
+            if key in self._pending and key not in keys:
+                keys.append(key)
+        return keys
+
+    def _take_batch(self, keys: list[str | None]) -> list:
+        """各対話のキューの先頭からbatch_size件まで取り出す
+
+        Args:
+            keys (list): flush() で待たれている対話 (指定した場合、これらの対話からのみ取り出す)
+        """
+        writes = []
+        for key in keys or list(self._pending):
+            queue_ = self._pending[key]
+            while queue_ and len(writes) < self.batch_size:
+                document_ref, data, _ = queue_.popleft()
+                writes.append((document_ref, data))
+                self._in_flight.add(key)
+            if not queue_:
+                del self._pending[key]
+            if len(writes) >= self.batch_size:
+                break
+        self._num_pending -= len(writes)
+        return writes
+
+    def _write_loop(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._num_pending == 0:
+                        if self._ended:
+                            for _, waiter in self._waiters:
+                                waiter.set_result(None)
+                            self._waiters = []
+                            return
+                        self._cond.wait()
+                        continue
+                    flush_keys = self._flush_keys()
+                    if flush_keys or self._ended or self._num_pending >= self.batch_size:
+                        break
+                    oldest = min(q[0][2] for q in self._pending.values())
+                    timeout = oldest + self.flush_interval - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    self._cond.wait(timeout)
+                writes = self._take_batch(flush_keys)
+
+            self._commit(writes)
+
+            with self._cond:
+                self._in_flight = set()
+                waiters, self._waiters = self._waiters, []
+                for key, waiter in waiters:
+                    if self._is_written(key):
+                        waiter.set_result(None)
+                    else:
+                        self._waiters.append((key, waiter))
+
+    def _commit(self, writes: list):
+        for retry in range(self.MAX_RETRIES):
+            try:
+                tic = time.perf_counter()
+                batch = self.client.batch()
+                for document_ref, data in writes:
+                    batch.set(document_ref, data)
+                batch.commit()
+                self.flush_latency.observe(time.perf_counter() - tic)
+                self.batch_sizes.observe(len(writes))
+                self.num_written += len(writes)
+                return
+            except Exception as e:
+                logger.warning(
+                    f"Failed to commit {len(writes)} events (retry {retry + 1}/{self.MAX_RETRIES}): {e}"
+                )
+                time.sleep(0.1 * 2**retry)
+        self.num_failed += len(writes)
+        logger.error(f"Dropped {len(writes)} events after {self.MAX_RETRIES} retries")
+
+
 class FirestoreClient:
     """Firestoreに接続し、対話ログを管理するためのクラス"""
 
-    def __init__(self):
+    def __init__(self, event_writer: FirestoreEventWriter | None = None):
         """
         コンストラクタ。Firestoreクライアントを初期化する。
 
         Args:
-            credential_path (Optional[str]): サービスアカウント鍵のパス。環境変数で設定されていない場合に使用。
+            event_writer (Optional[FirestoreEventWriter]): 指定した場合、対話イベントは
+                同期的に書き込まずライター経由でまとめて書き込む
         """
         if not firebase_admin._apps:
             credential_path = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS", None)
@@ -42,6 +228,11 @@ class FirestoreClient:
         
         self.client: Client = firestore.client()
         self.conversation_ref = None
+        self.event_writer = event_writer
+        # まとめて書き込むと同じバッチのcreated_atが同じ値になるため、対話内の順序を別に保持する
+        self._event_sequence = 0
+        # 対話の参照が決まる前に追加されたイベント (event_id, event_data)
+        self._pending_events: list[tuple[str, Dict[str, Any]]] = []
     
     def get_credentials(self) -> Credentials:
         credential_path = os.environ.get(
@@ -73,6 +264,14 @@ class FirestoreClient:
         """対話のドキュメント参照を取得"""
         self.conversation_ref = project_ref.collection("conversations").document(conversation_id)
         logger.info(f"[Set Conversation Ref] Conversation ref: {self.conversation_ref.path}")
+        pending_events, self._pending_events = self._pending_events, []
+        for event_id, event_data in pending_events:
+            self._write_conversation_event(event_id, event_data)
+
+    @property
+    def num_pending_events(self) -> int:
+        """対話の参照が決まらず、書き込めていないイベントの数"""
+        return len(self._pending_events)
 
     def create_customer(self, tenant_ref, customer_id: str, customer_data: Dict[str, Any]):
         """顧客ドキュメントを作成"""
@@ -89,10 +288,31 @@ class FirestoreClient:
     def add_conversation_event(self, event_data: Dict[str, Any]):
         """対話イベントを追加"""
         event_id = str(uuid.uuid4()).replace("-", "")
+        event_data.setdefault("sequence", self._event_sequence)
+        self._event_sequence += 1
+        if self.conversation_ref is None:
+            # 通話開始直後 (対話ドキュメントの準備中) のイベントは参照が決まってから書き込む
+            self._pending_events.append((event_id, event_data))
+            logger.info(f"[Add Event] Pending event: {event_id}")
+        else:
+            self._write_conversation_event(event_id, event_data)
+        return event_id
+
+    def _write_conversation_event(self, event_id: str, event_data: Dict[str, Any]):
         event_ref = self.conversation_ref.collection("conversation_events").document(event_id)
-        event_ref.set(event_data)
+        if self.event_writer is not None:
+            self.event_writer.enqueue(event_ref, event_data, key=self.conversation_ref.path)
+        else:
+            event_ref.set(event_data)
         logger.info(f"[Add Event] Event ref: {event_ref.path}")
-        return event_id
+
+    def flush_events(self) -> Future:
+        """この対話のイベントがコミットされると完了するFutureを返す"""
+        if self.event_writer is None or self.conversation_ref is None:
+            future = Future()
+            future.set_result(None)
+            return future
+        return self.event_writer.flush(self.conversation_ref.path)
 
     def update_conversation_event(self, conversation_ref, event_id: str, update_data: Dict[str, Any]):
         """対話イベントを更新"""
@@ -102,4 +322,9 @@ class FirestoreClient:
     def get_conversation_events(self, conversation_ref):
         """対話イベントを取得"""
         events = conversation_ref.collection("conversation_events").order_by("created_at").stream()
-        return [event.to_dict() for event in events]
\ No newline at end of file
+        # まとめて書き込んだイベントはcreated_atが同じになるため、同時刻のイベントは対話内の順序 (sequence) で並べる
+        # (sequenceのないイベントも取得できるよう、クエリではなく取得後に並べ替える)
+        return sorted(
+            (event.to_dict() for event in events),
+            key=lambda data: (data.get("created_at"), data.get("sequence", 0)),
+        )
\ No newline at end of file
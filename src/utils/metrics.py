@@ -0,0 +1,104 @@
+import os
+import resource
+import sys
+import threading
+from collections import deque
+
+
+def get_rss_bytes() -> int:
+    """現在のプロセスの常駐メモリ (RSS) をバイト単位で返す
+
+    Linuxでは /proc/self/statm を読み、取得できない環境では
+    getrusage の最大RSSで代用する。
+
+    Returns:
+        int: RSS (bytes)
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOSはbytes、Linuxはkilobytesで返る
+        return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def get_cpu_seconds(pid: int | str = "self") -> float:
+    """プロセスがこれまでに使ったCPU時間 (user + system, 秒) を返す (Linuxのみ)"""
+    with open(f"/proc/{pid}/stat") as f:
+        # 2番目のフィールド (comm) は空白を含みうるため、閉じ括弧以降を分割する
+        fields = f.read().rsplit(")", 1)[1].split()
+    utime, stime = int(fields[11]), int(fields[12])
+    return (utime + stime) / os.sysconf("SC_CLK_TCK")
+
+
+class LatencyHistogram:
+    """直近のサンプルを保持し、件数・平均・パーセンタイルを返す簡易ヒストグラム (スレッドセーフ)"""
+
+    def __init__(self, max_samples: int = 10000):
+        self._samples = deque(maxlen=max_samples)
+        self._count = 0
+        self._total = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self._samples.append(value)
+            self._count += 1
+            self._total += value
+
+    def summary(self) -> dict:
+        """件数・平均・p50/p90/p99・最大値を返す (平均以外は直近max_samples件から計算)"""
+        with self._lock:
+            samples = sorted(self._samples)
+            count = self._count
+            total = self._total
+        if not samples:
+            return {"count": 0}
+
+        def percentile(q):
+            return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+        return {
+            "count": count,
+            "mean": total / count,
+            "p50": percentile(0.5),
+            "p90": percentile(0.9),
+            "p99": percentile(0.99),
+            "max": samples[-1],
+        }
+
+
+def get_memory_usage(pid: int | str = "self") -> dict[str, int]:
+    """プロセスのメモリ使用量を共有分・固有分に分けて返す (Linuxのみ)
+
+    /proc/<pid>/smaps_rollup を読む。フォーク前にロードしたモデルのページは
+    子プロセス間で共有されるため、shared_bytes に計上される。
+
+    Args:
+        pid (int | str): プロセスID (省略時は自プロセス)
+
+    Returns:
+        dict[str, int]: rss_bytes, pss_bytes, shared_bytes, private_bytes
+            (取得できない環境では rss_bytes のみ)
+    """
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                parts = value.split()
+                if len(parts) == 2 and parts[1] == "kB":
+                    fields[key] = int(parts[0]) * 1024
+    except (OSError, ValueError):
+        if pid == "self":
+            return {"rss_bytes": get_rss_bytes()}
+        return {}
+
+    return {
+        "rss_bytes": fields.get("Rss", 0),
+        "pss_bytes": fields.get("Pss", 0),
+        "shared_bytes": fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0),
+        "private_bytes": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+    }
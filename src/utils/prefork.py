@@ -0,0 +1,186 @@
+"""モデルを親プロセスでロードしてからワーカーをforkするサーバ起動スクリプト
+
+uvicornの --workers はワーカーをspawnで起動するため、GiNZAやVAPの重みが
+ワーカーごとに重複してロードされる。ここでは親プロセスで読み取り専用の
+リソースをロードしてからforkし、ページをcopy-on-writeで共有する。
+
+Usage:
+    python -m src.utils.prefork --workers 4 --port 8080
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+
+import uvicorn
+
+from src.utils import get_custom_logger
+from src.utils.metrics import get_memory_usage
+
+logger = get_custom_logger(__name__)
+
+# 親プロセスがワーカーのメモリ使用量をログに出す間隔 (秒)
+MEMORY_REPORT_INTERVAL = float(os.getenv("PREFORK_MEMORY_REPORT_INTERVAL", "60"))
+
+
+class PreforkServer:
+    """共有ソケットを1つ開き、N個のワーカープロセスでuvicornを動かす
+
+    ワーカーが異常終了した場合は親プロセスが再度forkする。
+    """
+
+    def __init__(
+        self,
+        app: str,
+        host: str,
+        port: int,
+        workers: int,
+        warmup_models: list[str] | None = None,
+    ):
+        """
+        Args:
+            app (str): "module:attribute" 形式のASGIアプリ
+            host (str): バインドするホスト
+            port (int): バインドするポート
+            workers (int): ワーカープロセス数
+            warmup_models (list[str] | None): fork前にロードするmodel_registryのリソース名
+                (省略時はアプリのモジュールの WARMUP_MODELS を使う)
+        """
+        self.app = app
+        self.host = host
+        self.port = port
+        self.num_workers = workers
+        self.warmup_models = warmup_models
+        self.workers: dict[int, int] = {}  # pid -> worker index
+        self._sock: socket.socket | None = None
+        self._should_exit = False
+
+    def preload(self):
+        """アプリをimportし、読み取り専用のリソースをロードする"""
+        from src.modules.model_registry import DEFAULT_WARMUP_MODELS, model_registry
+
+        app = uvicorn.importer.import_from_string(self.app)
+        warmup_models = self.warmup_models
+        if warmup_models is None:
+            # main.WARMUP_MODELS には環境変数の指定や、SLOT_AUDIO_ENGINE の場合の slot_audio が反映されている
+            module = sys.modules[self.app.split(":")[0]]
+            warmup_models = getattr(module, "WARMUP_MODELS", DEFAULT_WARMUP_MODELS)
+        model_registry.warmup(warmup_models)
+        logger.info(f"Preloaded resources: {model_registry.report()}")
+        # fork後にGCが参照カウント・GCヘッダを書き換えてページがコピーされるのを防ぐ
+        gc.collect()
+        gc.freeze()
+        logger.info(f"Parent memory usage: {get_memory_usage()}")
+        return app
+
+    def bind(self):
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind((self.host, self.port))
+        self._sock.set_inheritable(True)
+        logger.info(f"Listening on {self.host}:{self.port}")
+
+    def spawn_worker(self, app, index: int):
+        pid = os.fork()
+        if pid == 0:
+            # 子プロセス: 親のシグナルハンドラを外してuvicornに任せる
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            config = uvicorn.Config(app, lifespan="on")
+            server = uvicorn.Server(config)
+            server.run(sockets=[self._sock])
+            os._exit(0)
+        self.workers[pid] = index
+        logger.info(f"Started worker {index} (pid={pid})")
+
+    def report_memory(self) -> dict[int, dict[str, int]]:
+        """ワーカーごとのRSS・共有メモリ・固有メモリを返す"""
+        return {pid: get_memory_usage(pid) for pid in self.workers}
+
+    def _handle_exit(self, signum, frame):
+        self._should_exit = True
+
+    def run(self):
+        app = self.preload()
+        self.bind()
+        signal.signal(signal.SIGTERM, self._handle_exit)
+        signal.signal(signal.SIGINT, self._handle_exit)
+        for index in range(self.num_workers):
+            self.spawn_worker(app, index)
+
+        last_report = time.monotonic()
+        while not self._should_exit:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid != 0:
+                index = self.workers.pop(pid)
+                logger.warning(f"Worker {index} (pid={pid}) exited with status {status}")
+                if not self._should_exit:
+                    self.spawn_worker(app, index)
+                continue
+
+            if time.monotonic() - last_report >= MEMORY_REPORT_INTERVAL:
+                for pid, usage in self.report_memory().items():
+                    logger.info(f"Worker {self.workers[pid]} (pid={pid}) memory: {usage}")
+                last_report = time.monotonic()
+            time.sleep(0.5)
+
+        self.shutdown()
+
+    def shutdown(self, timeout: float = 30):
+        for pid in self.workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + timeout
+        while self.workers and time.monotonic() < deadline:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                time.sleep(0.1)
+                continue
+            self.workers.pop(pid, None)
+        for pid in self.workers:
+            os.kill(pid, signal.SIGKILL)
+        self._sock.close()
+        logger.info("Prefork server stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--app", type=str, default="main:app")
+    parser.add_argument("--host", type=str, default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "2")))
+    parser.add_argument(
+        "--warmup-models",
+        type=str,
+        default=None,
+        help="fork前にロードするリソース (カンマ区切り, 省略時はアプリの WARMUP_MODELS を使う)",
+    )
+    args = parser.parse_args()
+
+    server = PreforkServer(
+        app=args.app,
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        warmup_models=(
+            [name for name in args.warmup_models.split(",") if name]
+            if args.warmup_models is not None
+            else None
+        ),
+    )
+    server.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import threading
+from types import SimpleNamespace
+
+from google.api_core.exceptions import OutOfRange
+
+from src.bridge.asr_bridge import (
+    ROTATION_CHECK_INTERVAL,
+    STREAM_MAX_SECONDS,
+    ASRBridge,
+    AudioAggregator,
+)
+
+
+def make_response(transcript, is_final=False, stability=0.0):
+    alternative = SimpleNamespace(transcript=transcript)
+    result = SimpleNamespace(
+        alternatives=[alternative], is_final=is_final, stability=stability
+    )
+    return SimpleNamespace(results=[result])
+
+
+def test_persistent_segments_on_final():
+    asr_bridge = ASRBridge(persistent=True)
+    asr_bridge._on_response(make_response("明日の"))
+    asr_bridge._on_response(make_response("明日の7時", is_final=True))
+    assert asr_bridge.get_transcription() == "明日の7時"
+
+    asr_bridge.end_utterance()
+    assert asr_bridge.get_transcription() == ""
+
+    asr_bridge._on_response(make_response("2名"))
+    assert asr_bridge.get_transcription() == "2名"
+
+
+def test_persistent_strips_consumed_prefix_before_final():
+    asr_bridge = ASRBridge(persistent=True)
+    asr_bridge._on_response(make_response("明日の7時"))
+    # is_finalより先にVADで発話終了した場合
+    asr_bridge.end_utterance()
+
+    asr_bridge._on_response(make_response("明日の7時に"))
+    assert asr_bridge.get_transcription() == "に"
+    asr_bridge._on_response(make_response("明日の7時", is_final=True))
+    assert asr_bridge.get_transcription() == ""
+
+    asr_bridge.end_utterance()
+    asr_bridge._on_response(make_response("2名です"))
+    assert asr_bridge.get_transcription() == "2名です"
+
+
+def test_persistent_joins_segments_within_utterance():
+    asr_bridge = ASRBridge(persistent=True)
+    asr_bridge._on_response(make_response("明日の", is_final=True))
+    asr_bridge._on_response(make_response("7時で"))
+    assert asr_bridge.get_transcription() == "明日の7時で"
+
+
+def test_rotation_carries_unfinished_utterance():
+    asr_bridge = ASRBridge(persistent=True)
+    asr_bridge._on_response(make_response("明日の"))
+    asr_bridge._on_stream_rotated()
+    asr_bridge._on_response(make_response("7時"))
+    assert asr_bridge.get_transcription() == "明日の7時"
+
+
+def test_default_mode_overwrites_transcription():
+    asr_bridge = ASRBridge()
+    asr_bridge._on_response(make_response("明日の", is_final=True))
+    asr_bridge._on_response(make_response("7時"))
+    assert asr_bridge.get_transcription() == "7時"
+
+
+def test_aggregation_sends_fixed_size_requests():
+    asr_bridge = ASRBridge(aggregation_ms=100)
+    for i in range(12):
+        asr_bridge.add_request(bytes([i]) * 160)
+
+    generator = asr_bridge._aggregated_generator()
+    requests = [next(generator), next(generator)]
+    # 100ms (800バイト) ずつ、20msフレーム5つ分を順番どおりに送る
+    assert [len(r) for r in requests] == [800, 800]
+    assert requests[1][:160] == bytes([5]) * 160
+    assert asr_bridge.get_metrics()["num_requests"] == 2
+    assert asr_bridge.queue_depth == 2
+
+    asr_bridge.terminate()
+    assert list(generator) == []
+
+
+def test_aggregator_drops_oldest_audio_when_full():
+    aggregator = AudioAggregator(request_ms=20, buffer_seconds=0.04)
+    for i in range(3):
+        aggregator.add(bytes([i]) * 160)
+    assert aggregator.num_dropped_bytes == 160
+    assert aggregator.get(timeout=0)[0] == bytes([1]) * 160
+    assert aggregator.get(timeout=0)[0] == bytes([2]) * 160
+    assert aggregator.get(timeout=0) is None
+
+
+def test_hypothesis_events_track_stable_prefix():
+    asr_bridge = ASRBridge(persistent=True)
+    asr_bridge._on_response(make_response("明日の"))
+    asr_bridge._on_response(make_response("明日の7"))
+    asr_bridge._on_response(make_response("明日の7時に"))
+    events = asr_bridge.hypotheses_since(0)
+    assert [e.revision for e in events] == [1, 2, 3]
+    # 途中結果が1つだけの間は確定部分なし
+    assert events[0].stable_prefix == ""
+    assert events[1].stable_prefix == "明日の"
+    assert events[2].stable_prefix == "明日の"
+    assert events[2].unstable_tail == "7時に"
+
+    asr_bridge._on_response(make_response("明日の7時にお願い", is_final=True))
+    final = asr_bridge.latest_hypothesis
+    assert final.is_final
+    assert final.stable_prefix == "明日の7時にお願い"
+    assert final.unstable_tail == ""
+    assert asr_bridge.hypotheses_since(final.revision) == []
+
+    asr_bridge.end_utterance()
+    asr_bridge._on_response(make_response("2名"))
+    assert asr_bridge.latest_hypothesis.stable_prefix == ""
+
+
+def test_rotation_is_checked_while_no_audio_arrives():
+    asr_bridge = ASRBridge(persistent=True)
+    generator = asr_bridge.generator()
+    asr_bridge.add_request(b"\xff" * 160)
+    assert next(generator) == b"\xff" * 160
+
+    # 次の音声を待っている間に上限時間を超えた場合も、音声を待たずにストリームを閉じる
+    asr_bridge._stream_started_at -= STREAM_MAX_SECONDS
+    thread = threading.Thread(target=lambda: list(generator), daemon=True)
+    thread.start()
+    thread.join(timeout=ROTATION_CHECK_INTERVAL * 4)
+    assert not thread.is_alive()
+
+
+def test_out_of_range_restarts_stream_without_recursion():
+    class OutOfRangeASRBridge(ASRBridge):
+        num_streams = 0
+
+        def _open_stream(self, audio):
+            self.num_streams += 1
+            if self.num_streams >= 1500:
+                self.terminate()
+                return iter([])
+
+            def responses():
+                raise OutOfRange("stream duration exceeded")
+                yield
+
+            return responses()
+
+    asr_bridge = OutOfRangeASRBridge(persistent=True)
+    asr_bridge.start()
+    # 再帰で張り直していた場合は、長い通話で再帰の上限に達する
+    assert asr_bridge.num_streams == 1500
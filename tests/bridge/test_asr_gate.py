@@ -0,0 +1,73 @@
+import threading
+
+from src.bridge.asr_bridge import ROTATION_CHECK_INTERVAL, STREAM_ROTATION_SECONDS, ASRBridge
+from src.bridge.asr_gate import ASRUploadGate
+from src.bridge.asr_replay import ReplayASRBridge, ReplayHypothesis, ReplayScript
+
+
+def test_gate_flushes_preroll_on_speech_onset():
+    gate = ASRUploadGate(preroll_ms=60, hangover_ms=40, keepalive_seconds=60)
+    silence = [bytes([i]) * 160 for i in range(5)]
+    for frame in silence:
+        assert gate.process(frame, is_speech=False) == []
+
+    # 発話の開始時に直前3フレーム (60ms) のプリロールと一緒に送る
+    sent = gate.process(b"\x01" * 160, is_speech=True)
+    assert sent == silence[-3:] + [b"\x01" * 160]
+    assert gate.is_open
+
+    # ハングオーバーの間は無音でも送り続け、その後は閉じる
+    assert len(gate.process(b"\xff" * 160, is_speech=False)) == 1
+    assert len(gate.process(b"\xff" * 160, is_speech=False)) == 1
+    assert not gate.is_open
+    assert gate.process(b"\xff" * 160, is_speech=False) == []
+
+    metrics = gate.get_metrics()
+    assert abs(metrics["sent_seconds"] - 0.12) < 1e-9
+    # 押し出された2フレームと、プリロールに残っている1フレーム
+    assert abs(metrics["gated_seconds"] - 0.06) < 1e-9
+
+
+def test_gate_sends_keepalive_frame_while_closed():
+    gate = ASRUploadGate(preroll_ms=60, keepalive_seconds=0)
+    assert len(gate.process(b"\xff" * 160, is_speech=False)) == 1
+
+
+def test_gated_silence_advances_replay_clock():
+    script = ReplayScript([ReplayHypothesis(time=1.0, transcript="明日の")])
+    asr_bridge = ReplayASRBridge(script)
+    gate = ASRUploadGate(preroll_ms=300, keepalive_seconds=60)
+
+    def feed(frame, is_speech):
+        # CallSessionと同じ順序で、送るフレームと送らなかった音声の長さをASRへ渡す
+        for sent in gate.process(frame, is_speech):
+            asr_bridge.add_request(sent)
+        asr_bridge.skip_audio(gate.pop_skipped_bytes())
+
+    for _ in range(49):
+        feed(b"\xff" * 160, is_speech=False)
+    assert asr_bridge.get_transcription() == ""
+    # 送らなかった無音 (0.68秒) とプリロール (0.3秒) を含め、通話の音声時刻で結果を返す
+    feed(b"\x01" * 160, is_speech=True)
+    assert abs(script.audio_seconds - 1.0) < 1e-9
+    assert asr_bridge.get_transcription() == "明日の"
+
+
+def test_persistent_stream_rotates_while_gate_is_closed():
+    asr_bridge = ASRBridge(persistent=True)
+    gate = ASRUploadGate(preroll_ms=300, hangover_ms=40, keepalive_seconds=60)
+    generator = asr_bridge.generator()
+    thread = threading.Thread(target=lambda: list(generator), daemon=True)
+    thread.start()
+
+    frames = [(b"\x01" * 160, True)] + [(b"\xff" * 160, False)] * 3
+    for frame, is_speech in frames:
+        for sent in gate.process(frame, is_speech):
+            asr_bridge.add_request(sent)
+    assert not gate.is_open
+
+    # 発話の切れ目で張り替え時刻を過ぎた後は、ゲートが音声を止めていても張り替える
+    asr_bridge._stream_started_at -= STREAM_ROTATION_SECONDS
+    assert gate.process(b"\xff" * 160, is_speech=False) == []
+    thread.join(timeout=ROTATION_CHECK_INTERVAL * 4)
+    assert not thread.is_alive()
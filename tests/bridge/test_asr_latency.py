@@ -0,0 +1,36 @@
+import time
+
+from src.bridge.asr_latency import ASRLatencyTracker
+
+
+def test_tracker_records_per_utterance_latency():
+    tracker = ASRLatencyTracker(onset_silence_frames=2)
+    tracker.on_stream_opened()
+    tracker.on_audio_sent(1600, time.monotonic())
+
+    tracker.on_vad(True)
+    tracker.on_result(False)
+    tracker.on_vad(True)
+    tracker.on_result(False)
+    tracker.on_vad(False)
+    tracker.on_result(True, audio_offset=0.1)
+
+    # 次の発話の前にストリームを張り替える
+    tracker.on_stream_closed()
+    tracker.on_stream_opened()
+    tracker.on_audio_sent(160, time.monotonic())
+    tracker.on_vad(False)
+    tracker.on_vad(True)
+
+    utterances = tracker.get_record()["utterances"]
+    assert len(utterances) == 2
+    first = utterances[0]
+    assert first["num_partials"] == 3
+    assert first["first_partial_latency"] >= 0
+    assert first["final_latency"] >= 0
+    assert first["final_audio_lag"] >= 0
+    assert len(utterances[1]["restart_gaps"]) == 1
+
+    summary = tracker.summary()
+    assert summary["num_utterances"] == 2
+    assert summary["restart_gap_sec"] is not None
@@ -0,0 +1,41 @@
+from src.bridge.asr_replay import ReplayASRBridge, ReplayHypothesis, ReplayScript
+
+FRAME = b"\xff" * 160  # 20ms
+
+
+def make_script():
+    return ReplayScript(
+        [
+            ReplayHypothesis(time=0.04, transcript="明日の"),
+            ReplayHypothesis(time=0.08, transcript="明日の19時", is_final=True),
+            ReplayHypothesis(time=0.16, transcript="2名です", is_final=True),
+        ]
+    )
+
+
+def test_replay_follows_audio_clock():
+    asr_bridge = ReplayASRBridge(make_script(), persistent=True)
+    asr_bridge.add_request(FRAME)
+    assert asr_bridge.get_transcription() == ""
+    asr_bridge.add_request(FRAME)
+    assert asr_bridge.get_transcription() == "明日の"
+    assert not asr_bridge.is_final
+    asr_bridge.add_request(FRAME)
+    asr_bridge.add_request(FRAME)
+    assert asr_bridge.get_transcription() == "明日の19時"
+    assert asr_bridge.is_final
+    assert asr_bridge.revision == 2
+
+
+def test_script_clock_is_shared_across_restarts():
+    script = make_script()
+    first = ReplayASRBridge(script)
+    for _ in range(4):
+        first.add_request(FRAME)
+    first.terminate()
+
+    # ターンごとにASRを作り直しても、音声時刻は通話の先頭から続く
+    second = ReplayASRBridge(script)
+    for _ in range(4):
+        second.add_request(FRAME)
+    assert second.get_transcription() == "2名です"
@@ -0,0 +1,142 @@
+import queue
+import threading
+import time
+
+from src.bridge.asr_stream_pool import ASRStreamPool, StandbyStream
+
+
+class FakeCall:
+    """gRPCのストリーミング呼び出し (音声を受け取るまでレスポンスを返さない)"""
+
+    def __init__(self, requests, connect_delay=0.0):
+        self.received = []
+        self.cancelled = False
+        self.connect_delay = connect_delay
+        self._responses = queue.Queue()
+        # gRPCと同様に、リクエストは別スレッドで読み出される
+        self.thread = threading.Thread(target=self._consume, args=(requests,), daemon=True)
+        self.thread.start()
+
+    def _consume(self, requests):
+        for i, request in enumerate(requests):
+            if i == 0:
+                # 最初のリクエストの送信はチャネルの接続を待つ
+                time.sleep(self.connect_delay)
+            if request.audio_content:
+                self.received.append(request.audio_content)
+                self._responses.put(request.audio_content)
+        self._responses.put(None)
+
+    def __next__(self):
+        response = self._responses.get()
+        if response is None:
+            raise StopIteration
+        return response
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class FakeTransport:
+    def __init__(self, client):
+        self.client = client
+
+    def streaming_recognize(self, requests, timeout=None, metadata=None):
+        self.client.num_streams += 1
+        self.client.calls.append({"timeout": timeout, "metadata": metadata})
+        return FakeCall(requests, self.client.connect_delay)
+
+
+class FakeSpeechClient:
+    def __init__(self, connect_delay=0.0):
+        self.num_streams = 0
+        self.calls = []
+        self.connect_delay = connect_delay
+        self.transport = FakeTransport(self)
+
+    def streaming_recognize(self, config, requests):
+        # api_coreのラッパーと同様に、最初のレスポンスを先読みしてから返す
+        call = self.transport.streaming_recognize(requests)
+        first = next(call)
+        return iter([first, *call])
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_pool_hands_out_prewarmed_streams():
+    client = FakeSpeechClient(connect_delay=0.05)
+    pool = ASRStreamPool(streaming_config=None, size=2, client=client)
+    pool.start()
+    assert wait_for(lambda: pool.get_metrics()["available"] == 2)
+
+    stream = pool.acquire()
+    stream.attach(iter([b"\xff" * 160, b"\x7f" * 160]))
+    stream.responses._call.thread.join(timeout=2)
+    assert stream.responses._call.received == [b"\xff" * 160, b"\x7f" * 160]
+
+    # 取り出した分は補充される
+    assert wait_for(lambda: pool.get_metrics()["available"] == 2)
+    assert client.num_streams == 3
+    metrics = pool.get_metrics()
+    assert metrics["num_hits"] == 1
+    assert metrics["hit_rate"] == 1.0
+    assert metrics["warmup_latency_sec"]["count"] == 3
+    # 開始にかかった時間には設定の送信 (チャネルの接続) を含む
+    assert metrics["warmup_latency_sec"]["p50"] >= 0.05
+    # SpeechClientと同じタイムアウトとメタデータで開始する
+    assert client.calls[0]["timeout"] > 0
+    assert any(key == "x-goog-api-client" for key, _ in client.calls[0]["metadata"])
+    pool.stop()
+
+
+def test_pool_shrinks_without_calls():
+    client = FakeSpeechClient()
+    pool = ASRStreamPool(
+        streaming_config=None, size=1, max_idle_seconds=0.2, shrink_after_seconds=0.3, client=client
+    )
+    pool.start()
+    assert wait_for(lambda: pool.get_metrics()["available"] == 1)
+
+    # 通話がない間は期限切れのストリームを作り直さない
+    assert wait_for(lambda: pool.get_metrics()["available"] == 0 and not pool.get_metrics()["active"])
+    num_streams = client.num_streams
+    time.sleep(0.5)
+    assert client.num_streams == num_streams
+
+    # 次の通話で補充を再開する
+    assert pool.acquire() is None
+    assert wait_for(lambda: pool.get_metrics()["available"] == 1)
+    pool.stop()
+
+
+def test_pool_expires_idle_streams():
+    client = FakeSpeechClient()
+    pool = ASRStreamPool(streaming_config=None, size=1, max_idle_seconds=0.0, client=client)
+    standby = StandbyStream(client, None)
+    pool._standby.append(standby)
+
+    # 待機時間を超えたストリームは使わずに閉じる
+    assert pool.acquire() is None
+    assert standby.responses._call.cancelled
+    metrics = pool.get_metrics()
+    assert metrics["num_expired"] == 1
+    assert metrics["num_misses"] == 1
+
+
+def test_standby_stream_does_not_wait_for_first_response():
+    client = FakeSpeechClient()
+    result = {}
+    # 音声を送る前のストリームにはレスポンスが返らないため、先読みすると開始できない
+    thread = threading.Thread(target=lambda: result.update(stream=StandbyStream(client, None)), daemon=True)
+    thread.start()
+    thread.join(timeout=1)
+    assert "stream" in result
+
+    stream = result["stream"]
+    stream.attach(iter([b"\xff" * 160]))
+    assert list(stream.responses) == [b"\xff" * 160]
@@ -0,0 +1,38 @@
+import json
+import os
+
+from src.bridge import tts_bridge
+from src.bridge.tts_bridge import azure_synthesizer_pool
+
+
+class FakeSynthesizer:
+    def __init__(self, api_key, region, streaming=False):
+        self.api_key = api_key
+
+
+def test_pool_is_empty_after_fork(monkeypatch):
+    monkeypatch.setattr(tts_bridge, "AzureSynthesizer", FakeSynthesizer)
+    monkeypatch.setattr(azure_synthesizer_pool, "_idle", {})
+    monkeypatch.setattr(azure_synthesizer_pool, "num_created", 0)
+    # pre-forkの親プロセスでのwarmup時の合成
+    with azure_synthesizer_pool.acquire("key", "japaneast") as parent_synthesizer:
+        pass
+    assert azure_synthesizer_pool.get_metrics() == {"num_created": 1, "num_idle": 1}
+
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            metrics = azure_synthesizer_pool.get_metrics()
+            with azure_synthesizer_pool.acquire("key", "japaneast") as synthesizer:
+                metrics["reused"] = synthesizer is parent_synthesizer
+            os.write(write_fd, json.dumps(metrics).encode())
+        finally:
+            os._exit(0)
+    os.close(write_fd)
+    os.waitpid(pid, 0)
+    with os.fdopen(read_fd) as f:
+        child = json.loads(f.read())
+    assert child == {"num_created": 0, "num_idle": 0, "reused": False}
+    # 親プロセスのプールはそのまま
+    assert azure_synthesizer_pool.get_metrics() == {"num_created": 1, "num_idle": 1}
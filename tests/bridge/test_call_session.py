@@ -0,0 +1,211 @@
+import asyncio
+import base64
+
+from starlette.websockets import WebSocketState
+
+from src.bridge.call_session import CallSession
+from src.bridge.tts_bridge import BaseTTSBridge
+from src.modules.dialogue.utils.constants import TurnTakingStatus
+
+
+class FakeWebSocket:
+    def __init__(self, events):
+        self.events = list(events)
+        self.sent = []
+        self.application_state = WebSocketState.CONNECTED
+
+    async def receive_json(self):
+        await asyncio.sleep(0)
+        return self.events.pop(0)
+
+    async def send_text(self, text):
+        self.sent.append(text)
+
+
+class FakeASRBridge:
+    instances = []
+
+    def __init__(self, persistent=False):
+        self.persistent = persistent
+        self.chunks = []
+        self.n_utterances = 1
+        self.terminated = False
+        self.revision = 0
+        FakeASRBridge.instances.append(self)
+
+    def end_utterance(self):
+        self.n_utterances += 1
+
+    def start(self):
+        pass
+
+    def add_request(self, chunk):
+        self.chunks.append(chunk)
+
+    def reset(self):
+        pass
+
+    def terminate(self):
+        self.terminated = True
+
+
+class FakeTTSBridge(BaseTTSBridge):
+    def __init__(self):
+        super().__init__()
+        self.synthesized = []
+
+    def set_connect_info(self, stream_sid):
+        self.stream_sid = stream_sid
+
+    def stream_use_endpoint(self, text):
+        self.synthesized.append(text)
+
+
+class FakeDialogBridge:
+    def __init__(self, asr_done_at, vad_changes=True):
+        self.asr_done_at = asr_done_at
+        self.vad_changes = vad_changes
+        self.n_frames = 0
+        self.bot_speak = False
+        self.allow_barge_in = False
+
+    def set_stream_sid(self, stream_sid):
+        self.stream_sid = stream_sid
+
+    def get_initial_message(self):
+        return "INITIAL_1"
+
+    async def send_tts(self, *args):
+        pass
+
+    def vad_step(self, chunk):
+        return self.vad_changes
+
+    def turn_taking(self, *args):
+        return TurnTakingStatus.CONTINUE
+
+    async def __call__(self, ws, asr_bridge, tts_bridge, **kwargs):
+        self.n_frames += 1
+        return {"asr_done": self.n_frames == self.asr_done_at}
+
+
+def make_session(events, persistent=False, vad_changes=True):
+    ws = FakeWebSocket(events)
+    session = CallSession(
+        ws,
+        "MZ0000",
+        FakeDialogBridge(asr_done_at=2, vad_changes=vad_changes),
+        FakeTTSBridge(),
+        firestore_client=None,
+        conversation_logger=None,
+        asr_bridge_factory=lambda: FakeASRBridge(persistent=persistent),
+    )
+    return session
+
+
+async def settle():
+    """対話ターンの処理タスクに実行を譲る"""
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def media_event(payload=b"\xff" * 160):
+    return {"event": "media", "media": {"payload": base64.b64encode(payload).decode()}}
+
+
+def test_call_session_runs_on_event_loop():
+    FakeASRBridge.instances = []
+    session = make_session([media_event(), media_event(), media_event(), {"event": "stop"}])
+    dialog_bridge = session.dialog_bridge
+    tts_bridge = session.tts_bridge
+
+    asyncio.run(session.run())
+
+    assert dialog_bridge.n_frames == 3
+    # ターン終了ごとにASRストリームを張り直す
+    assert len(FakeASRBridge.instances) == 2
+    assert [len(b.chunks) for b in FakeASRBridge.instances] == [2, 1]
+    assert all(b.terminated for b in FakeASRBridge.instances)
+    assert tts_bridge.synthesized[0] == "INITIAL_1"
+    assert session._tts_task.done()
+
+
+def test_persistent_asr_keeps_stream_between_turns():
+    FakeASRBridge.instances = []
+    session = make_session(
+        [media_event(), media_event(), media_event(), {"event": "stop"}],
+        persistent=True,
+    )
+
+    asyncio.run(session.run())
+
+    assert len(FakeASRBridge.instances) == 1
+    assert FakeASRBridge.instances[0].n_utterances == 2
+    assert len(FakeASRBridge.instances[0].chunks) == 3
+
+
+def test_turn_step_runs_only_on_state_change():
+    FakeASRBridge.instances = []
+    session = make_session([], vad_changes=False)
+    dialog_bridge = session.dialog_bridge
+
+    async def scenario():
+        await session.start()
+        for _ in range(5):
+            await session.handle_event(media_event())
+        await settle()
+        assert dialog_bridge.n_frames == 0
+
+        # 新しいASR結果が届いたフレームでのみ対話ターンを処理する
+        session.asr_bridge.revision += 1
+        await session.handle_event(media_event())
+        await settle()
+        await session.handle_event(media_event())
+        await settle()
+        assert dialog_bridge.n_frames == 1
+
+        # TTS音声の合成完了は次のフレームで処理する
+        session.tts_bridge.on_audio_ready()
+        await session.handle_event(media_event())
+        await settle()
+        assert dialog_bridge.n_frames == 2
+        await session.close()
+
+    asyncio.run(scenario())
+    assert session.get_metrics()["num_frames"] == 8
+    assert session.get_metrics()["num_turn_steps"] == 2
+
+
+class SlowDialogBridge(FakeDialogBridge):
+    """応答生成 (LLM) に時間がかかる対話"""
+
+    def __init__(self):
+        super().__init__(asr_done_at=0)
+        self.release = asyncio.Event()
+
+    async def __call__(self, ws, asr_bridge, tts_bridge, **kwargs):
+        self.n_frames += 1
+        await self.release.wait()
+        return {"asr_done": False}
+
+
+def test_media_is_ingested_while_turn_is_processing():
+    FakeASRBridge.instances = []
+    session = make_session([])
+    session.dialog_bridge = dialog_bridge = SlowDialogBridge()
+
+    async def scenario():
+        await session.start()
+        for _ in range(10):
+            assert await session.handle_event(media_event())
+            await settle()
+        # ターンの処理が終わっていなくても、フレームはASRへ送り続ける
+        assert len(session.asr_bridge.chunks) == 10
+        assert dialog_bridge.n_frames == 1
+        dialog_bridge.release.set()
+        await settle()
+        # 処理中に変化した状態は、処理が終わった後にまとめて1回処理する
+        assert dialog_bridge.n_frames == 2
+        await session.close()
+
+    asyncio.run(scenario())
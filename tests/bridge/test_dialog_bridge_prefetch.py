@@ -0,0 +1,67 @@
+import asyncio
+import threading
+import time
+
+from src.bridge.asr_bridge import HypothesisEvent
+from src.bridge.dialog_bridge_with_ic import DialogBridgeWithIntentClassification
+from src.loadtest.stubs import StubDialogueSystem
+
+
+class FakeNLU:
+    def __init__(self):
+        self.parsed = []
+        self.cleared = 0
+        self.release = threading.Event()
+
+    def prefetch(self, text):
+        self.release.wait(2)
+        self.parsed.append(text)
+        if text == "失敗":
+            raise RuntimeError("parse error")
+
+    def clear_prefetch(self):
+        self.cleared += 1
+
+
+def hypothesis(stable_prefix, unstable_tail="", is_final=False):
+    return HypothesisEvent(
+        revision=0,
+        stable_prefix=stable_prefix,
+        unstable_tail=unstable_tail,
+        is_final=is_final,
+        stability=0.0,
+        received_at=time.monotonic(),
+    )
+
+
+def test_stable_prefix_is_parsed_before_end_of_turn():
+    dialogue_system = StubDialogueSystem()
+    dialogue_system.rule_based_sf = nlu = FakeNLU()
+    bridge = DialogBridgeWithIntentClassification(dialogue_system=dialogue_system)
+
+    async def scenario():
+        # 確定部分が伸びるたびに解析する (解析中に届いた結果は最新のものだけを後で解析する)
+        bridge.on_hypothesis(hypothesis("", "明日"))
+        bridge.on_hypothesis(hypothesis("明日の", "19時"))
+        bridge.on_hypothesis(hypothesis("明日の19時", "に"))
+        bridge.on_hypothesis(hypothesis("明日の19時に2名", "で"))
+        bridge.on_hypothesis(hypothesis("明日の19時に2名で", is_final=True))
+        nlu.release.set()
+        await bridge._wait_prefetch("明日の19時に2名で")
+        while not bridge._prefetch_future.done():
+            await asyncio.sleep(0.01)
+        assert nlu.parsed == ["明日の", "明日の19時に2名で"]
+
+        # 解析の例外はログに残し、次の解析を止めない
+        bridge.on_hypothesis(hypothesis("失敗", is_final=True))
+        await asyncio.wait([bridge._prefetch_future])
+        assert isinstance(bridge._prefetch_future.exception(), RuntimeError)
+
+        bridge.reset_turn_taking_status()
+        assert nlu.cleared == 1
+        assert bridge._prefetch_future is None
+        bridge.on_hypothesis(hypothesis("明日の", is_final=True))
+        await asyncio.wait([bridge._prefetch_future])
+        assert nlu.parsed[-1] == "明日の"
+
+    asyncio.run(scenario())
@@ -0,0 +1,61 @@
+import asyncio
+import json
+
+from src.bridge.dialog_bridge_with_ic import DialogBridgeWithIntentClassification
+from src.loadtest.stubs import StubDialogueSystem, StubTTSBridge
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, text):
+        self.sent.append(json.loads(text)["event"])
+
+
+class FakeFirestoreClient:
+    def __init__(self):
+        self.events = []
+
+    def get_timestamp(self):
+        return 0
+
+    def add_conversation_event(self, event_data):
+        self.events.append(event_data)
+
+
+class FakeConversationLogger:
+    def __init__(self):
+        self.entries = []
+
+    def add_log_entry(self, speaker, message):
+        self.entries.append((speaker, message))
+
+
+def test_split_response_is_sent_as_one_utterance():
+    bridge = DialogBridgeWithIntentClassification(dialogue_system=StubDialogueSystem())
+    tts_bridge = StubTTSBridge(tts_latency=0.01, max_parallel=2)
+    tts_bridge.set_connect_info("MZ")
+    ws = FakeWebSocket()
+    firestore_client = FakeFirestoreClient()
+    conversation_logger = FakeConversationLogger()
+
+    async def scenario():
+        loop_task = asyncio.create_task(tts_bridge.async_response_loop())
+        tts_bridge.add_response("19時ですね。2名様でよろしいですか？")
+        for _ in range(100):
+            # markの往復 (bot_speakの解除) がなくても、続きの部分を送る
+            await bridge.send_tts(ws, tts_bridge, firestore_client, conversation_logger)
+            if "mark" in ws.sent:
+                break
+            await asyncio.sleep(0.01)
+        tts_bridge.terminate()
+        await loop_task
+
+    asyncio.run(scenario())
+    assert ws.sent == ["media", "media", "mark"]
+    assert [event["message"] for event in firestore_client.events] == [
+        "19時ですね。2名様でよろしいですか？"
+    ]
+    assert conversation_logger.entries == [("bot", "19時ですね。2名様でよろしいですか？")]
+    assert bridge.bot_speak and not bridge._continuing
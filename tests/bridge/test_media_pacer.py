@@ -0,0 +1,70 @@
+import asyncio
+import base64
+import json
+
+import pytest
+
+from src.bridge.media_pacer import PacedMediaSender
+from src.bridge.tts_bridge import BaseTTSBridge
+
+
+class RecordingWebSocket:
+    def __init__(self):
+        self.messages = []
+
+    async def send_text(self, text):
+        self.messages.append((asyncio.get_running_loop().time(), json.loads(text)))
+
+    def events(self, name):
+        return [m for _, m in self.messages if m["event"] == name]
+
+
+def media_message(seconds):
+    payload = base64.b64encode(b"\x01" * int(8000 * seconds)).decode("ascii")
+    return BaseTTSBridge.get_twilio_media_stream(payload, "MZ1")
+
+
+def test_utterance_is_sent_as_paced_frames_with_marks():
+    async def main():
+        ws = RecordingWebSocket()
+        pacer = PacedMediaSender(frame_ms=20, lead_ms=100, mark_interval_ms=100)
+        tic = asyncio.get_running_loop().time()
+        completed = await pacer.play(ws, "MZ1", "こんにちは", media_message(0.41))
+        return ws, completed, asyncio.get_running_loop().time() - tic
+
+    ws, completed, elapsed = asyncio.run(main())
+    assert completed
+    media = ws.events("media")
+    # 0.41秒 -> 20msのフレーム21個 (最後のフレームは無音で埋める)
+    assert len(media) == 21
+    assert all(len(base64.b64decode(m["media"]["payload"])) == 160 for m in media)
+    assert [m["mark"]["name"] for m in ws.events("mark")] == [f"frame:1:{n}" for n in (5, 10, 15, 20)]
+    # 最初のlead_ms分はすぐに送り、残りは実時間に合わせて送る
+    assert elapsed == pytest.approx(0.42 - 0.1, abs=0.05)
+
+
+def test_stop_halts_output_and_reports_position():
+    async def main():
+        ws = RecordingWebSocket()
+        pacer = PacedMediaSender(frame_ms=20, lead_ms=60)
+        task = asyncio.create_task(pacer.play(ws, "MZ1", "ご予約ですね", media_message(2.0)))
+        await asyncio.sleep(0.2)
+        playback = pacer.stop()
+        heard_ms = playback.heard_ms(asyncio.get_running_loop().time())
+        num_sent = len(ws.events("media"))
+        completed = await task
+        await asyncio.sleep(0.05)
+        # 止めた発話のmarkがclear後に返ってきても無視する
+        assert pacer.on_mark("frame:1:25")
+        return ws, playback, heard_ms, num_sent, completed, pacer
+
+    ws, playback, heard_ms, num_sent, completed, pacer = asyncio.run(main())
+    assert not completed
+    # 止めた後はフレームを送らない
+    assert len(ws.events("media")) == num_sent == playback.frames_sent
+    assert heard_ms == pytest.approx(200, abs=40)
+    # Twilio側に溜まっていて、clearで捨てられるのはlead_ms分 (+1フレーム) まで
+    assert playback.frames_sent * 20 - heard_ms <= 60 + 20
+    assert playback.total_frames == 100
+    assert playback.frames_acked == 0
+    assert pacer.get_metrics()["num_truncated"] == 1
@@ -0,0 +1,47 @@
+import numpy as np
+from pydub import AudioSegment
+
+from src.bridge.slot_audio import build_slot_audio_engine, date_readings, time_readings
+from src.bridge.template_audio_cache import to_twilio_audio
+from src.modules.dialogue.utils.template import templates
+
+
+def synthesize_tone(text):
+    """テキストの長さに比例した音声の前後に無音を付ける (実際の合成音声と同じ形)"""
+    tone = (np.sin(np.arange(len(text) * 800) / 4) * 8000).astype(np.int16)
+    samples = np.concatenate([np.zeros(2000, np.int16), tone, np.zeros(2000, np.int16)])
+    audio = AudioSegment(data=samples.tobytes(), sample_width=2, frame_rate=8000, channels=1)
+    return to_twilio_audio(text, audio, source="synthesized")
+
+
+def test_confirmation_is_spliced_without_synthesis_and_names_fall_back():
+    assert len(date_readings()) == 366
+    assert time_readings()[:3] == ["11時", "11時30分", "12時"]
+    assert "22時30分" in time_readings() and "16時" not in time_readings()
+
+    engine = build_slot_audio_engine(templates["scenes"], synthesize_tone)
+    synthesized = []
+
+    def synthesize(text):
+        synthesized.append(text)
+        return synthesize_tone(text)
+
+    audio = engine.render("5月3日の18時30分に2名様ですね。", synthesize)
+    assert synthesized == []
+    assert audio.source == "spliced"
+    # 前後の無音を除いた断片を、つなぎ目ごとにクロスフェードの分だけ重ねる
+    parts = ["5月3日", "の", "18時30分", "に", "2名様", "ですね。"]
+    expected = sum(len(engine.fragments[part]) for part in parts)
+    assert len(audio.ulaw) == expected - 5 * engine.crossfade
+
+    # 名前を含むテンプレートは、つなぐときにTTSプロバイダで合成する
+    assert not engine.match("5月3日の18時30分に2名様ですね。")[0].has_free_text
+    assert engine.match("田中様ですね。")[0].has_free_text
+    assert engine.render("田中様ですね。", synthesize) is not None
+    assert synthesized == ["田中"]
+
+    # 30分刻みでない時刻は断片がないため、文全体を合成させる
+    assert engine.render("18時45分ですね。", synthesize) is None
+    assert engine.render("他にご用件はございますか？", synthesize) is None
+    metrics = engine.get_metrics()
+    assert (metrics["num_rendered"], metrics["num_free_text"], metrics["num_unmatched"]) == (2, 1, 2)
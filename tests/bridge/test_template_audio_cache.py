@@ -0,0 +1,34 @@
+import json
+
+from pydub import AudioSegment
+
+from src.bridge.template_audio_cache import build_template_audio_cache
+from src.bridge.tts_bridge import BaseTTSBridge
+
+
+def test_cache_matches_runtime_conversion_and_reports_missing():
+    recorded = {"date_1": AudioSegment.silent(duration=500, frame_rate=8000)}
+    labels = {"DATE_1": "ご希望の日付", "TIME_1": "ご希望の時間", "NAME_1": "お名前"}
+    synthesized = []
+
+    def synthesize(text):
+        synthesized.append(text)
+        if text == "お名前":
+            raise RuntimeError("synthesis failed")
+        return AudioSegment.silent(duration=200, frame_rate=16000)
+
+    cache = build_template_audio_cache(recorded, labels, synthesize)
+
+    entry = cache.get("DATE_1")
+    expected = BaseTTSBridge.get_twilio_media_stream(
+        BaseTTSBridge.trans4twilio(recorded["date_1"]), "MZ123"
+    )
+    assert entry.media_message("MZ123") == expected
+    assert json.loads(entry.media_message("MZ123"))["streamSid"] == "MZ123"
+    assert len(entry.ulaw) == 4000
+
+    assert cache.get("time_1").source == "synthesized"
+    assert synthesized == ["ご希望の時間", "お名前"]
+    report = cache.report()
+    assert report["num_entries"] == 2
+    assert report["missing"] == ["name_1"]
@@ -0,0 +1,44 @@
+from pydub import AudioSegment
+
+from src.bridge.tts_cache import TTSCache, make_cache_key
+
+
+def tone(ms):
+    return AudioSegment.silent(duration=ms, frame_rate=8000)
+
+
+def test_cache_key_normalizes_text():
+    key = make_cache_key("voice", "style", "+10%", "19時に２名様で ")
+    assert key == make_cache_key("voice", "style", "+10%", "19時に2名様で")
+    assert key != make_cache_key("voice", "style", "+20%", "19時に2名様で")
+
+
+def test_memory_and_disk_tiers(tmp_path):
+    cache = TTSCache(max_memory_items=1, disk_dir=tmp_path)
+    assert cache.get("a") is None
+    stored = cache.put("a", tone(100))
+    cache.put("b", tone(100))
+
+    # aはメモリから追い出されたがディスクに残っている
+    restored = cache.get("a")
+    assert restored.ulaw == stored.ulaw
+    assert restored.media_message("MZ1") == stored.media_message("MZ1")
+    assert cache.get("a") is restored
+
+    # 別のプロセス (再起動後) からもディスクのキャッシュを使える
+    other = TTSCache(disk_dir=tmp_path)
+    assert other.get("b") is not None
+    assert other.get_metrics()["disk_bytes"] == 1600
+
+    metrics = cache.get_metrics()
+    assert metrics["num_misses"] == 1
+    assert metrics["num_disk_hits"] == 1
+    assert metrics["num_memory_hits"] == 1
+
+
+def test_disk_eviction_by_size(tmp_path):
+    cache = TTSCache(disk_dir=tmp_path, max_disk_bytes=2000)
+    for key in ["a", "b", "c"]:
+        cache.put(key, tone(100))  # 800 bytes each
+    assert len(list(tmp_path.glob("*.ulaw"))) == 2
+    assert cache.get_metrics()["num_evicted_files"] == 1
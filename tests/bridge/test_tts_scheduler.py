@@ -0,0 +1,78 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src.bridge.tts_scheduler import OrderedSynthesisScheduler, SynthesisSlot, split_first_sentence
+
+
+def test_split_first_sentence():
+    assert split_first_sentence("19時ですね。2名様でよろしいですか？") == [
+        "19時ですね。",
+        "2名様でよろしいですか？",
+    ]
+    assert split_first_sentence("承知しました。") == ["承知しました。"]
+    assert split_first_sentence("はい") == ["はい"]
+
+
+def test_audio_is_delivered_in_request_order():
+    delivered = []
+    head_started = threading.Event()
+    scheduler = OrderedSynthesisScheduler(delivered.append, max_parallel=3)
+    latencies = {"a": 0.3, "b": 0.1, "c": 0.05}
+
+    def synthesize(text):
+        slot = scheduler.current_slot
+        if text == "a":
+            # 先頭の途中の出力 (ストリーミング合成のフレーム) はすぐに渡す
+            scheduler.add(slot, "a-first")
+            head_started.set()
+        time.sleep(latencies[text])
+        scheduler.add(slot, text)
+
+    async def main():
+        with ThreadPoolExecutor(3) as executor:
+            tic = time.perf_counter()
+            for text in ["a", "b", "c"]:
+                await scheduler.submit(text, synthesize, executor)
+            while scheduler.num_synthesized < 3:
+                await asyncio.sleep(0.01)
+            return time.perf_counter() - tic
+
+    elapsed = asyncio.run(main())
+    assert delivered == ["a-first", "a", "b", "c"]
+    assert head_started.is_set()
+    # 順に合成した場合 (0.45秒) より短い
+    assert elapsed < 0.4
+    assert scheduler.get_metrics()["max_in_flight"] == 3
+
+
+def test_full_audio_queue_does_not_block_other_synthesis():
+    delivered = []
+    release = threading.Event()
+
+    def deliver(item):
+        # 送信待ちのキューが一杯の状態
+        if item == "a-first":
+            release.wait(5)
+        delivered.append(item)
+
+    scheduler = OrderedSynthesisScheduler(deliver)
+    slots = {text: SynthesisSlot(text) for text in ["a", "b"]}
+    scheduler._slots.extend(slots.values())
+
+    blocked = threading.Thread(target=scheduler.add, args=(slots["a"], "a-first"), daemon=True)
+    blocked.start()
+    time.sleep(0.05)
+    # 他の合成スレッドの出力は、キューの空きを待たずに受け取る
+    tic = time.perf_counter()
+    scheduler.add(slots["b"], "b")
+    slots["b"].done = True
+    scheduler.add(slots["a"], "a")
+    assert time.perf_counter() - tic < 0.1
+    slots["a"].done = True
+    scheduler.flush()
+
+    release.set()
+    blocked.join(timeout=5)
+    assert delivered == ["a-first", "a", "b"]
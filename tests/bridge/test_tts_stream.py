@@ -0,0 +1,39 @@
+import asyncio
+import threading
+
+from src.bridge.tts_stream import FRAME_BYTES, StreamingAudio
+
+
+def test_frames_are_emitted_as_chunks_arrive():
+    async def main():
+        stream = StreamingAudio(asyncio.get_running_loop())
+
+        def synthesize():
+            # SDKのチャンクはフレーム境界と揃っていない
+            for size in [100, 100, 250, 40]:
+                stream.feed(b"\x01" * size)
+            stream.finish()
+
+        thread = threading.Thread(target=synthesize)
+        thread.start()
+        frames = [frame async for frame in stream.frames()]
+        thread.join()
+        return stream, frames
+
+    stream, frames = asyncio.run(main())
+    assert [len(f) for f in frames] == [FRAME_BYTES] * 4
+    # 端数は無音で埋める
+    assert frames[-1].endswith(b"\xff" * (4 * FRAME_BYTES - 490))
+    assert stream.ulaw == b"\x01" * 490
+    assert stream.first_frame_at is not None
+
+
+def test_cancel_stops_iteration():
+    async def main():
+        stream = StreamingAudio(asyncio.get_running_loop())
+        stream.feed(b"\x01" * FRAME_BYTES)
+        stream.cancel()
+        stream.feed(b"\x01" * FRAME_BYTES)
+        return [frame async for frame in stream.frames()]
+
+    assert asyncio.run(main()) == []
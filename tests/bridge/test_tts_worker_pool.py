@@ -0,0 +1,64 @@
+import threading
+
+from src.bridge.tts_worker_pool import TTSPriority, TTSWorkerPool, classify_priority
+
+
+def test_jobs_run_in_priority_order():
+    pool = TTSWorkerPool(max_workers=1)
+    started = threading.Event()
+    release = threading.Event()
+    order = []
+
+    def blocker():
+        started.set()
+        release.wait(5)
+
+    first = pool.submit(blocker)
+    started.wait(5)
+    futures = [
+        pool.submit(order.append, "faq", priority=TTSPriority.LONG),
+        pool.submit(order.append, "confirm", priority=TTSPriority.SHORT),
+        pool.submit(order.append, "greeting", priority=TTSPriority.GREETING),
+        pool.submit(order.append, "confirm2", priority=TTSPriority.SHORT),
+    ]
+    assert pool.get_metrics()["queue_depth"] == 4
+    release.set()
+    for future in [first, *futures]:
+        future.result(5)
+    assert order == ["greeting", "confirm", "confirm2", "faq"]
+    metrics = pool.get_metrics()
+    assert metrics["num_completed"] == 5
+    assert metrics["high_watermark"] == 4
+    assert metrics["wait_sec"]["long"]["count"] >= 1
+    pool.shutdown()
+
+
+def test_provider_limit_does_not_block_other_providers():
+    pool = TTSWorkerPool(max_workers=3, provider_limits={"azure": 1})
+    started = threading.Event()
+    release = threading.Event()
+
+    def synthesize():
+        started.set()
+        release.wait(5)
+        return "azure"
+
+    first = pool.submit(synthesize, provider="azure")
+    started.wait(5)
+    second = pool.submit(lambda: "azure", provider="azure", priority=TTSPriority.GREETING)
+    # azureの上限に達していても、テンプレート発話は空いているワーカーで実行する
+    assert pool.submit(lambda: "template", provider="template").result(5) == "template"
+    metrics = pool.get_metrics()
+    assert metrics["running_by_provider"]["azure"] == 1
+    assert metrics["queue_depth_by_provider"]["azure"] == 1
+    assert not second.done()
+
+    release.set()
+    assert first.result(5) == "azure" and second.result(5) == "azure"
+    pool.shutdown()
+
+
+def test_classify_priority():
+    assert classify_priority("INITIAL_1", is_template=True) is TTSPriority.GREETING
+    assert classify_priority("5月3日の18時に2名様ですね。") is TTSPriority.SHORT
+    assert classify_priority("営業時間は午前11時から23時までとなっております。ラストオーダーは22時30分です。") is TTSPriority.LONG
@@ -0,0 +1,42 @@
+import pytest
+
+from src.modules.model_registry import ModelRegistry
+
+
+def test_resource_is_loaded_once():
+    registry = ModelRegistry()
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return object()
+
+    registry.register("dummy", loader)
+    assert not registry.is_loaded("dummy")
+
+    first = registry.get("dummy")
+    second = registry.get("dummy")
+    assert first is second
+    assert len(calls) == 1
+    assert registry.is_loaded("dummy")
+
+
+def test_warmup_and_report():
+    registry = ModelRegistry()
+    registry.register("a", lambda: [0] * 1000)
+    registry.register("b", lambda: "b")
+
+    registry.warmup(["a"])
+    report = registry.report()
+    assert list(report.keys()) == ["a"]
+    assert report["a"]["load_seconds"] >= 0
+    assert "rss_delta_bytes" in report["a"]
+
+    registry.warmup()
+    assert set(registry.report().keys()) == {"a", "b"}
+
+
+def test_unknown_resource():
+    registry = ModelRegistry()
+    with pytest.raises(KeyError):
+        registry.get("missing")
@@ -0,0 +1,33 @@
+from src.utils.admission import AdmissionController
+
+
+class FakeSession:
+    def queue_depths(self):
+        return {"asr": 2, "tts_text": 1, "tts_audio": 0}
+
+
+def test_rejects_above_max_calls():
+    controller = AdmissionController(max_calls=2)
+    assert controller.try_admit("CA1")
+    assert controller.try_admit("CA2")
+    # WebSocket接続前の予約も枠として数える
+    assert not controller.try_admit("CA3")
+
+    controller.register("CA1", FakeSession())
+    controller.register("CA2", FakeSession())
+    load = controller.get_load()
+    assert load["active_calls"] == 2
+    assert load["reserved_calls"] == 0
+    assert load["queue_depths"] == {"asr": 4, "tts_text": 2, "tts_audio": 0}
+    assert load["num_rejected"] == 1
+
+    controller.unregister("CA1")
+    assert controller.try_admit("CA4")
+
+
+def test_rejects_while_loop_lag_is_high():
+    controller = AdmissionController(max_loop_lag=0.1)
+    controller.loop_lag = 0.5
+    assert not controller.try_admit("CA1")
+    controller.loop_lag = 0.01
+    assert controller.try_admit("CA1")
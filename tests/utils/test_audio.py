@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+from src.utils.audio import encode_twilio_ulaw, lin2ulaw, resample_poly, ulaw_decode
+
+
+def tone(freq, sample_rate, seconds=0.5, amplitude=10000):
+    t = np.arange(int(sample_rate * seconds)) / sample_rate
+    return (np.sin(2 * np.pi * freq * t) * amplitude).astype(np.int16)
+
+
+def test_lin2ulaw_matches_audioop_for_every_sample():
+    audioop = pytest.importorskip("audioop")
+    samples = np.arange(-32768, 32768, dtype=np.int16)
+    assert lin2ulaw(samples) == audioop.lin2ulaw(samples.tobytes(), 2)
+
+
+@pytest.mark.parametrize("sample_rate", [16000, 24000, 22050])
+def test_resample_keeps_speech_band_and_removes_aliases(sample_rate):
+    passband = resample_poly(tone(1000, sample_rate), sample_rate, 8000)
+    assert len(passband) == 4000
+    # 先頭・末尾はフィルタの立ち上がりを含むため、中央で振幅を比べる
+    assert np.abs(passband[500:-500]).max() == pytest.approx(10000, rel=0.02)
+
+    # 8kHzのナイキスト周波数 (4kHz) を超える成分は折り返さずに除く
+    alias = resample_poly(tone(5000, sample_rate), sample_rate, 8000)
+    assert np.abs(alias[500:-500]).max() < 100
+
+
+def test_encode_twilio_ulaw_clips_before_encoding():
+    samples = np.array([0, 32767, -32768, 1000], dtype=np.int16)
+    decoded = ulaw_decode(encode_twilio_ulaw(samples, 8000))
+    assert np.abs(decoded).max() <= 30000 * 1.05
+    assert len(encode_twilio_ulaw(tone(440, 16000), 16000)) == 4000
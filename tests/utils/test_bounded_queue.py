@@ -0,0 +1,29 @@
+import queue
+
+import pytest
+
+from src.utils.bounded_queue import BoundedQueue, OverflowPolicy
+
+
+def test_drop_oldest_keeps_latest_items():
+    q = BoundedQueue(3, OverflowPolicy.DROP_OLDEST)
+    for i in range(5):
+        q.put(i, block=False)
+    assert [q.get_nowait() for _ in range(3)] == [2, 3, 4]
+    assert q.num_dropped == 2
+    assert q.high_watermark == 3
+    for _ in range(3):
+        q.task_done()
+    # 捨てた要素の分の未完了タスクが残らない
+    q.join()
+
+
+def test_block_policy_waits_and_counts_overflow():
+    q = BoundedQueue(1, OverflowPolicy.BLOCK)
+    q.put("a")
+    with pytest.raises(queue.Full):
+        q.put("b", timeout=0.01)
+    assert not q.offer("c")
+    assert q.get_metrics()["num_blocked"] == 1
+    assert q.get_metrics()["num_rejected"] == 2
+    assert q.get_nowait() == "a"
@@ -0,0 +1,137 @@
+import threading
+
+from src.utils.firestore import FirestoreClient, FirestoreEventWriter
+
+
+class FakeBatch:
+    def __init__(self, client):
+        self.client = client
+        self.writes = []
+
+    def set(self, document_ref, data):
+        self.writes.append((document_ref, data))
+
+    def commit(self):
+        with self.client.lock:
+            self.client.commits.append(self.writes)
+
+
+class FakeDocumentRef:
+    def __init__(self, path):
+        self.path = path
+
+    def collection(self, name):
+        return self
+
+    def document(self, name):
+        return FakeDocumentRef(f"{self.path}/{name}")
+
+
+class FakeClient:
+    def __init__(self):
+        self.commits = []
+        self.lock = threading.Lock()
+
+    def batch(self):
+        return FakeBatch(self)
+
+
+def test_events_are_batched_in_order():
+    client = FakeClient()
+    writer = FirestoreEventWriter(client, batch_size=3, flush_interval=10)
+    writer.start()
+    for i in range(7):
+        writer.enqueue(f"conversation/events/{i}", {"message": i})
+    writer.flush().result(timeout=5)
+
+    written = [data["message"] for commit in client.commits for _, data in commit]
+    assert written == list(range(7))
+    assert max(len(commit) for commit in client.commits) <= 3
+    assert writer.num_written == 7
+    assert writer.get_metrics()["queue_depth"] == 0
+    writer.stop()
+
+
+def test_stop_drains_queue():
+    client = FakeClient()
+    writer = FirestoreEventWriter(client, batch_size=50, flush_interval=10)
+    writer.start()
+    for i in range(5):
+        writer.enqueue(f"conversation/events/{i}", {"message": i})
+    writer.stop()
+
+    assert sum(len(commit) for commit in client.commits) == 5
+    assert writer.flush().done()
+
+
+def test_events_before_conversation_ref_are_buffered():
+    client = FakeClient()
+    writer = FirestoreEventWriter(client, batch_size=50, flush_interval=10)
+    writer.start()
+    firestore_client = FirestoreClient.__new__(FirestoreClient)
+    firestore_client.conversation_ref = None
+    firestore_client.event_writer = writer
+    firestore_client._event_sequence = 0
+    firestore_client._pending_events = []
+
+    firestore_client.add_conversation_event({"message": "greeting"})
+    assert writer.queue_depth == 0
+    assert firestore_client.num_pending_events == 1
+
+    firestore_client.set_conversation_ref(FakeDocumentRef("project"), "conversation")
+    assert firestore_client.num_pending_events == 0
+    firestore_client.add_conversation_event({"message": "user"})
+    writer.flush().result(timeout=5)
+
+    written = [data for commit in client.commits for _, data in commit]
+    assert [data["message"] for data in written] == ["greeting", "user"]
+    assert [data["sequence"] for data in written] == [0, 1]
+    writer.stop()
+
+
+def test_flush_waits_only_for_its_conversation():
+    client = FakeClient()
+    writer = FirestoreEventWriter(client, batch_size=50, flush_interval=10)
+    writer.start()
+    for i in range(5):
+        writer.enqueue(f"other/events/{i}", {"message": i}, key="other")
+    writer.enqueue("mine/events/0", {"message": "bye"}, key="mine")
+
+    # 他の通話のイベントはflush_intervalまで待たせたまま、この通話のイベントだけをコミットする
+    writer.flush("mine").result(timeout=5)
+    written = [data["message"] for commit in client.commits for _, data in commit]
+    assert written == ["bye"]
+    assert writer.queue_depth == 5
+
+    writer.flush().result(timeout=5)
+    written = [data["message"] for commit in client.commits for _, data in commit]
+    assert written == ["bye", 0, 1, 2, 3, 4]
+    writer.stop()
+
+
+def test_events_with_same_timestamp_are_read_in_sequence_order():
+    class FakeSnapshot:
+        def __init__(self, data):
+            self.data = data
+
+        def to_dict(self):
+            return self.data
+
+    class FakeQuery:
+        def __init__(self, events):
+            self.events = events
+
+        def collection(self, name):
+            return self
+
+        def order_by(self, field):
+            return FakeQuery(sorted(self.events, key=lambda data: data[field]))
+
+        def stream(self):
+            return [FakeSnapshot(data) for data in self.events]
+
+    # 同じバッチで書き込んだイベントは同じcreated_atになる
+    events = [{"created_at": 1, "sequence": 2}, {"created_at": 1, "sequence": 1}, {"created_at": 0}]
+    firestore_client = FirestoreClient.__new__(FirestoreClient)
+    read = firestore_client.get_conversation_events(FakeQuery(events))
+    assert [(data["created_at"], data.get("sequence")) for data in read] == [(0, None), (1, 1), (1, 2)]
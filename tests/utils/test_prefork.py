@@ -0,0 +1,25 @@
+import gc
+
+from src.modules.model_registry import model_registry
+from src.utils.prefork import PreforkServer
+
+
+def test_preload_with_default_warmup_models(monkeypatch):
+    loaded = []
+
+    def stub_loader(name):
+        return lambda: loaded.append(name) or name
+
+    # 登録済みの名前はそのままにして、重いロードだけを置き換える
+    monkeypatch.setattr(
+        model_registry, "_loaders", {name: stub_loader(name) for name in model_registry._loaders}
+    )
+    monkeypatch.setattr(model_registry, "_resources", {})
+    monkeypatch.setattr(model_registry, "_stats", {})
+
+    server = PreforkServer(app="fastapi:FastAPI", host="127.0.0.1", port=0, workers=1)
+    try:
+        server.preload()
+    finally:
+        gc.unfreeze()
+    assert loaded == ["ginza", "template_audio", "template_media"]